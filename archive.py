@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Game archive: many traces in one memory-mapped file.
+
+Traces are replayed once when they are added to the archive. The archive
+then stores per-game and per-move data in columns, and indexes every
+position reached by its digest (sarena.percepts_digest), so that questions
+like "which games went through this position" are answered without
+unpickling or replaying any trace.
+
+File layout (little-endian, every section aligned on 8 bytes):
+    header           ARCHIVE_MAGIC, version, numbers of games, moves,
+                     indexed positions and bytes of boards, offsets of
+                     the sections
+    move_start       u32[games + 1]  first move of each game in moves
+    scores           i32[games]      final score of each game
+    flags            u32[games]      FLAG_FORFEIT if the game ended early,
+                                     FLAG_INCOMPLETE if its trace stopped
+                                     before the end (score 0)
+    board_start      u32[games + 1]  initial board of each game in boards
+    moves            u16[moves]      action codes (sarena.action_to_code)
+    times            f32[moves]      time taken for each move
+    boards           bytes           initial boards (sarena.pack_percepts)
+    index_digests    u64[positions]  sorted digests of the positions
+    index_games      u32[positions]  game of each indexed position
+    index_steps      u32[positions]  step at which it was reached
+
+"""
+
+import bisect
+import mmap
+import struct
+import sys
+from array import array
+
+from sarena import *
+
+ARCHIVE_MAGIC = b"SRNA"
+ARCHIVE_VERSION = 1
+FLAG_FORFEIT = 1
+FLAG_INCOMPLETE = 2
+
+# name, array typecode
+COLUMNS = (("move_start", "I"), ("scores", "i"), ("flags", "I"),
+           ("board_start", "I"), ("moves", "H"), ("times", "f"),
+           ("boards", "B"), ("index_digests", "Q"), ("index_games", "I"),
+           ("index_steps", "I"))
+HEADER = struct.Struct("<4sIIIII" + "Q" * len(COLUMNS))
+
+
+def position_digest(board):
+    """Return the key under which a Board is indexed."""
+    return board.digest()
+
+
+class ArchiveWriter:
+
+    """Collect traces and write them as an archive."""
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in COLUMNS}
+        self.columns["move_start"].append(0)
+        self.columns["board_start"].append(0)
+
+    @classmethod
+    def from_archive(cls, archive):
+        """Return a writer already containing all games of archive."""
+        writer = cls()
+        for name, code in COLUMNS:
+            writer.columns[name] = array(code, archive.columns[name])
+        return writer
+
+    def __len__(self):
+        return len(self.columns["scores"])
+
+    def add(self, trace):
+        """Add a Trace (or TraceReader) to the archive.
+
+        The positions of an incomplete TraceReader are indexed, but the game
+        is flagged FLAG_INCOMPLETE and has no outcome.
+
+        """
+        c = self.columns
+        game = len(self)
+        board = trace.get_initial_board()
+        c["boards"].extend(pack_percepts(board.m))
+        c["board_start"].append(len(c["boards"]))
+        index = [(position_digest(board), 0)]
+        for step, (action, t) in enumerate(trace.actions, 1):
+            board.play_action(action)
+            c["moves"].append(action_to_code(action, board.columns))
+            c["times"].append(t)
+            index.append((position_digest(board), step))
+        c["move_start"].append(len(c["moves"]))
+        c["scores"].append(trace.score)
+        if not getattr(trace, "complete", True):
+            c["flags"].append(FLAG_INCOMPLETE)
+        else:
+            c["flags"].append(FLAG_FORFEIT if trace.reason else 0)
+        for digest, step in index:
+            c["index_digests"].append(digest)
+            c["index_games"].append(game)
+            c["index_steps"].append(step)
+
+    def write(self, filename):
+        """Write the archive to filename, sorting the position index."""
+        c = self.columns
+        order = sorted(range(len(c["index_digests"])),
+                       key=c["index_digests"].__getitem__)
+        for name in ("index_digests", "index_games", "index_steps"):
+            column = c[name]
+            c[name] = array(column.typecode, (column[k] for k in order))
+        sections = []
+        offset = HEADER.size
+        for name, code in COLUMNS:
+            offset = (offset + 7) & ~7
+            sections.append(offset)
+            offset += len(c[name]) * c[name].itemsize
+        with open(filename, "wb") as f:
+            f.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, len(self),
+                                len(c["moves"]), len(c["index_digests"]),
+                                len(c["boards"]), *sections))
+            for (name, code), start in zip(COLUMNS, sections):
+                f.write(bytes(start - f.tell()))
+                column = c[name]
+                if sys.byteorder != "little":
+                    column = array(code, column)
+                    column.byteswap()
+                f.write(column.tobytes())
+
+
+class Archive:
+
+    """An archive file opened for queries.
+
+    The columns are memoryviews (or arrays on big-endian machines) named as
+    in the module documentation.
+
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_games, n_moves, n_positions, n_bytes, \
+            *sections = HEADER.unpack_from(self.data)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            raise ValueError("not a game archive")
+        lengths = {"move_start": self.n_games + 1, "scores": self.n_games,
+                   "flags": self.n_games, "board_start": self.n_games + 1,
+                   "moves": n_moves, "times": n_moves, "boards": n_bytes,
+                   "index_digests": n_positions, "index_games": n_positions,
+                   "index_steps": n_positions}
+        self.view = memoryview(self.data)
+        self.columns = {}
+        for (name, code), start in zip(COLUMNS, sections):
+            size = array(code).itemsize
+            column = self.view[start:start + lengths[name] * size].cast(code)
+            if sys.byteorder != "little":
+                column = array(code, column)
+                column.byteswap()
+            self.columns[name] = column
+
+    def __len__(self):
+        return self.n_games
+
+    def close(self):
+        for name in list(self.columns):
+            column = self.columns.pop(name)
+            if isinstance(column, memoryview):
+                column.release()
+        self.view.release()
+        self.data.close()
+
+    def initial_board(self, game):
+        """Return the initial Board of a game."""
+        start = self.columns["board_start"][game]
+        return Board(unpack_percepts(self.columns["boards"][start:]))
+
+    def actions(self, game):
+        """Return the list of (action, time) of a game."""
+        start = self.columns["move_start"][game]
+        end = self.columns["move_start"][game + 1]
+        columns = len(self.initial_board(game).m[0])
+        moves = self.columns["moves"]
+        times = self.columns["times"]
+        return [(code_to_action(moves[k], columns), times[k])
+                for k in range(start, end)]
+
+    def score(self, game):
+        return self.columns["scores"][game]
+
+    def flags(self, game):
+        return self.columns["flags"][game]
+
+    def find(self, position):
+        """Return the (game, step) pairs at which position was reached.
+
+        position is a Board or a digest as returned by position_digest.
+
+        """
+        if isinstance(position, Board):
+            position = position_digest(position)
+        digests = self.columns["index_digests"]
+        lo = bisect.bisect_left(digests, position)
+        hi = bisect.bisect_right(digests, position, lo)
+        games = self.columns["index_games"]
+        steps = self.columns["index_steps"]
+        return [(games[k], steps[k]) for k in range(lo, hi)]
+
+    def move_stats(self, position=None):
+        """Return outcome statistics per move played from a position.
+
+        If position is None, statistics are given for the first move of all
+        games. The result maps each action to a dictionary with the number
+        of games, of yellow wins, red wins and draws and the mean score.
+        Incomplete games have no outcome and are left out.
+
+        """
+        if position is None:
+            hits = [(game, 0) for game in range(self.n_games)]
+        else:
+            hits = self.find(position)
+        move_start = self.columns["move_start"]
+        moves = self.columns["moves"]
+        scores = self.columns["scores"]
+        flags = self.columns["flags"]
+        stats = {}
+        for game, step in hits:
+            if flags[game] & FLAG_INCOMPLETE:
+                continue
+            k = move_start[game] + step
+            if k >= move_start[game + 1]:
+                continue  # the game ended in this position
+            s = stats.setdefault(moves[k], [0, 0, 0, 0, 0, game])
+            score = scores[game]
+            s[0] += 1
+            s[1 if score > 0 else 2 if score < 0 else 3] += 1
+            s[4] += score
+        result = {}
+        for code, (n, yellow, red, draws, total, game) in stats.items():
+            columns = len(self.initial_board(game).m[0])
+            result[code_to_action(code, columns)] = {
+                "games": n, "yellow": yellow, "red": red, "draws": draws,
+                "mean_score": total / n}
+        return result
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+    from optparse import OptionParser
+    from game import load_trace, TraceReader
+    parser = OptionParser(usage="Usage: %prog build ARCHIVE TRACE...\n" +
+                                "       %prog add ARCHIVE TRACE...\n" +
+                                "       %prog find ARCHIVE BOARD_FILE\n" +
+                                "       %prog openings ARCHIVE [BOARD_FILE]",
+                          description="Build and query game archives." +
+                          " TRACE may be a directory of traces.")
+    (options, args) = parser.parse_args()
+    if len(args) < 2 or args[0] not in ("build", "add", "find", "openings"):
+        parser.error("invalid command")
+    command, filename = args[0], args[1]
+    if command in ("build", "add"):
+        if command == "add" and os.path.exists(filename):
+            archive = Archive(filename)
+            writer = ArchiveWriter.from_archive(archive)
+            archive.close()
+        else:
+            writer = ArchiveWriter()
+        for arg in args[2:]:
+            files = sorted(glob.glob(os.path.join(arg, "*"))) \
+                if os.path.isdir(arg) else [arg]
+            for trace_file in files:
+                trace = load_trace(trace_file)
+                try:
+                    writer.add(trace)
+                finally:
+                    if isinstance(trace, TraceReader):
+                        trace.close()
+        writer.write(filename)
+        print("%d games in %s" % (len(writer), filename))
+    else:
+        archive = Archive(filename)
+        position = None
+        if len(args) > 2:
+            position = Board(load_percepts(args[2]))
+        if command == "find":
+            if position is None:
+                parser.error("need a board file")
+            for game, step in archive.find(position):
+                if archive.flags(game) & FLAG_INCOMPLETE:
+                    print("game %d step %d incomplete" % (game, step))
+                else:
+                    print("game %d step %d score %d" %
+                          (game, step, archive.score(game)))
+        else:
+            stats = archive.move_stats(position)
+            print("action        games  yellow  red  draws  mean score")
+            for action, s in sorted(stats.items(),
+                                    key=lambda a_s: -a_s[1]["games"]):
+                print("%-12s %6d  %6d  %3d  %5d  %10.2f" %
+                      (action, s["games"], s["yellow"], s["red"], s["draws"],
+                       s["mean_score"]))
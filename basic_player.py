@@ -7,7 +7,6 @@ import random
 
 from sarena import *
 import minimax
-import time
 
 class AlphaBetaPlayer(Player, minimax.Game):
     def __init__(self):
@@ -17,13 +16,18 @@ class AlphaBetaPlayer(Player, minimax.Game):
         for action in board.get_actions():
             new_board = board.clone()
             new_board.play_action(action)
-            self.nodes += 1
             yield action, new_board
 
     def cutoff(self, board, depth):
         # TODO: remove depth limitation
         return depth >= 2 or board.is_finished()
 
+    def expand(self, board, depth):
+        # a finished board has no successors, no need to test it first
+        if depth >= 2:
+            return True, ()
+        return False, self.successors(board)
+
     def evaluate(self, board):
         score = board.get_score()
 
@@ -39,17 +43,18 @@ class AlphaBetaPlayer(Player, minimax.Game):
     def play(self, percepts, step, time_left):
         # We are always the yellow player
         board = Board(percepts)
-        nodes_before = self.nodes
-        t0 = time.clock()
-        result = minimax.search(board, self)
-        # result = minimax.search(board, self, prune=False)
-        t1 = time.clock()
-        print("Nodes visited:", self.nodes-nodes_before);
-        print("Time required:", t1-t0)
+        stats = minimax.SearchStats() if self.collect_metrics else None
+        result = minimax.search(board, self, stats=stats)
+        # result = minimax.search(board, self, prune=False, stats=stats)
+        if stats is not None:
+            self.nodes += stats.total_nodes()
+            self.metrics = stats.metrics()
+            print(stats)
         print("Result: ", result)
         return result
 
 if __name__ == "__main__":
     player = AlphaBetaPlayer()
     player_main(player)
-    print("Total number of nodes visited:", player.nodes)
+    if player.collect_metrics:
+        print("Total number of nodes visited:", player.nodes)
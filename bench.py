@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search benchmark on a fixed corpus of positions.
+
+The corpus (bench_positions.txt) holds opening, middlegame and endgame
+positions, one per line:
+
+    name phase step packed-percepts-in-hex
+
+The percepts are seen by the player to move, as in Player.play. Every
+engine searches each position to a fixed depth and for a fixed time. The
+nodes, nodes per second, depth reached, best move and wall time are printed
+and appended, with the current git revision, to a history file so that
+regressions between versions can be spotted.
+
+With --alloc, the fixed-depth searches are instead run under tracemalloc to
+report the allocations and the bytes allocated per visited node, by
+function, temporaries included. Allocations in the inner loop mean garbage
+collection pauses in timed games, so budgets of allocations and of bytes
+per node can be given to make the benchmark fail when one is exceeded.
+
+With --selective, SuperPlayer searches each position with and without
+its selective search options (late move reductions, futility pruning): the
+nodes and times at a fixed depth, whether the moves agree, how much worse
+the selective move is according to the full search, and the depths reached
+in the fixed time are compared.
+
+"""
+
+import ast
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from sarena import *
+import minimax
+from super_player import State, SuperPlayer, negamax, iterative_deepening
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "bench_positions.txt")
+HISTORY = "bench_history.jsonl"
+SELECTIVE = ("lmr", "futility")  # SuperPlayer selective search options
+
+# phase, steps of the positions and number of positions per step
+PHASES = (("opening", (1, 2), 2), ("middlegame", (11, 12), 2),
+          ("endgame", (21, 22), 2))
+
+
+def minimax_engines():
+    """Return the minimax.Game players by name."""
+    from simple_player import SimplePlayer
+    from eval_player_base import EvalPlayerBase
+    from eval_player_ours import EvalPlayerOurs
+    from basic_player import AlphaBetaPlayer
+    return {"simple": SimplePlayer(), "eval_base": EvalPlayerBase(),
+            "eval_ours": EvalPlayerOurs(), "alphabeta": AlphaBetaPlayer()}
+
+
+ENGINES = ("simple", "eval_base", "eval_ours", "alphabeta", "super")
+
+
+def load_corpus(filename=CORPUS):
+    """Return the corpus as a list of (name, phase, step, percepts)."""
+    corpus = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                name, phase, step, packed = line.split()
+                corpus.append((name, phase, int(step),
+                               unpack_percepts(bytes.fromhex(packed))))
+    return corpus
+
+
+def make_corpus(filename=CORPUS):
+    """Write a new corpus of positions reached by seeded random games."""
+    with open(filename, "w") as f:
+        f.write("# name phase step packed-percepts (see bench.py)\n")
+        for phase, steps, count in PHASES:
+            for step in steps:
+                for seed in range(count):
+                    rnd = random.Random("%s-%d-%d" % (phase, step, seed))
+                    while True:
+                        random.seed(rnd.random())
+                        board = Board(random_board())
+                        for k in range(step - 1):
+                            actions = list(board.get_actions())
+                            if not actions:
+                                break
+                            board.play_action(rnd.choice(actions))
+                        else:
+                            if not board.is_finished():
+                                break
+                    packed = pack_percepts(board.m, step % 2 == 0)
+                    f.write("%s-%d-%d %s %d %s\n" % (phase, step, seed, phase,
+                                                     step, packed.hex()))
+
+
+class SearchTimeout(Exception):
+    """Raised when a fixed-time search of a minimax player is over."""
+
+
+class FixedDepthGame(minimax.Game):
+
+    """Run the evaluation of a minimax player to a fixed depth.
+
+    It raises SearchTimeout after stop_time.
+
+    """
+
+    def __init__(self, game, depth, stop_time=None):
+        self.game = game
+        self.depth = depth
+        self.stop_time = stop_time
+
+    def successors(self, state):
+        if self.stop_time is not None and time.time() >= self.stop_time:
+            raise SearchTimeout()
+        return self.game.successors(state)
+
+    def cutoff(self, state, depth):
+        return depth >= self.depth or state.is_finished()
+
+    def expand(self, state, depth):
+        if depth >= self.depth:
+            return True, ()
+        return False, self.successors(state)
+
+    def evaluate(self, state):
+        return self.game.evaluate(state)
+
+
+def search_minimax(game, percepts, depth=None, seconds=None):
+    """Search with a minimax player and return (nodes, depth, action).
+
+    With depth, search to that depth. With seconds, deepen iteratively
+    until the time is over.
+
+    """
+    board = Board(percepts)
+    stats = minimax.SearchStats()
+    if depth is not None:
+        g = FixedDepthGame(game, depth)
+        action = minimax.search(board, g, stats=stats)
+        return stats.total_nodes(), depth, action
+    stop_time = time.time() + seconds
+    action = None
+    depth = 0
+    while not board.is_finished():
+        g = FixedDepthGame(game, depth + 1, stop_time)
+        try:
+            action = minimax.search(board, g, stats=stats)
+        except SearchTimeout:
+            break
+        depth += 1
+        if len(stats.nodes) <= depth:
+            break  # the whole game tree was searched
+    return stats.total_nodes(), depth, action
+
+
+def search_super(percepts, depth=None, seconds=None):
+    """Search with SuperPlayer and return (nodes, depth, action).
+
+    depth and seconds are as for search_minimax.
+
+    """
+    state = State.from_percepts(percepts)
+    SuperPlayer().reset()
+    nodes = SuperPlayer.nodes
+    if depth is not None:
+        action = negamax(state, depth, None)
+    else:
+        action, depth = iterative_deepening(state, time.time() + seconds)
+    if action is not None:
+        action = State.to_board_action(action)
+    return SuperPlayer.nodes - nodes, depth, action
+
+
+def selective_search(percepts, depth=None, seconds=None, options=()):
+    """Same as search_super, with the selective search options enabled.
+
+    options is a collection of names of SuperPlayer options, e.g. ("lmr",
+    "futility"). Return (nodes, depth, action, wall time).
+
+    """
+    saved = [(name, getattr(SuperPlayer, name)) for name in SELECTIVE]
+    for name in SELECTIVE:
+        setattr(SuperPlayer, name, name in options)
+    try:
+        start = time.time()
+        nodes, reached, action = search_super(percepts, depth, seconds)
+        return nodes, reached, action, time.time() - start
+    finally:
+        for name, value in saved:
+            setattr(SuperPlayer, name, value)
+
+
+def move_value(percepts, depth, action):
+    """Return the value of a move by a full search to depth."""
+    state = State.from_percepts(percepts)
+    root = [[State.from_board_action(action), None, None]]
+    root[0][1] = State.play(state, root[0][0])
+    negamax(state, depth, None, root)
+    return root[0][2]
+
+
+def compare_selective(corpus, options, depth, seconds):
+    """Compare SuperPlayer with and without the selective search options.
+
+    Return a list of results, one per position.
+
+    """
+    State.setup()
+    results = []
+    for name, phase, step, percepts in corpus:
+        r = {"position": name, "phase": phase}
+        if depth is not None:
+            full = selective_search(percepts, depth)
+            sel = selective_search(percepts, depth, options=options)
+            r.update(full_nodes=full[0], full_time=full[3],
+                     nodes=sel[0], time=sel[3],
+                     agree=full[2] == sel[2], loss=0)
+            if full[2] is not None and full[2] != sel[2]:
+                r["loss"] = move_value(percepts, depth, full[2]) - \
+                    move_value(percepts, depth, sel[2])
+        if seconds is not None:
+            r["full_depth"] = selective_search(percepts, None, seconds)[1]
+            r["depth"] = selective_search(percepts, None, seconds,
+                                          options)[1]
+        results.append(r)
+    return results
+
+
+def print_selective(results, options, depth, seconds):
+    print("Selective search: %s" % ", ".join(options))
+    if depth is not None:
+        print("%-16s %10s %10s %6s %8s %8s %6s %5s" %
+              ("position", "nodes", "selective", "%", "time", "selective",
+               "agree", "loss"))
+        for r in results:
+            print("%-16s %10d %10d %6.1f %8.3f %8.3f %6s %5g" %
+                  (r["position"], r["full_nodes"], r["nodes"],
+                   100.0 * r["nodes"] / max(r["full_nodes"], 1),
+                   r["full_time"], r["time"], "yes" if r["agree"] else "no",
+                   r["loss"]))
+        full = sum(r["full_nodes"] for r in results)
+        nodes = sum(r["nodes"] for r in results)
+        print("depth %d: %d -> %d nodes (%.1f%%), %.3fs -> %.3fs, %d/%d" %
+              (depth, full, nodes, 100.0 * nodes / max(full, 1),
+               sum(r["full_time"] for r in results),
+               sum(r["time"] for r in results),
+               sum(r["agree"] for r in results), len(results)) +
+              " same moves, total loss %g" % sum(r["loss"] for r in results))
+    if seconds is not None:
+        n = max(len(results), 1)
+        print("%gs: mean depth %.2f -> %.2f" %
+              (seconds, sum(r["full_depth"] for r in results) / n,
+               sum(r["depth"] for r in results) / n))
+
+
+def run(corpus, engines, depth, seconds):
+    """Run the benchmark and return the list of results."""
+    State.setup()
+    games = minimax_engines()
+    results = []
+    for name, phase, step, percepts in corpus:
+        for engine in engines:
+            for mode, limit in (("depth", depth), ("time", seconds)):
+                if limit is None:
+                    continue
+                d = limit if mode == "depth" else None
+                t = limit if mode == "time" else None
+                start = time.time()
+                if engine == "super":
+                    nodes, reached, action = search_super(percepts, d, t)
+                else:
+                    nodes, reached, action = search_minimax(games[engine],
+                                                            percepts, d, t)
+                wall = time.time() - start
+                results.append({
+                    "position": name, "phase": phase, "engine": engine,
+                    "mode": mode, "limit": limit, "nodes": nodes,
+                    "nps": nodes / wall if wall else 0.0, "depth": reached,
+                    "move": list(action) if action is not None else None,
+                    "time": wall})
+    return results
+
+
+_functions = {}
+
+
+def function_at(filename, lineno):
+    """Return "file:function" for the function defining a line of code."""
+    if filename not in _functions:
+        spans = []
+        try:
+            with open(filename) as f:
+                tree = ast.parse(f.read())
+        except (OSError, SyntaxError, ValueError):
+            tree = None
+
+        def visit(node, prefix):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                      ast.ClassDef)):
+                    name = prefix + child.name
+                    spans.append((child.lineno, child.end_lineno, name))
+                    visit(child, name + ".")
+                else:
+                    visit(child, prefix)
+        if tree is not None:
+            visit(tree, "")
+        _functions[filename] = spans
+    name = "<module>"
+    for start, end, function in _functions[filename]:
+        if start <= lineno <= end:
+            name = function  # nested definitions come after their parent
+    return "%s:%s" % (os.path.basename(filename), name)
+
+
+class AllocationProfiler:
+
+    """Count the memory allocated by function calls, by function.
+
+    The profiler is installed with sys.settrace while tracemalloc traces,
+    so that it sees every line executed, a loop running a line at every
+    iteration. At every event, the rise of the peak of traced memory since
+    the previous event is added to the bytes of the function that ran in
+    between, and the memory blocks allocated since then, from
+    sys.getallocatedblocks(), to its allocations. A line allocating and
+    freeing several temporaries only counts as the largest of them, and the
+    blocks are net of those freed, at least one if memory was allocated.
+    Objects taken from the free lists of the interpreter, like the headers
+    of lists and tuples, are not allocated and not counted.
+
+    Tracing creates a frame object just before every call event. It is
+    left out: the memory allocated by the caller is the peak reached before
+    the frame object, which is the memory in use without the frame if the
+    frame object raised the peak.
+
+    Functions of the files in ignore are not accounted for.
+
+    """
+
+    def __init__(self, ignore=()):
+        self.ignore = set(ignore)
+        self.functions = {}  # {function: [allocations, bytes]}
+        self.peak = 0
+        self._names = {}  # {code: function, or None if ignored}
+        self._tracer = self._event  # not a new bound method at every event
+
+    def run(self, f, *args):
+        """Return f(*args), profiling its allocations."""
+        tracemalloc.start()
+        self._start = self._current = tracemalloc.get_traced_memory()[0]
+        self._blocks = sys.getallocatedblocks()
+        sys.settrace(self._tracer)
+        try:
+            return f(*args)
+        finally:
+            sys.settrace(None)
+            tracemalloc.stop()
+
+    def _event(self, frame, event, arg):
+        # the memory is read first and the peak reset last, so that what
+        # the profiler allocates itself is not counted
+        current, peak = tracemalloc.get_traced_memory()
+        blocks = sys.getallocatedblocks() - self._blocks
+        if event == "call":
+            # the memory was allocated by the caller
+            if peak == current:
+                peak = max(current - sys.getsizeof(frame), self._current)
+            blocks -= 1
+            frame = frame.f_back
+        size = peak - self._current
+        code = frame.f_code if frame is not None else None
+        if code not in self._names:
+            self._names[code] = None if code is None or \
+                code.co_filename in self.ignore \
+                else function_at(code.co_filename, code.co_firstlineno)
+        function = self._names[code]
+        if function is not None and size > 0:
+            counts = self.functions.setdefault(function, [0, 0])
+            counts[0] += max(blocks, 1)
+            counts[1] += size
+        self.peak = max(self.peak, peak - self._start)
+        # the locals are freed before the memory is read again
+        del current, peak, blocks, size
+        self._blocks = sys.getallocatedblocks()
+        self._current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self._tracer
+
+
+def alloc_profile(corpus, engines, depth):
+    """Profile the memory allocated by fixed-depth searches.
+
+    All the memory allocated during the searches is accounted for by an
+    AllocationProfiler, the successors and the temporaries of the
+    evaluation included, not only what is still alive at the end.
+
+    Return {engine: (nodes, allocations, bytes, peak, {function:
+    (allocations, bytes)})}, with the peak in bytes being the maximum over
+    the positions of the memory in use during a search.
+
+    """
+    State.setup()
+    games = minimax_engines()
+    ignore = [__file__, tracemalloc.__file__]
+    result = {}
+    for engine in engines:
+        nodes = 0
+        profiler = AllocationProfiler(ignore)
+        for name, phase, step, percepts in corpus:
+            if engine == "super":
+                n, _, _ = profiler.run(search_super, percepts, depth)
+            else:
+                n, _, _ = profiler.run(search_minimax, games[engine],
+                                       percepts, depth)
+            nodes += n
+        functions = {function: tuple(counts)
+                     for function, counts in profiler.functions.items()}
+        blocks = sum(b for b, _ in functions.values())
+        size = sum(s for _, s in functions.values())
+        result[engine] = (nodes, blocks, size, profiler.peak, functions)
+    return result
+
+
+def print_alloc_profile(profile, lines=8):
+    print("%-10s %10s %12s %12s %12s" % ("engine", "nodes", "allocs/node",
+                                         "bytes/node", "peak bytes"))
+    for engine, (nodes, blocks, size, peak, _) in profile.items():
+        print("%-10s %10d %12.1f %12.1f %12d" % (engine, nodes,
+                                                 blocks / max(nodes, 1),
+                                                 size / max(nodes, 1), peak))
+    for engine, (nodes, blocks, size, peak, functions) in profile.items():
+        print()
+        print("%s by function:" % engine)
+        print("%12s %12s %6s  function" % ("allocs/node", "bytes/node", "%"))
+        for function, (b, s) in sorted(functions.items(),
+                                       key=lambda f: -f[1][1])[:lines]:
+            print("%12.2f %12.1f %6.1f  %s" % (b / max(nodes, 1),
+                                               s / max(nodes, 1),
+                                               100.0 * s / max(size, 1),
+                                               function))
+
+
+def revision():
+    """Return the git revision of the working tree, or None."""
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                      stderr=subprocess.DEVNULL)
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"],
+                                stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return rev.decode().strip() + ("-dirty" if dirty else "")
+
+
+def append_history(results, filename=HISTORY):
+    with open(filename, "a") as f:
+        f.write(json.dumps({"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "revision": revision(),
+                            "python": platform.python_version(),
+                            "results": results}) + "\n")
+
+
+def totals(results):
+    """Return {(engine, mode): (nodes, time, mean depth)} for results."""
+    t = {}
+    for r in results:
+        nodes, wall, depth, n = t.get((r["engine"], r["mode"]), (0, 0, 0, 0))
+        t[r["engine"], r["mode"]] = (nodes + r["nodes"], wall + r["time"],
+                                     depth + r["depth"], n + 1)
+    return {k: (nodes, wall, depth / n)
+            for k, (nodes, wall, depth, n) in t.items()}
+
+
+def print_results(results):
+    print("%-16s %-10s %-6s %5s %10s %10s %5s %-14s %8s" %
+          ("position", "engine", "mode", "limit", "nodes", "nodes/s",
+           "depth", "move", "time"))
+    for r in results:
+        print("%-16s %-10s %-6s %5g %10d %10.0f %5d %-14s %8.3f" %
+              (r["position"], r["engine"], r["mode"], r["limit"], r["nodes"],
+               r["nps"], r["depth"], r["move"], r["time"]))
+    print()
+    print_totals(results)
+
+
+def print_totals(results):
+    for (engine, mode), (nodes, wall, depth) in sorted(totals(results).items()):
+        print("%-10s %-6s %10d nodes %8.3fs %10.0f nodes/s depth %.2f" %
+              (engine, mode, nodes, wall, nodes / wall if wall else 0, depth))
+
+
+def print_history(filename=HISTORY):
+    with open(filename) as f:
+        for line in f:
+            run = json.loads(line)
+            print("%s %s" % (run["date"], run["revision"]))
+            print_totals(run["results"])
+            print()
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options]",
+                          description="Benchmark the search of the players" +
+                          " on a fixed corpus of positions.")
+    parser.add_option("-d", "--depth", type="int", dest="depth", default=2,
+                      help="fixed search depth, 0 to skip (default: %default)")
+    parser.add_option("-t", "--time", type="float", dest="time", default=1.0,
+                      help="fixed search time in seconds, 0 to skip" +
+                           " (default: %default)")
+    parser.add_option("-e", "--engine", action="append", dest="engines",
+                      choices=ENGINES, help="engine to benchmark (one of %s;" %
+                      ", ".join(ENGINES) + " may be repeated, default: all)")
+    parser.add_option("--phase", action="append", dest="phases",
+                      choices=[p for p, _, _ in PHASES],
+                      help="only use positions of PHASE (may be repeated)")
+    parser.add_option("--history-file", dest="history", default=HISTORY,
+                      help="history file (default: %default)", metavar="FILE")
+    parser.add_option("--no-history", action="store_false", dest="record",
+                      default=True, help="do not append to the history file")
+    parser.add_option("--show-history", action="store_true", dest="show",
+                      default=False, help="print the totals of past runs")
+    parser.add_option("--make-corpus", action="store_true", dest="make",
+                      default=False, help="regenerate the corpus file")
+    parser.add_option("--alloc", action="store_true", dest="alloc",
+                      default=False, help="profile the memory allocated per" +
+                      " node by the fixed-depth searches instead of timing")
+    parser.add_option("--alloc-budget", type="float", dest="budget",
+                      help="with --alloc, fail if an engine allocates more" +
+                      " than BYTES per visited node", metavar="BYTES")
+    parser.add_option("--alloc-count-budget", type="float",
+                      dest="count_budget", help="with --alloc, fail if an" +
+                      " engine makes more than ALLOCS allocations per" +
+                      " visited node", metavar="ALLOCS")
+    parser.add_option("--selective", action="append", dest="selective",
+                      choices=SELECTIVE, help="compare SuperPlayer with and" +
+                      " without the selective search OPTION (one of %s;" %
+                      ", ".join(SELECTIVE) + " may be repeated) instead of" +
+                      " benchmarking the engines", metavar="OPTION")
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error("no arguments needed")
+    if options.make:
+        make_corpus()
+    elif options.show:
+        print_history(options.history)
+    elif options.selective:
+        corpus = [p for p in load_corpus()
+                  if options.phases is None or p[1] in options.phases]
+        results = compare_selective(corpus, options.selective,
+                                    options.depth or None,
+                                    options.time or None)
+        print_selective(results, options.selective, options.depth or None,
+                        options.time or None)
+    elif options.alloc:
+        corpus = [p for p in load_corpus()
+                  if options.phases is None or p[1] in options.phases]
+        profile = alloc_profile(corpus, options.engines or ENGINES,
+                                options.depth or 2)
+        print_alloc_profile(profile)
+        over = []
+        for engine, (nodes, blocks, size, _, _) in profile.items():
+            if options.count_budget is not None and \
+                    blocks / max(nodes, 1) > options.count_budget:
+                over.append("%s (%.1f allocations per node, budget %g)" %
+                            (engine, blocks / max(nodes, 1),
+                             options.count_budget))
+            if options.budget is not None and \
+                    size / max(nodes, 1) > options.budget:
+                over.append("%s (%.1f bytes per node, budget %g)" %
+                            (engine, size / max(nodes, 1), options.budget))
+        if over:
+            print()
+            print("Allocation budget exceeded by %s" % ", ".join(over))
+            exit(1)
+    else:
+        corpus = [p for p in load_corpus()
+                  if options.phases is None or p[1] in options.phases]
+        results = run(corpus, options.engines or ENGINES,
+                      options.depth or None, options.time or None)
+        print_results(results)
+        if options.record:
+            append_history(results, options.history)
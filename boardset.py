@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Board sets: many initial boards in one memory-mapped file.
+
+Board files (b1.dmp, mini_board.dmp, Board.write) hold one pickled board
+each, so a tournament of thousands of games opens and unpickles thousands
+of files. A board set stores the boards back to back in the packed form of
+Board.pack (sarena.pack_percepts: the size, a byte per cell giving its type
+and height and the tokens as nibbles, 56 bytes for an initial 6x6 board),
+with an index giving the start of each board. Board k is the board of game
+k (see the --board-set option of game.py).
+
+File layout (little-endian):
+    header    BOARDSET_MAGIC, version, number of boards, bytes of boards
+    offsets   u32[boards + 1]  start of each board in boards
+    boards    bytes            the packed boards
+
+"""
+
+import mmap
+import re
+import struct
+import sys
+from array import array
+
+from sarena import *
+
+BOARDSET_MAGIC = b"SRNB"
+BOARDSET_VERSION = 1
+HEADER = struct.Struct("<4sIII")
+
+
+def write_board_set(boards, filename):
+    """Write boards (Board instances or percepts) as a board set file.
+
+    Return the number of boards written.
+
+    """
+    offsets = array("I", [0])
+    data = bytearray()
+    for board in boards:
+        data += board.pack() if isinstance(board, Board) else \
+            pack_percepts(board)
+        offsets.append(len(data))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    write_packed_board_set(offsets, data, filename)
+    return len(offsets) - 1
+
+
+def write_packed_board_set(offsets, data, filename):
+    """Write boards already packed as a board set file.
+
+    offsets -- the boards + 1 offsets of the layout, as a buffer of
+        little-endian u32 (e.g. an array or a NumPy array)
+    data -- the packed boards, as a buffer
+
+    """
+    offsets = memoryview(offsets).cast("B")
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(BOARDSET_MAGIC, BOARDSET_VERSION,
+                            len(offsets) // 4 - 1, memoryview(data).nbytes))
+        f.write(offsets)
+        f.write(data)
+
+
+def board_file_key(filename):
+    """Sort key putting boards/b2.dmp before boards/b10.dmp."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", filename)]
+
+
+class BoardSet:
+
+    """A board set file opened for reading."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.length, size = HEADER.unpack_from(self.data)
+        self.boards = HEADER.size + 4 * (self.length + 1)
+        if magic != BOARDSET_MAGIC or version != BOARDSET_VERSION or \
+                len(self.data) != self.boards + size:
+            self.data.close()
+            raise ValueError("not a board set")
+        self.view = memoryview(self.data)
+        self.offsets = self.view[HEADER.size:self.boards].cast("I")
+        if sys.byteorder != "little":
+            self.offsets = array("I", self.offsets)
+            self.offsets.byteswap()
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, k):
+        """Return a new Board holding board k."""
+        return Board(self.percepts(k))
+
+    def __iter__(self):
+        for k in range(self.length):
+            yield self[k]
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.view.release()
+        self.data.close()
+
+    def packed(self, k):
+        """Return the packed form of board k, as bytes."""
+        if not 0 <= k < self.length:
+            raise IndexError("board %d not in a set of %d" % (k, self.length))
+        start = self.boards + self.offsets[k]
+        return self.data[start:self.boards + self.offsets[k + 1]]
+
+    def percepts(self, k):
+        """Return the percepts of board k."""
+        return unpack_percepts(self.packed(k))
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog build SET BOARD_FILE...\n" +
+                                "       %prog extract SET K BOARD_FILE\n" +
+                                "       %prog info SET",
+                          description="Build board sets from board files" +
+                          " (or directories of them, e.g. boards), or" +
+                          " write board K of a set as a board file.")
+    (options, args) = parser.parse_args()
+    if len(args) < 2 or args[0] not in ("build", "extract", "info") or \
+            (args[0] == "extract" and len(args) != 4) or \
+            (args[0] == "info" and len(args) != 2):
+        parser.error("invalid command")
+    command, filename = args[0], args[1]
+    if command == "build":
+        files = []
+        for arg in args[2:]:
+            files += sorted(glob.glob(os.path.join(arg, "*")),
+                            key=board_file_key) \
+                if os.path.isdir(arg) else [arg]
+        n = write_board_set((load_percepts(f) for f in files), filename)
+        print("%d boards in %s" % (n, filename))
+    else:
+        board_set = BoardSet(filename)
+        if command == "extract":
+            board_set[int(args[2])].write(args[3])
+        else:
+            print("%d boards, %d bytes" % (len(board_set),
+                                           len(board_set.data)))
+        board_set.close()
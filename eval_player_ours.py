@@ -71,7 +71,11 @@ class EvalPlayerOurs(Player, minimax.Game):
     def play(self, percepts, step, time_left):
         # We are always the yellow player
         board = Board(percepts)
-        return minimax.search(board, self)
+        stats = minimax.SearchStats() if self.collect_metrics else None
+        action = minimax.search(board, self, stats=stats)
+        if stats is not None:
+            self.metrics = stats.metrics()
+        return action
 
 if __name__ == "__main__":
     player = EvalPlayerOurs()
@@ -5,8 +5,10 @@ import random
 from sarena import *
 
 class FastPlayer(Player):
+    readonly_percepts = True
+
     def play(self, percepts, step, time_left):
-        board = Board(percepts)
+        board = BoardView(percepts)
         # always play first action
         for action in board.get_actions():
             return action
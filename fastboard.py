@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Flat Sarena board engine.
+
+FastBoard plays by the same rules as sarena.Board but keeps the towers in a
+flat list of tuples of tokens, with the neighbours of every cell computed
+once per board geometry. Heights are tuple lengths, so move generation and
+scoring do not walk the 5-element cells of the percepts.
+
+"""
+
+from sarena import Board, InvalidAction
+
+_geometries = {}
+
+
+def geometry(rows, columns):
+    """Return the neighbours of all cells of a rows x columns board.
+
+    The result is a list giving, for each cell index, a tuple of
+    (neighbour index, action) pairs.
+
+    """
+    key = (rows, columns)
+    if key not in _geometries:
+        neighbors = []
+        for i in range(rows):
+            for j in range(columns):
+                cell = []
+                for di, dj in ((-1, 0), (0, 1), (1, 0), (0, -1)):
+                    i2, j2 = i + di, j + dj
+                    if 0 <= i2 < rows and 0 <= j2 < columns:
+                        cell.append((i2 * columns + j2, (i, j, i2, j2)))
+                neighbors.append(tuple(cell))
+        _geometries[key] = neighbors
+    return _geometries[key]
+
+
+class FastBoard:
+
+    """Sarena board as a flat list of towers.
+
+    Attributes:
+    rows, columns -- the dimensions of the board
+    towers -- list of the towers, cell (i, j) being at index
+        i * columns + j. A tower is a tuple of tokens from bottom to top,
+        and a token a (bottom, top) tuple of colors as in Board.
+    arrows -- tuple of booleans telling whether each cell has arrows
+
+    """
+
+    max_height = Board.max_height
+
+    def __init__(self, percepts=None):
+        if percepts is None:
+            return
+        self.rows = len(percepts)
+        self.columns = len(percepts[0])
+        self.neighbors = geometry(self.rows, self.columns)
+        self.arrows = tuple(cell[0] == 4 for row in percepts for cell in row)
+        self.towers = [tuple(tuple(token) for token in cell[1:]
+                             if token[0] != 0)
+                       for row in percepts for cell in row]
+
+    def clone(self):
+        """Return a clone of this object."""
+        board = FastBoard()
+        board.rows = self.rows
+        board.columns = self.columns
+        board.neighbors = self.neighbors
+        board.arrows = self.arrows
+        board.towers = self.towers[:]
+        return board
+
+    def get_percepts(self):
+        """Return the percepts corresponding to the current state."""
+        percepts = []
+        for i in range(self.rows):
+            row = []
+            for j in range(self.columns):
+                k = i * self.columns + j
+                cell = [4 if self.arrows[k] else 3]
+                cell.extend(list(token) for token in self.towers[k])
+                cell.extend([0, 0] for l in range(5 - len(cell)))
+                row.append(cell)
+            percepts.append(row)
+        return percepts
+
+    def get_actions(self):
+        """Yield all valid actions on this board."""
+        towers = self.towers
+        arrows = self.arrows
+        max_height = self.max_height
+        for i, tower in enumerate(towers):
+            h = len(tower)
+            if h:
+                for n, action in self.neighbors[i]:
+                    nh = len(towers[n])
+                    if nh:
+                        if h + nh <= max_height:
+                            yield action
+                    elif arrows[n]:
+                        yield action
+
+    def is_action_valid(self, action):
+        """Return whether action is a valid action."""
+        try:
+            i1, j1, i2, j2 = action
+            if not (0 <= i1 < self.rows and 0 <= j1 < self.columns and
+                    abs(i1 - i2) + abs(j1 - j2) == 1 and
+                    0 <= i2 < self.rows and 0 <= j2 < self.columns):
+                return False
+        except (TypeError, ValueError):
+            return False
+        h1 = len(self.towers[i1 * self.columns + j1])
+        n = i2 * self.columns + j2
+        h2 = len(self.towers[n])
+        if h2:
+            return h1 > 0 and h1 + h2 <= self.max_height
+        return h1 > 0 and self.arrows[n]
+
+    def play_action(self, action):
+        """Play an action if it is valid, as Board.play_action. Return self."""
+        if not self.is_action_valid(action):
+            raise InvalidAction(action)
+        i1, j1, i2, j2 = action
+        i = i1 * self.columns + j1
+        n = i2 * self.columns + j2
+        towers = self.towers
+        tower = towers[i]
+        if towers[n]:
+            towers[n] = towers[n] + tower
+        else:
+            towers[n] = tuple((top, bot) for bot, top in reversed(tower))
+        towers[i] = ()
+        return self
+
+    def is_finished(self):
+        """Return whether no more moves can be made (i.e., game finished)."""
+        for action in self.get_actions():
+            return False
+        return True
+
+    def get_score(self):
+        """Return the score of this board, as Board.get_score."""
+        score = 0
+        for tower in self.towers:
+            if tower:
+                top = tower[-1][1]
+                if top == 1 or top == -1:
+                    score += top * len(tower)
+        if score == 0:
+            for tower in self.towers:
+                if tower:
+                    top = tower[-1][1]
+                    if top == 1 or top == -1:
+                        for bot_half, top_half in tower:
+                            if bot_half == top or top_half == top:
+                                score += top
+        return score
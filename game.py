@@ -20,12 +20,17 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
+import math
+import mmap
+import struct
 import time
 import socket
 import xmlrpc.client
 import pickle
 import traceback
 
+import wire
+
 from sarena import *
 
 
@@ -111,6 +116,8 @@ class Trace:
     invert -- whether the initial board was inverted
     actions -- list of tuples (action, time) of the played action. The first
         element is the action, the second one is the time taken in seconds.
+    metrics -- list of the search metrics reported by the player for each
+        action (see sarena.Player.get_metrics), None if it reported none
     score -- score of the game
     reason -- specific reason for victory or "" if standard
 
@@ -129,10 +136,11 @@ class Trace:
         self.initial_board = board.get_percepts()
         self.max_height = board.max_height
         self.actions = []
+        self.metrics = []
         self.score = 0
         self.reason = ""
 
-    def add_action(self, action, t):
+    def add_action(self, action, t, metrics=None):
         """Add an action to the trace.
 
         Arguments:
@@ -140,9 +148,12 @@ class Trace:
             sarena.Board.play_action
         t -- a float representing the number of seconds the player has taken
             to generate the action
+        metrics -- dictionary of search metrics reported by the player, or
+            None
 
         """
         self.actions.append((action, t))
+        self.metrics.append(metrics)
 
     def set_score(self, score, reason):
         """Set the winner.
@@ -170,18 +181,243 @@ class Trace:
                 f.close()
 
 
+# Binary trace files
+#
+# A binary trace file is written while the game is played, so that a crash
+# only loses the current step. It consists of:
+#   header  -- TRACE_MAGIC, the format version, the width in bytes of action
+#              codes, the maximal height, the two time limits (f64, NaN for
+#              None) and the initial board packed by sarena.pack_percepts
+#   records -- one per step: the action code (see sarena.action_to_code,
+#              1 or 2 bytes) and the time taken (f32)
+#   footer  -- an action code with all bits set, the score (i32), the reason
+#              (UTF-8), its length (u16) and TRACE_END
+# All numbers are big-endian. Records have a fixed size, so that any step
+# can be reached directly.
+
+TRACE_MAGIC = b"SRNT"
+TRACE_END = b"SRNE"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct(">4sBBBdd")
+TRACE_TIME = struct.Struct(">f")
+TRACE_SCORE = struct.Struct(">i")
+TRACE_REASON_LENGTH = struct.Struct(">H")
+TRACE_RECORDS = {1: struct.Struct(">Bf"), 2: struct.Struct(">Hf")}
+TRACE_END_CODES = {1: b"\xff", 2: b"\xff\xff"}
+
+
+def action_code_width(rows, columns):
+    """Return the number of bytes needed for the action codes of a board."""
+    return 1 if 4 * rows * columns < 0xff else 2
+
+
+class StreamTrace(Trace):
+
+    """Trace appended to a binary trace file as the game is played.
+
+    The file is flushed after each step and completed by set_score. The
+    search metrics are only kept in memory, not in the file.
+
+    """
+
+    def __init__(self, board, time_limits, filename):
+        """Initialize the trace and write the header of the file.
+
+        Arguments:
+        board, time_limits -- as for Trace
+        filename -- the file to write to
+
+        """
+        Trace.__init__(self, board, time_limits)
+        self.columns = board.columns
+        self.width = action_code_width(board.rows, board.columns)
+        self.record = TRACE_RECORDS[self.width]
+        self.file = open(filename, "wb")
+        limits = [math.nan if l is None else l for l in time_limits]
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                          self.width, self.max_height,
+                                          *limits))
+        self.file.write(pack_percepts(self.initial_board))
+        self.file.flush()
+
+    def __getstate__(self):
+        # allow pickling it like a Trace with Trace.write
+        state = self.__dict__.copy()
+        del state["file"], state["record"]
+        return state
+
+    def add_action(self, action, t, metrics=None):
+        Trace.add_action(self, action, t, metrics)
+        self.file.write(self.record.pack(
+            action_to_code(action, self.columns), t))
+        self.file.flush()
+
+    def set_score(self, score, reason):
+        Trace.set_score(self, score, reason)
+        reason = reason.encode("utf-8")
+        self.file.write(TRACE_END_CODES[self.width])
+        self.file.write(TRACE_SCORE.pack(score))
+        self.file.write(reason)
+        self.file.write(TRACE_REASON_LENGTH.pack(len(reason)))
+        self.file.write(TRACE_END)
+        self.file.close()
+
+
+def write_binary_trace(trace, filename):
+    """Write a trace, e.g. loaded from a pickle, as a binary trace file."""
+    stream = StreamTrace(trace.get_initial_board(), trace.time_limits,
+                         filename)
+    for action, t in trace.actions:
+        stream.add_action(action, t)
+    stream.set_score(trace.score, trace.reason)
+
+
+class TraceActions:
+
+    """Read-only sequence of the (action, time) pairs of a binary trace."""
+
+    def __init__(self, data, offset, length, record, columns):
+        self.data = data
+        self.offset = offset
+        self.length = length
+        self.record = record
+        self.columns = columns
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, step):
+        if step < 0:
+            step += self.length
+        if not 0 <= step < self.length:
+            raise IndexError("step out of range")
+        code, t = self.record.unpack_from(
+            self.data, self.offset + step * self.record.size)
+        return code_to_action(code, self.columns), t
+
+    def __iter__(self):
+        for step in range(self.length):
+            yield self[step]
+
+
+class TraceReader:
+
+    """Binary trace file opened for random access.
+
+    It has the same attributes as Trace, but actions is a TraceActions
+    sequence reading the file on demand and metrics is None. If the game was
+    interrupted before its end, complete is False and the score is 0.
+
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+        magic, version, width, max_height, t1, t2 = \
+            TRACE_HEADER.unpack_from(data)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or \
+                width not in TRACE_RECORDS:
+            raise ValueError("not a binary trace file")
+        self.time_limits = [None if math.isnan(t) else t for t in (t1, t2)]
+        self.max_height = max_height
+        self.metrics = None
+        offset = TRACE_HEADER.size
+        self.initial_board = unpack_percepts(data, offset)
+        columns = len(self.initial_board[0])
+        offset += packed_percepts_size(data, offset)
+        record = TRACE_RECORDS[width]
+        end = len(data)
+        self.complete = data[-len(TRACE_END):] == TRACE_END
+        if self.complete:
+            end -= len(TRACE_END) + TRACE_REASON_LENGTH.size
+            length, = TRACE_REASON_LENGTH.unpack_from(data, end)
+            self.reason = data[end - length:end].decode("utf-8")
+            end -= length + TRACE_SCORE.size
+            self.score, = TRACE_SCORE.unpack_from(data, end)
+            end -= width
+        else:
+            self.score = 0
+            self.reason = "Incomplete trace."
+        self.actions = TraceActions(data, offset, (end - offset) // record.size,
+                                    record, columns)
+
+    def get_initial_board(self):
+        """Return a Board instance representing the initial board."""
+        return Board(self.initial_board)
+
+    def get_board(self, step):
+        """Return a Board instance representing the board after step."""
+        board = self.get_initial_board()
+        for k in range(step):
+            board.play_action(self.actions[k][0])
+        return board
+
+    def close(self):
+        self.data.close()
+
+
+class TraceUnpickler(pickle.Unpickler):
+
+    """Unpickler finding Trace in this module.
+
+    Traces written by running game.py are pickled as __main__.Trace, which
+    other programs loading them do not have.
+
+    """
+
+    def find_class(self, module, name):
+        if module == "__main__" and name == "Trace":
+            return Trace
+        return pickle.Unpickler.find_class(self, module, name)
+
+
 def load_trace(filename):
-    """Load a trace from a file."""
+    """Load a trace from a file, either pickled or binary."""
     f = None
     try:
         f = open(filename, "rb")
-        return pickle.load(f)
+        if f.read(len(TRACE_MAGIC)) == TRACE_MAGIC:
+            return TraceReader(filename)
+        f.seek(0)
+        return TraceUnpickler(f).load()
     finally:
         if f is not None:
             f.close()
 
 
-def play_game(players, board, viewer=None, credits=[None, None]):
+def start_session(player, board, invert):
+    """Start a session with a player and return whether it succeeded."""
+    try:
+        digest = player.start_session(board.get_percepts(invert))
+    except (socket.error, xmlrpc.client.Fault) as e:
+        logging.info("Player does not support sessions. Reason: %s", e)
+        return False
+    if digest != "%016x" % board.digest(invert):
+        logging.warning("Player session board does not match, not using it")
+        return False
+    return True
+
+
+def play_session(player, board, invert, last_action, step, time_left):
+    """Ask a player in session mode for its action.
+
+    The player receives only last_action. If the digest it returns does not
+    match the referee's board, the board is sent again and the question
+    asked again.
+
+    """
+    action, digest = player.play_session(last_action, step, time_left)
+    if digest != "%016x" % board.digest(invert):
+        logging.warning("Player board out of sync at step %d, resending it",
+                        step)
+        player.start_session(board.get_percepts(invert))
+        action, digest = player.play_session(None, step, time_left)
+    return action
+
+
+def play_game(players, board, viewer=None, credits=[None, None],
+              sessions=False, trace=None):
     """Play the Sarena game and return the trace as a Trace object.
 
     Arguments:
@@ -191,15 +427,37 @@ def play_game(players, board, viewer=None, credits=[None, None]):
     viewer -- the viewer or None if none should be used
     credits -- a sequence of 2 elements containing the time credit in seconds
         for each player, or None for a time-unlimitted player
+    sessions -- whether to use stateful sessions with the players that
+        support them: the board is sent once, then only the last action.
+        Viewers and a player playing both sides are not in session mode.
+    trace -- the Trace to fill, e.g. a StreamTrace, or None to create one
 
     """
     if viewer is None:
         viewer = Viewer()
     logging.info("Starting new game")
     step = 0
-    trace = Trace(board, credits)
+    if trace is None:
+        trace = Trace(board, credits)
     viewer.update(board, step, (0, 0, 0, 0))
+    in_session = [False, False]
+    # local players which do not modify their percepts get a view of board
+    readonly = [isinstance(p, Player) and p.readonly_percepts for p in players]
+    has_metrics = [True, True]
+    last_action = None
     try:
+        if sessions:
+            for player in range(2):
+                # viewers ask humans, and an object playing both sides
+                # would have a single session board for the two of them
+                if isinstance(players[player], Viewer) or \
+                        players[0] is players[1]:
+                    continue
+                start = time.time()
+                in_session[player] = start_session(players[player], board,
+                                                   player == 1)
+                if credits[player] is not None:
+                    credits[player] -= time.time() - start
         while not board.is_finished():
             player = step % 2
             step += 1
@@ -212,10 +470,16 @@ def play_game(players, board, viewer=None, credits=[None, None]):
                 socket.setdefaulttimeout(credits[player] + 1)
             start = time.time()
             try:
-                action = players[player].play(
-                    board.get_percepts(player == 1),
-                    step,
-                    credits[player])
+                if in_session[player]:
+                    action = play_session(players[player], board, player == 1,
+                                          last_action, step, credits[player])
+                else:
+                    if readonly[player]:
+                        percepts = PerceptsView(board.m, player == 1)
+                    else:
+                        percepts = board.get_percepts(player == 1)
+                    action = players[player].play(percepts, step,
+                                                  credits[player])
             except socket.timeout:
                 credits[player] = -1.0  # ensure it is counted as expired
                 raise TimeCreditExpired
@@ -235,7 +499,19 @@ def play_game(players, board, viewer=None, credits=[None, None]):
                 if credits[player] < -0.5:  # small epsilon to be sure
                     raise TimeCreditExpired
             board.play_action(action)
-            trace.add_action(action, t)
+            last_action = action
+            metrics = None
+            if has_metrics[player]:
+                # not counted in the time credit
+                try:
+                    metrics = players[player].get_metrics() or None
+                    logging.info("Step %d: metrics %s", step, metrics)
+                except (AttributeError, socket.error,
+                        xmlrpc.client.Fault) as e:
+                    logging.info("Player %d does not give metrics." +
+                                 " Reason: %s", player+1, e)
+                    has_metrics[player] = False
+            trace.add_action(action, t, metrics)
             viewer.update(board, step, action)
     except (TimeCreditExpired, InvalidAction) as e:
         if isinstance(e, TimeCreditExpired):
@@ -264,9 +540,20 @@ def play_game(players, board, viewer=None, credits=[None, None]):
     return trace
 
 
-def connect_player(uri):
-    """Connect to a remote player and return a proxy for the Player object."""
-    return xmlrpc.client.ServerProxy(uri, allow_none=True)
+def connect_player(uri, binary=True):
+    """Connect to a remote player and return a proxy for the Player object.
+
+    If binary is True, the compact binary protocol is negotiated with the
+    player, falling back to XML-RPC if the player does not support it.
+
+    """
+    return wire.connect(uri, binary)
+
+
+def disconnect_player(player):
+    """Close the persistent connection of a remote player, if any."""
+    if isinstance(player, wire.BinaryPlayerProxy):
+        player.close()
 
 if __name__ == "__main__":
     from optparse import OptionParser
@@ -285,6 +572,10 @@ if __name__ == "__main__":
                       help="write the trace to FILE for replay with -r" +
                            " (no effect on replay)",
                       metavar="FILE")
+    parser.add_option("--stream",
+                      action="store_true", dest="stream", default=False,
+                      help="write the trace given by -w as a binary trace" +
+                           " file, step by step during the game")
     parser.add_option("--no-gui",
                       action="store_false", dest="gui", default=True,
                       help="do not try to load the graphical user interface")
@@ -292,6 +583,14 @@ if __name__ == "__main__":
                       action="store_true", dest="headless", default=False,
                       help="run without user interface (players cannot be" +
                            " human)")
+    parser.add_option("--no-binary",
+                      action="store_false", dest="binary", default=True,
+                      help="talk XML-RPC to the players, without trying the" +
+                           " binary protocol")
+    parser.add_option("--session",
+                      action="store_true", dest="session", default=False,
+                      help="send the board once and then only the last" +
+                           " action to the players supporting it")
     parser.add_option("-n", type=int, dest="games", default=1,
                       metavar="N", help="play N games consecutively")
     g = parser.add_option_group("Rule options (no effect on replay)")
@@ -303,6 +602,9 @@ if __name__ == "__main__":
                  help="invert the initial board")
     g.add_option("--board", dest="board",
                    help="load initial board from FILE", metavar="FILE")
+    g.add_option("--board-set", dest="board_set",
+                 help="play game K on board K of the board set FILE (see" +
+                      " boardset.py)", metavar="FILE")
     g.add_option("-b", "--save-board", dest="save_board",
                  help="save board to FILE", metavar="FILE")
     (options, args) = parser.parse_args()
@@ -315,6 +617,16 @@ if __name__ == "__main__":
         parser.error("human players are not allowed in headless mode")
     if options.replay is not None and options.headless:
         parser.error("cannot replay in headless mode")
+    board_set = None
+    if options.board_set is not None:
+        from boardset import BoardSet
+        try:
+            board_set = BoardSet(options.board_set)
+        except (IOError, ValueError) as e:
+            parser.error("option --board-set: %s" % e)
+        if len(board_set) < options.games:
+            parser.error("option --board-set: %d boards for %d games" %
+                         (len(board_set), options.games))
 
     level = logging.WARNING
     if options.verbose:
@@ -330,10 +642,12 @@ if __name__ == "__main__":
             logging.info("Loading trace '%s'", options.replay)
             try:
                 trace = load_trace(options.replay)
-            except (IOError, pickle.UnpicklingError) as e:
+            except (IOError, ValueError, pickle.UnpicklingError) as e:
                 logging.error("Unable to load trace. Reason: %s", e)
                 exit(1)
             board = trace.get_initial_board()
+        elif board_set is not None:
+            board = board_set[i]
         elif options.board is not None:
             if options.board == "statics":
                 board_file = "boards/b%d.dmp" % (i+1,)
@@ -376,16 +690,23 @@ if __name__ == "__main__":
             credits = [None, None]
             for i in range(2):
                 if args[i] != 'human':
-                    players[i] = connect_player(args[i])
+                    players[i] = connect_player(args[i], options.binary)
                     credits[i] = options.time
             trace = [None]
 
             def play():
+                stream = None
+                if options.write is not None and options.stream:
+                    stream = StreamTrace(board, credits, options.write)
                 try:
-                    trace[0] = play_game(players, board, viewer, credits)
+                    trace[0] = play_game(players, board, viewer, credits,
+                                         options.session, stream)
                 except KeyboardInterrupt:
                     exit()
-                if options.write is not None:
+                finally:
+                    for p in players:
+                        disconnect_player(p)
+                if options.write is not None and not options.stream:
                     logging.info("Writing trace to '%s'", options.write)
                     try:
                         trace[0].write(options.write)
@@ -404,5 +725,9 @@ if __name__ == "__main__":
         else:
             # Replay mode
             logging.debug("Replaying trace.")
-            viewer.replay(trace)
+            try:
+                viewer.replay(trace)
+            finally:
+                if isinstance(trace, TraceReader):
+                    trace.close()
         logging.info("End of Game %d" % (i+1,))
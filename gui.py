@@ -40,6 +40,7 @@ class TkViewer(Viewer):
     dist_arrow_x2 = 11 * r_cell_x / 12  # measure to draw the arrows on circles
     dist_arrow_y = r_cell_y / 2  # measure to draw the arrows on circles
     dist_tokens = (r_cell_y - r_token_y) / 4  # the distance between two tokens
+    colors = {1: "yellow", -1: "red"}  # of half tokens, grey otherwise
 
     def __init__(self, board):
         """Create a GUI viewer.
@@ -61,9 +62,19 @@ class TkViewer(Viewer):
                              height=self.canvas_height,
                              selectbackground="light gray")
         self.canvas.pack()
-        # tower_ids is filled by _update_gui
+        # what is drawn on each cell: the tower as a tuple of tokens, the
+        # oval of each half token, bottom first, and the height label
+        self.drawn = [[() for j in range(self.board.columns)]
+                      for i in range(self.board.rows)]
+        self.token_ids = [[[] for j in range(self.board.columns)]
+                          for i in range(self.board.rows)]
+        self.height_ids = [[0 for j in range(self.board.columns)]
+                           for i in range(self.board.rows)]
+        # top oval of each tower, 0 for empty cells
         self.tower_ids = [[0 for j in range(self.board.columns)]
                           for i in range(self.board.rows)]
+        self.pending = None  # percepts and step waiting to be drawn
+        self.pending_lock = threading.Lock()
         self.cell_ids = [[0 for j in range(self.board.columns)]
                           for i in range(self.board.rows)]
         for i, j, h in self.board.get_towers():
@@ -142,190 +153,79 @@ class TkViewer(Viewer):
 
     def update(self, board, step, action):
         self.board = board
-        if self.root is not None:
-            self.root.after_idle(self._update_gui, board, step, action)
-
-    def clean_board(self):
-        for i in range(self.board.rows):
-            for j in range(self.board.columns):
-                self.canvas.delete("height%d%d" % (i, j))
-                for k in range(4):
-                    for l in range(2):
-                        self.canvas.delete(
-                            "towers%d%d%d%d" % (i, j, k, l))
-
-    def _update_gui(self, board, step, action, invert=False):
-        i1, j1, i2, j2 = action
-        if (i1 == 0 and i2 == 0 and j1 == 0 and j2 == 0):
-            self.clean_board()
-            for i in range(self.board.rows):
-                for j in range(self.board.columns):
-                    tower = board.get_tower(board.m[i][j])
-                    height = board.get_height(board.m[i][j])
-                    y = (i + .5) * self.w * self.ratio_yx + \
-                    4 * self.dist_tokens
-                    x = (j + .5) * self.w
-                    for k in range(height):
-                        for l in range(2):
-                            half_token = tower[k][l]
-                            if half_token == -1:
-                                color = "red"
-                            elif half_token == 1:
-                                color = "yellow"
-                            else:
-                                color = "grey"
-                            if (k == (height - 1) and l == 1):
-                                o = self.canvas.create_oval(
-                                    x - self.r_token_x,
-                                    y - self.r_token_y,
-                                    x + self.r_token_x,
-                                    y + self.r_token_y,
-                                    fill=color,
-                                    tags=["towers%d%d%d%d" % (i, j, k, l)])
-                            else:
-                                self.canvas.create_oval(
-                                    x - self.r_token_x,
-                                    y - self.r_token_y,
-                                    x + self.r_token_x,
-                                    y + self.r_token_y,
-                                    fill=color,
-                                    tags=["towers%d%d%d%d" % (i, j, k, l)])
-                            y -= self.dist_tokens
-                    if height > 0:
-                        self.canvas.create_text(x,
-                                                y,
-                                                text=str(height),
-                                                font=self.font,
-                                                tags=["height%d%d" % (i, j)])
-                    self.tower_ids[i][j] = o
-                    self._mark((i, j))  # ensure coherent unselected appearance
-        else:
-            if(invert and board.get_height(board.m[i1][j1]) != 0):
-                height1 = board.get_height(board.m[i1][j1])
-                height2 = board.get_height(board.m[i2][j2])
-                formerHeight1 = height1 + height2
-                y = (i2 - i1) * self.w * self.ratio_yx \
-                + (self.dist_tokens * 2 * height1)
-                x = (j2 - j1) * self.w
-                self.tower_ids[i1][j1] = self.canvas.find_withtag(
-                    "towers%d%d%d%d" % (i1, j1, height1 - 1, 1))
-                for k in range(height1, formerHeight1):
-                    for l in range(2):
-                        self.canvas.move(
-                            "towers%d%d%d%d" % (i1, j1, k, l), x, y)
-                        self.canvas.addtag_withtag(
-                            "towers%d%d%d%d" % (i2, j2, k - height1, l),
-                            "towers%d%d%d%d" % (i1, j1, k, l))
-                        self.canvas.dtag(
-                            "towers%d%d%d%d" % (i2, j2, k - height1, l),
-                            "towers%d%d%d%d" % (i1, j1, k, l))
-                        if (k == (formerHeight1 - 1) and l == 1):
-                            self.tower_ids[i2][j2] = \
-                            self.canvas.find_withtag(
-                                "towers%d%d%d%d" % (i2, j2, k - height1, l))
-                        self.canvas.tag_raise(
-                            "towers%d%d%d%d" % (i2, j2, k - height1, l))
-                self.canvas.move(
-                    "height%d%d" % (i1, j1), 0, self.dist_tokens * 2 * height2)
-                self.canvas.itemconfigure("height%d%d" % (i1, j1),
-                                          text=str(height1))
-                self.canvas.tag_raise("height%d%d" % (i1, j1))
-                self.canvas.create_text(
-                    (j2 + .5) * self.w,
-                    (i2 + .5) * self.w * self.ratio_yx +
-                    self.dist_tokens * (4 - 2 * height2),
-                    text=str(height2), font=self.font,
-                    tags=["height%d%d" % (i2, j2)])
-                self._mark((i1, j1))  # ensure coherent unselected appearance
-                self._mark((i2, j2))  # ensure coherent unselected appearance
-            else:
-                self.canvas.delete("height%d%d" % (i1, j1))
-                tower1Tags = []
-                for k in range(4):
-                    for l in range(2):
-                        if self.canvas.find_withtag(
-                            "towers%d%d%d%d" % (i1, j1, k, l)):
-                            tower1Tags.append(
-                                "towers%d%d%d%d" % (i1, j1, k, l))
-                height1 = len(tower1Tags) // 2
-                height2 = board.get_height(board.m[i2][j2])
-                y = (i2 - i1) * self.w * self.ratio_yx - \
-                (self.dist_tokens * 2 * (height2 - height1))
-                x = (j2 - j1) * self.w
-                if height1 == height2:
-                    y += (height2 * 2 - 1) * self.dist_tokens
-                    for k in range(height1 - 1, -1, -1):
-                        for l in range(1, -1, -1):
-                            self.canvas.move(
-                                "towers%d%d%d%d" % (i1, j1, k, l), x, y)
-                            self.canvas.addtag_withtag(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    height1 - k - 1, 1 - l),
-                                "towers%d%d%d%d" % (i1, j1, k, l))
-                            self.canvas.dtag(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    height1 - k - 1, 1 - l),
-                                "towers%d%d%d%d" % (i1, j1, k, l))
-                            if (k == 0 and l == 0):
-                                self.tower_ids[i2][j2] = \
-                                self.canvas.find_withtag(
-                                    "towers%d%d%d%d" % (i2, j2,
-                                                        height1 - k - 1,
-                                                        1 - l))
-                            self.canvas.tag_raise(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    height1 - k - 1, 1 - l))
-                            y -= 2 * self.dist_tokens
-                    self.canvas.create_text((j2 + .5) * self.w,
-                                            (i2 + .5) * self.w *
-                                            self.ratio_yx +
-                                            self.dist_tokens *
-                                            (4 - 2 * height2),
-                                            text=str(height2),
-                                            font=self.font,
-                                            tags=["height%d%d" % (i2, j2)])
-                    self._mark((i2, j2))
-                else:
-                    for k in range(height1):
-                        for l in range(2):
-                            self.canvas.move(
-                                "towers%d%d%d%d" % (i1, j1, k, l), x, y)
-                            self.canvas.addtag_withtag(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    k + (height2 - height1),
-                                                    l),
-                                "towers%d%d%d%d" % (i1, j1, k, l))
-                            self.canvas.dtag(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    k + (height2 - height1),
-                                                    l),
-                                "towers%d%d%d%d" % (i1, j1, k, l))
-                            if (k == (height1 - 1) and l == 1):
-                                self.tower_ids[i2][j2] = \
-                                self.canvas.find_withtag(
-                                    "towers%d%d%d%d" % (i2, j2,
-                                                        k +
-                                                        (height2 - height1),
-                                                        l))
-                            self.canvas.tag_raise(
-                                "towers%d%d%d%d" % (i2, j2,
-                                                    k + (height2 - height1),
-                                                    l))
-                    if height2 > 0:
-                        self.canvas.move("height%d%d" % (i2, j2),
-                                         0,
-                                         -height1 * 2 * self.dist_tokens)
-                        self.canvas.itemconfigure("height%d%d" % (i2, j2),
-                                                  text=str(height2))
-                        self.canvas.tag_raise("height%d%d" % (i2, j2))
-                    self._mark((i2, j2))
+        if self.root is None:
+            return
+        # Only the last board is drawn when the play thread goes faster
+        # than Tk: the updates are coalesced in self.pending, which a single
+        # idle callback draws.
+        with self.pending_lock:
+            scheduled = self.pending is not None
+            self.pending = (board.get_percepts(), step)
+        if not scheduled:
+            self.root.after_idle(self._update_pending)
+
+    def _update_pending(self):
+        with self.pending_lock:
+            percepts, step = self.pending
+            self.pending = None
+        self._update_gui(percepts, step)
+
+    def _update_gui(self, percepts, step):
+        """Draw the percepts, changing only the cells which differ."""
+        for i, row in enumerate(percepts):
+            for j, cell in enumerate(row):
+                tower = tuple((bot, top) for bot, top in cell[1:] if bot)
+                if tower != self.drawn[i][j]:
+                    self._draw_tower(i, j, tower)
         if step % 2:
-                player = "Red"
+            player = "Red"
         else:
             player = "Yellow"
         self.set_status("Step %d: %s's turn." % (step, player))
         self.set_substatus("")
 
+    def _draw_tower(self, i, j, tower):
+        """Update the canvas items of cell (i, j) to show tower.
+
+        The ovals of the half tokens already drawn are recoloured, and only
+        the missing ones are created or the extra ones deleted.
+
+        """
+        items = self.token_ids[i][j]
+        halves = [half for token in tower for half in token]
+        x = (j + .5) * self.w
+        y = (i + .5) * self.w * self.ratio_yx + 4 * self.dist_tokens
+        for n, half in enumerate(halves):
+            color = self.colors.get(half, "grey")
+            if n < len(items):
+                self.canvas.itemconfigure(items[n], fill=color)
+            else:
+                yn = y - n * self.dist_tokens
+                items.append(self.canvas.create_oval(
+                    x - self.r_token_x, yn - self.r_token_y,
+                    x + self.r_token_x, yn + self.r_token_y, fill=color))
+        for item in items[len(halves):]:
+            self.canvas.delete(item)
+        del items[len(halves):]
+        text = self.height_ids[i][j]
+        if halves:
+            y -= len(halves) * self.dist_tokens
+            if text:
+                self.canvas.coords(text, x, y)
+                self.canvas.itemconfigure(text, text=str(len(tower)))
+                self.canvas.tag_raise(text)
+            else:
+                self.height_ids[i][j] = self.canvas.create_text(
+                    x, y, text=str(len(tower)), font=self.font)
+            self.tower_ids[i][j] = items[-1]
+        else:
+            if text:
+                self.canvas.delete(text)
+                self.height_ids[i][j] = 0
+            self.tower_ids[i][j] = 0
+        self.drawn[i][j] = tower
+        self._mark((i, j))  # ensure coherent unselected appearance
+
     def play(self, percepts, step, time_left):
         if self.root is None:
             return None
@@ -402,14 +302,12 @@ class TkViewer(Viewer):
     def _mark(self, position, style="unselected"):
         """Mark tower as unselected, origin or destination."""
         i, j = position
-        if self.board.get_height(self.board.m[i][j]) > 0:
+        if self.tower_ids[i][j]:
             o = self.tower_ids[i][j]
         else:
             o = self.cell_ids[i][j]
-        if isinstance(o, list):
-            raise TypeError("A single int was expected")
         if style == "unselected":
-            if self.board.get_height(self.board.m[i][j]) > 0:
+            if self.tower_ids[i][j]:
                 self.canvas.itemconfigure(o, outline="black", width=1)
             else:
                 self.canvas.itemconfigure(o, outline="black", width=0)
@@ -445,9 +343,7 @@ class TkViewer(Viewer):
         self.trace = trace
         # generate all boards to access them backwards
         self.boards = [trace.get_initial_board()]
-        self.actions = [(0, 0, 0, 0)]
         for action, t in trace.actions:
-            self.actions.append(action)
             b = self.boards[-1].clone()
             b.play_action(action)
             self.boards.append(b)
@@ -470,21 +366,14 @@ class TkViewer(Viewer):
         self.root.bind_all("<space>", self._replay_play)
         self.playing = False
         if show_end:
-            self._replay_goto(len(self.boards) - 1, False)
+            self._replay_goto(len(self.boards) - 1)
         else:
-            self._replay_goto(0, False)
+            self._replay_goto(0)
 
-    def _replay_goto(self, step, invert=False):
+    def _replay_goto(self, step):
         """Update UI to show step step."""
         self.step = step
-        if invert:
-            self._update_gui(self.boards[step], step,
-                             (self.actions[step + 1][2],
-                              self.actions[step + 1][3],
-                              self.actions[step + 1][0],
-                              self.actions[step + 1][1]), invert)
-        else:
-            self._update_gui(self.boards[step], step, self.actions[step])
+        self._update_gui(self.boards[step].m, step)
         if step == len(self.boards) - 1:
             self.finished(self.boards[step], step, self.trace.score,
                           self.trace.reason)
@@ -494,7 +383,7 @@ class TkViewer(Viewer):
         if self.playing:
             self.after_id = self.root.after(
                     int(self.trace.actions[step][1] * 1000),
-                    self._replay_goto, step + 1, False)
+                    self._replay_goto, step + 1)
         else:
             if step == 0:
                 self.b_prev["state"] = DISABLED
@@ -507,32 +396,32 @@ class TkViewer(Viewer):
 
     def _replay_next(self, event=None):
         if not self.playing and self.step < len(self.boards) - 1:
-            self._replay_goto(self.step + 1, False)
+            self._replay_goto(self.step + 1)
 
     def _replay_prev(self, event=None):
         if not self.playing and self.step > 0:
-            self._replay_goto(self.step - 1, True)
+            self._replay_goto(self.step - 1)
 
     def _replay_first(self, event=None):
         if not self.playing:
-            self._replay_goto(0, False)
+            self._replay_goto(0)
 
     def _replay_last(self, event=None):
         if not self.playing:
-            self._replay_goto(len(self.boards) - 1, False)
+            self._replay_goto(len(self.boards) - 1)
 
     def _replay_play(self, event=None):
         if self.playing:
             self.root.after_cancel(self.after_id)
             self.playing = False
             self.b_play["text"] = "Play"
-            self._replay_goto(self.step, False)
+            self._replay_goto(self.step)
         else:
             self.playing = True
             self.b_prev["state"] = DISABLED
             self.b_next["state"] = DISABLED
             self.b_play["text"] = "Pause"
             if self.step < len(self.boards) - 1:
-                self._replay_goto(self.step, False)
+                self._replay_goto(self.step)
             else:
-                self._replay_goto(0, False)
+                self._replay_goto(0)
@@ -17,6 +17,8 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 """
 
+from time import perf_counter as time
+
 
 class Game:
 
@@ -35,6 +37,21 @@ class Game:
         """
         abstract
 
+    def expand(self, state, depth):
+        """Return (leaf, successors) for state at the given depth.
+
+        leaf tells whether state should not be expanded further; successors
+        are as returned by successors (ignored for a leaf). A state without
+        successors is evaluated as a leaf, so a game whose successors are
+        cheaper to generate than to test for the end of the game can
+        override this method to cut off on the depth only, generating the
+        moves once per node. The default uses cutoff and successors.
+
+        """
+        if self.cutoff(state, depth):
+            return True, ()
+        return False, self.successors(state)
+
     def evaluate(self, state):
         """Return the evaluation of state."""
         abstract
@@ -43,22 +60,127 @@ class Game:
 inf = float("inf")
 
 
-def search(state, game, prune=True):
+class SearchStats:
+
+    """Statistics of one or more searches.
+
+    Pass the same instance to successive calls of search, e.g. in iterative
+    deepening: every call is recorded as an iteration.
+
+    Attributes:
+    nodes -- list of the number of nodes visited at each depth
+    cutoffs -- number of beta cutoffs
+    first_cutoffs -- number of beta cutoffs on the first successor
+    tt_probes, tt_hits, tt_stores -- transposition table statistics, to be
+        updated by games having one with tt_probe and tt_store
+    iterations -- list of (max depth, nodes, seconds) for each search
+
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_stores = 0
+        self.iterations = []
+
+    def tt_probe(self, hit):
+        """Record a transposition table lookup."""
+        self.tt_probes += 1
+        if hit:
+            self.tt_hits += 1
+
+    def tt_store(self):
+        """Record a transposition table store."""
+        self.tt_stores += 1
+
+    def total_nodes(self):
+        return sum(self.nodes)
+
+    def first_cutoff_rate(self):
+        """Return the ratio of cutoffs happening on the first successor."""
+        return self.first_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def effective_branching_factor(self):
+        """Return the effective branching factor.
+
+        It is the ratio of the nodes of the last two iterations if there
+        are several, and of the nodes at the two deepest depths otherwise.
+
+        """
+        if len(self.iterations) >= 2 and self.iterations[-2][1]:
+            return self.iterations[-1][1] / self.iterations[-2][1]
+        nodes = [n for n in self.nodes if n]
+        if len(nodes) >= 2:
+            return nodes[-1] / nodes[-2]
+        return 0.0
+
+    def metrics(self):
+        """Return the metrics of the searches, as for Player.get_metrics."""
+        nodes = self.total_nodes()
+        t = sum(seconds for _, _, seconds in self.iterations)
+        result = {"depth": max([d for d, _, _ in self.iterations] or [0]),
+                  "nodes": nodes, "time_used": t}
+        if t:
+            result["nps"] = nodes / t
+        return result
+
+    def __str__(self):
+        lines = ["nodes: %d (per depth: %s)" % (self.total_nodes(),
+                                                 self.nodes),
+                 "cutoffs: %d (%.1f%% on first move)" % (
+                     self.cutoffs, 100 * self.first_cutoff_rate()),
+                 "effective branching factor: %.2f" %
+                 self.effective_branching_factor()]
+        if self.tt_probes or self.tt_stores:
+            lines.append("TT: %d probes, %.1f%% hits, %d stores" % (
+                self.tt_probes, 100 * self.tt_hit_rate(), self.tt_stores))
+        for depth, nodes, t in self.iterations:
+            lines.append("iteration to depth %d: %d nodes in %.3fs" %
+                         (depth, nodes, t))
+        return "\n".join(lines)
+
+
+def search(state, game, prune=True, stats=None, callback=None):
     """Perform a MiniMax/AlphaBeta search and return the best action.
 
     Arguments:
     state -- initial state
     game -- a concrete instance of class Game
     prune -- whether to use AlphaBeta pruning
+    stats -- a SearchStats instance to fill, or None
+    callback -- function called with the SearchStats at the end of the
+        search (i.e., of the iteration), or None
+
+    Without stats nor callback, no statistics are collected at all: the
+    search does not even test whether to count the nodes.
 
     """
+    if stats is not None or callback is not None:
+        if stats is None:
+            stats = SearchStats()
+        start = time()
+        before = stats.total_nodes()
+        action = _search_stats(state, game, prune, stats)
+        stats.iterations.append((len(stats.nodes) - 1,
+                                 stats.total_nodes() - before,
+                                 time() - start))
+        if callback is not None:
+            callback(stats)
+        return action
 
     def max_value(state, alpha, beta, depth):
-        if game.cutoff(state, depth):
+        leaf, successors = game.expand(state, depth)
+        if leaf:
             return game.evaluate(state), None
         val = -inf
         action = None
-        for a, s in game.successors(state):
+        for a, s in successors:
             v, _ = min_value(s, alpha, beta, depth + 1)
             if v > val:
                 val = v
@@ -67,14 +189,17 @@ def search(state, game, prune=True):
                     if v >= beta:
                         return v, a
                     alpha = max(alpha, v)
+        if action is None:  # no successors: the game is finished
+            return game.evaluate(state), None
         return val, action
 
     def min_value(state, alpha, beta, depth):
-        if game.cutoff(state, depth):
+        leaf, successors = game.expand(state, depth)
+        if leaf:
             return game.evaluate(state), None
         val = inf
         action = None
-        for a, s in game.successors(state):
+        for a, s in successors:
             v, _ = max_value(s, alpha, beta, depth + 1)
             if v < val:
                 val = v
@@ -83,6 +208,67 @@ def search(state, game, prune=True):
                     if v <= alpha:
                         return v, a
                     beta = min(beta, v)
+        if action is None:
+            return game.evaluate(state), None
+        return val, action
+
+    _, action = max_value(state, -inf, inf, 0)
+    return action
+
+
+def _search_stats(state, game, prune, stats):
+    """Same as search, collecting statistics in stats."""
+
+    nodes = stats.nodes
+
+    def max_value(state, alpha, beta, depth):
+        if depth == len(nodes):
+            nodes.append(0)
+        nodes[depth] += 1
+        leaf, successors = game.expand(state, depth)
+        if leaf:
+            return game.evaluate(state), None
+        val = -inf
+        action = None
+        for i, (a, s) in enumerate(successors):
+            v, _ = min_value(s, alpha, beta, depth + 1)
+            if v > val:
+                val = v
+                action = a
+                if prune:
+                    if v >= beta:
+                        stats.cutoffs += 1
+                        if i == 0:
+                            stats.first_cutoffs += 1
+                        return v, a
+                    alpha = max(alpha, v)
+        if action is None:  # no successors: the game is finished
+            return game.evaluate(state), None
+        return val, action
+
+    def min_value(state, alpha, beta, depth):
+        if depth == len(nodes):
+            nodes.append(0)
+        nodes[depth] += 1
+        leaf, successors = game.expand(state, depth)
+        if leaf:
+            return game.evaluate(state), None
+        val = inf
+        action = None
+        for i, (a, s) in enumerate(successors):
+            v, _ = max_value(s, alpha, beta, depth + 1)
+            if v < val:
+                val = v
+                action = a
+                if prune:
+                    if v <= alpha:
+                        stats.cutoffs += 1
+                        if i == 0:
+                            stats.first_cutoffs += 1
+                        return v, a
+                    beta = min(beta, v)
+        if action is None:
+            return game.evaluate(state), None
         return val, action
 
     _, action = max_value(state, -inf, inf, 0)
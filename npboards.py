@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized generation of random initial boards.
+
+random_boards(n, seed) draws n boards at once, in the distribution of
+sarena.random_board: the 36 tokens (6 yellow/red, 12 yellow/neutral, 12
+red/neutral and 6 neutral/neutral) are shuffled on the 6x6 board and each
+of them is flipped with probability 1/2. The cells with arrows are those
+with an even row + column, as in random_board.
+
+The boards are returned as an int8 array of shape (n, 6, 6, 2) giving the
+bottom and top colors of the token on each cell (1 yellow, -1 red, 2
+neutral). They can be converted to percepts with board_percepts, packed as
+by sarena.pack_percepts with pack_boards, and written as a board set (see
+boardset.py) with write_boards.
+
+Boards are identified by a 64-bit Zobrist hash, the xor of a random key per
+cell and token. With unique, random_boards draws again until it has n
+distinct boards.
+
+BatchBoards plays on many 6x6 boards at once, e.g. for self-play or random
+rollouts: it gives the legal moves of all boards as masks over the 120
+directed edges of the board (EDGES, in the order of the action codes of
+sarena.action_to_code), plays one move per board and computes the scores
+of Board.get_score, each with a few array operations.
+
+This module requires NumPy.
+
+"""
+
+import numpy as np
+
+from sarena import DIRECTIONS, InvalidAction, code_to_action
+from boardset import write_packed_board_set
+
+TOKENS = np.array([[1, -1]] * 6 + [[1, 2]] * 12 + [[-1, 2]] * 12 +
+                  [[2, 2]] * 6, np.int8)
+ARROWS = (np.add.outer(np.arange(6), np.arange(6)) % 2 == 0).reshape(36)
+COLOR_CODES = np.zeros(256, np.uint8)  # as sarena.HALF_CODES, by color & 255
+COLOR_CODES[1], COLOR_CODES[255], COLOR_CODES[2] = 1, 2, 3
+ZOBRIST = np.random.default_rng(0x5a72656e61).integers(
+    0, 2 ** 64, size=(36, 16), dtype=np.uint64)
+PACKED_SIZE = 2 + 36 + 18  # size, cells, 36 token nibbles
+
+# directed edges (action code, source cell, destination cell) of a 6x6 board
+EDGES = tuple((4 * (6 * i + j) + d, 6 * i + j, 6 * (i + di) + j + dj)
+              for i in range(6) for j in range(6)
+              for d, (di, dj) in enumerate(DIRECTIONS)
+              if 0 <= i + di < 6 and 0 <= j + dj < 6)
+EDGE_CODES = np.array([code for code, _, _ in EDGES])
+SOURCES = np.array([src for _, src, _ in EDGES])
+DESTINATIONS = np.array([dst for _, _, dst in EDGES])
+SLOTS = np.arange(4)
+
+
+def token_nibbles(boards):
+    """Return the (n, 36) token nibbles of boards, as in pack_percepts."""
+    codes = COLOR_CODES[boards.reshape(len(boards), 36, 2).view(np.uint8)]
+    return codes[:, :, 0] << 2 | codes[:, :, 1]
+
+
+def hash_boards(boards):
+    """Return the (n,) uint64 Zobrist hashes of boards."""
+    keys = ZOBRIST[np.arange(36), token_nibbles(boards)]
+    return np.bitwise_xor.reduce(keys, axis=1)
+
+
+def draw_boards(rng, n):
+    order = np.argsort(rng.random((n, 36)), axis=1)
+    boards = TOKENS[order]
+    flip = rng.random((n, 36, 1)) < 0.5
+    return np.where(flip, boards[:, :, ::-1], boards).reshape(n, 6, 6, 2)
+
+
+def random_boards(n, seed=None, unique=False):
+    """Return n random initial boards as an (n, 6, 6, 2) int8 array.
+
+    seed is as for numpy.random.default_rng: the same seed gives the same
+    boards. If unique is True, all boards have different hashes.
+
+    """
+    rng = np.random.default_rng(seed)
+    boards = draw_boards(rng, n)
+    if not unique:
+        return boards
+    while True:
+        _, first = np.unique(hash_boards(boards), return_index=True)
+        if len(first) == len(boards) and len(boards) == n:
+            return boards
+        boards = boards[np.sort(first)]  # keep the order of the draws
+        if len(boards) >= n:
+            return boards[:n]  # n first distinct boards
+        boards = np.concatenate([boards, draw_boards(rng, n - len(boards))])
+
+
+def board_percepts(board):
+    """Return the percepts of one board of the array, as random_board."""
+    return [[[4 if (i + j) % 2 == 0 else 3, [int(c) for c in board[i, j]],
+              [0, 0], [0, 0], [0, 0]] for j in range(6)] for i in range(6)]
+
+
+def pack_boards(boards):
+    """Return the (n, PACKED_SIZE) uint8 packed forms of boards.
+
+    Row k holds the bytes of sarena.pack_percepts for board k.
+
+    """
+    n = len(boards)
+    packed = np.empty((n, PACKED_SIZE), np.uint8)
+    packed[:, 0] = packed[:, 1] = 6
+    packed[:, 2:38] = np.where(ARROWS, 0x81, 0x01)
+    nibbles = token_nibbles(boards)
+    packed[:, 38:] = nibbles[:, 0::2] << 4 | nibbles[:, 1::2]
+    return packed
+
+
+def write_boards(boards, filename):
+    """Write boards as a board set file."""
+    offsets = np.arange(len(boards) + 1, dtype="<u4") * PACKED_SIZE
+    write_packed_board_set(offsets, pack_boards(boards), filename)
+
+
+class BatchBoards:
+
+    """N 6x6 boards played at once.
+
+    Attributes:
+    tokens -- (N, 36, 4, 2) int8 array of the tokens of the towers, bottom
+        first, as in Board.m (0 for no token)
+    heights -- (N, 36) int8 array of the heights of the towers
+    arrows -- (N, 36) bool array of the cells with arrows
+
+    The moves are given as indices in EDGES, -1 for no move.
+
+    """
+
+    def __init__(self, tokens, arrows):
+        self.tokens = np.ascontiguousarray(tokens, np.int8)
+        self.arrows = np.ascontiguousarray(arrows, bool)
+        self.heights = (self.tokens[..., 0] != 0).sum(axis=2).astype(np.int8)
+
+    @classmethod
+    def from_boards(cls, boards):
+        """Return the batch of an array of random_boards."""
+        n = len(boards)
+        tokens = np.zeros((n, 36, 4, 2), np.int8)
+        tokens[:, :, 0] = boards.reshape(n, 36, 2)
+        return cls(tokens, np.broadcast_to(ARROWS, (n, 36)))
+
+    @classmethod
+    def from_percepts(cls, percepts_list):
+        """Return the batch of a sequence of 6x6 percepts."""
+        tokens = np.array([[cell[1:5] for row in percepts for cell in row]
+                           for percepts in percepts_list], np.int8)
+        arrows = np.array([[cell[0] == 4 for row in percepts for cell in row]
+                           for percepts in percepts_list], bool)
+        return cls(tokens.reshape(-1, 36, 4, 2), arrows.reshape(-1, 36))
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def percepts(self, k):
+        """Return the percepts of board k."""
+        tokens = self.tokens[k].tolist()
+        return [[[4 if self.arrows[k, c] else 3] + tokens[c]
+                 for c in range(6 * i, 6 * i + 6)] for i in range(6)]
+
+    def legal_moves(self):
+        """Return the (N, 120) bool mask of the legal moves."""
+        src = self.heights[:, SOURCES]
+        dst = self.heights[:, DESTINATIONS]
+        return (src > 0) & np.where(dst > 0, src + dst <= 4,
+                                    self.arrows[:, DESTINATIONS])
+
+    def is_finished(self):
+        """Return the (N,) bool array of the boards without legal moves."""
+        return ~self.legal_moves().any(axis=1)
+
+    def play(self, moves):
+        """Play one move on each board, moves being (N,) EDGES indices.
+
+        Boards with move -1 are left unchanged. Raise InvalidAction,
+        with the first invalid action, if a move is not legal.
+
+        """
+        moves = np.asarray(moves)
+        rows = np.flatnonzero(moves >= 0)
+        edges = moves[rows]
+        legal = self.legal_moves()[rows, edges]
+        if not legal.all():
+            edge = edges[np.argmin(legal)]
+            raise InvalidAction(edge_action(edge))
+        src = SOURCES[edges]
+        dst = DESTINATIONS[edges]
+        moved = self.tokens[rows, src]
+        h_src = self.heights[rows, src][:, None]
+        h_dst = self.heights[rows, dst][:, None]
+        # slot k of the destination gets token k - h_dst of the moved tower,
+        # or token h_src - 1 - k reversed when returned on an arrow cell
+        returned = h_dst == 0
+        k = np.where(returned, h_src - 1 - SLOTS, SLOTS - h_dst)
+        tokens = moved[np.arange(len(rows))[:, None], np.clip(k, 0, 3)]
+        tokens = np.where(returned[:, :, None], tokens[:, :, ::-1], tokens)
+        keep = (SLOTS < h_dst)[:, :, None]
+        filled = ((k >= 0) & (k < h_src))[:, :, None]
+        self.tokens[rows, dst] = np.where(
+            keep, self.tokens[rows, dst], np.where(filled, tokens, 0))
+        self.tokens[rows, src] = 0
+        self.heights[rows, dst] += h_src[:, 0]
+        self.heights[rows, src] = 0
+
+    def scores(self):
+        """Return the (N,) scores of the boards, as Board.get_score."""
+        h = self.heights.astype(np.int32)
+        top = np.take_along_axis(self.tokens[..., 1],
+                                 np.maximum(h - 1, 0)[:, :, None], axis=2)
+        top = np.where(h > 0, top[:, :, 0], 0)
+        score = np.where(top == 1, h, np.where(top == -1, -h, 0)).sum(axis=1)
+        # ties: tokens with a half of the color of the top in each tower
+        yellow = (self.tokens == 1).any(axis=3).sum(axis=2)
+        red = (self.tokens == -1).any(axis=3).sum(axis=2)
+        ties = np.where(top == 1, yellow, np.where(top == -1, -red, 0))
+        return np.where(score == 0, ties.sum(axis=1), score)
+
+    def random_moves(self, rng):
+        """Return a random legal move for each board, -1 if there is none.
+
+        rng is a numpy.random.Generator.
+
+        """
+        legal = self.legal_moves()
+        moves = np.where(legal, rng.random(legal.shape), -1).argmax(axis=1)
+        return np.where(legal.any(axis=1), moves, -1)
+
+    def play_random(self, rng):
+        """Play random moves on all boards to their end, return the scores."""
+        while True:
+            moves = self.random_moves(rng)
+            if (moves < 0).all():
+                return self.scores()
+            self.play(moves)
+
+
+def edge_action(edge):
+    """Return the sarena action (i1, j1, i2, j2) of an EDGES index."""
+    return code_to_action(int(EDGE_CODES[edge]), 6)
+
+
+if __name__ == "__main__":
+    import time
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] SET",
+                          description="Write random initial boards as a" +
+                          " board set.")
+    parser.add_option("-n", "--boards", type="int", dest="boards",
+                      default=1000, help="number of boards (default: %default)")
+    parser.add_option("-s", "--seed", type="int", dest="seed", default=0,
+                      help="random seed (default: %default)")
+    parser.add_option("--allow-duplicates", action="store_false",
+                      dest="unique", default=True,
+                      help="do not remove duplicate boards")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("need the board set file")
+    start = time.time()
+    boards = random_boards(options.boards, options.seed, options.unique)
+    write_boards(boards, args[0])
+    print("%d boards written to %s in %.2fs" % (len(boards), args[0],
+                                                time.time() - start))
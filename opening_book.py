@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opening book for SuperPlayer.
+
+Competition and regression runs replay the same initial boards, and the
+first steps, with about 120 moves at the root, take a large share of the
+time credit. The book maps positions, seen by the player to move as in
+Player.play, to the move found by a deep search made offline. SuperPlayer
+loads it with its --book option and plays known positions without
+thinking.
+
+File layout (little-endian):
+    header    BOOK_MAGIC, version, number of entries
+    entries   sorted by key, each a u64 key (symmetry.canonical_key) and a
+              u16 action code (sarena.action_to_code)
+
+The file is memory-mapped and searched by bisection, so a book of any size
+costs nothing to load. Positions are stored in their canonical form (see
+symmetry.py), the action being given for the canonical position, so that
+symmetric positions share an entry.
+
+"""
+
+import mmap
+import os
+import struct
+from multiprocessing import Pool
+
+from sarena import *
+from symmetry import canonical_key, transform_action
+
+BOOK_MAGIC = b"SRNK"
+BOOK_VERSION = 2
+HEADER = struct.Struct("<4sII")
+ENTRY = struct.Struct("<QH")
+
+
+def book_key(percepts):
+    """Return the key of a position in the book and its symmetry."""
+    key, symmetry, inverted = canonical_key(percepts)
+    return key, symmetry
+
+
+def write_book(entries, filename):
+    """Write a dictionary mapping keys to action codes as a book file."""
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(entries)))
+        for key in sorted(entries):
+            f.write(ENTRY.pack(key, entries[key]))
+
+
+class OpeningBook:
+
+    """A book file opened for lookups."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.length = HEADER.unpack_from(self.data)
+        if magic != BOOK_MAGIC or version != BOOK_VERSION or \
+                len(self.data) != HEADER.size + self.length * ENTRY.size:
+            self.data.close()
+            raise ValueError("not an opening book")
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        self.data.close()
+
+    def entry(self, k):
+        """Return the (key, action code) of the k-th entry."""
+        return ENTRY.unpack_from(self.data, HEADER.size + k * ENTRY.size)
+
+    def entries(self):
+        """Return all entries as a dictionary mapping keys to codes."""
+        return dict(self.entry(k) for k in range(self.length))
+
+    def lookup_key(self, key):
+        """Return the action code stored for key, or None."""
+        lo, hi = 0, self.length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, code = self.entry(mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return code
+        return None
+
+    def lookup(self, percepts):
+        """Return the book action for the percepts, or None."""
+        key, symmetry = book_key(percepts)
+        code = self.lookup_key(key)
+        if code is None:
+            return None
+        rows, columns = len(percepts), len(percepts[0])
+        return transform_action(code_to_action(code, columns), symmetry,
+                                rows, columns)
+
+
+def search_position(task):
+    """Search a position deeply and return its (key, action code).
+
+    task is (percepts seen by the player to move, depth).
+
+    """
+    from super_player import State, negamax
+    percepts, depth = task
+    State.setup()
+    action = negamax(State.from_percepts(percepts), depth, None)
+    if action is None:
+        return None
+    key, symmetry = book_key(percepts)
+    action = transform_action(State.to_board_action(action), symmetry, 6, 6)
+    return key, action_to_code(action, 6)
+
+
+def book_positions(percepts, plies):
+    """Yield the positions of the first plies steps from an initial board.
+
+    Each position is seen by the player to move.
+
+    """
+    board = Board(percepts)
+    yield board.get_percepts()
+    if plies >= 2:
+        for action in board.get_actions():
+            yield board.clone().play_action(action).get_percepts(True)
+
+
+def build(percepts_list, depth, plies=2, entries=None, jobs=None):
+    """Search the opening positions of the boards and return the entries.
+
+    entries is a dictionary of entries to complete, e.g. of an existing
+    book. Positions already in it are not searched again.
+
+    """
+    entries = {} if entries is None else entries
+    tasks = {}
+    for percepts in percepts_list:
+        for position in book_positions(percepts, plies):
+            key, symmetry = book_key(position)
+            if key not in entries:
+                tasks[key] = (position, depth)
+    with Pool(jobs) as pool:
+        for result in pool.imap_unordered(search_position, tasks.values()):
+            if result is not None:
+                key, code = result
+                entries[key] = code
+    return entries
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] BOOK BOARD_FILE...",
+                          description="Add the openings of the boards to a" +
+                          " book, searching them deeply.")
+    parser.add_option("-d", "--depth", type="int", dest="depth", default=5,
+                      help="search depth (default: %default)")
+    parser.add_option("--plies", type="int", dest="plies", default=2,
+                      help="number of steps of each game to put in the book:" +
+                           " 1 for the initial board, 2 to add all replies" +
+                           " to the first move (default: %default)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs",
+                      default=os.cpu_count(),
+                      help="number of processes (default: %default)")
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error("need a book and board files")
+    if options.plies not in (1, 2):
+        parser.error("option --plies: must be 1 or 2")
+    entries = {}
+    if os.path.exists(args[0]):
+        book = OpeningBook(args[0])
+        entries = book.entries()
+        book.close()
+    n = len(entries)
+    entries = build([load_percepts(f) for f in args[1:]], options.depth,
+                    options.plies, entries, options.jobs)
+    write_book(entries, args[0])
+    print("%d new positions, %d positions in %s" % (len(entries) - n,
+                                                   len(entries), args[0]))
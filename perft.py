@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perft: count the leaf nodes of the game tree to a fixed depth.
+
+The same positions are expanded with each move generator (sarena.Board,
+super_player.State and fastboard.FastBoard). The counts must agree, and the
+time taken gives the speed of each generator in nodes per second.
+
+"""
+
+import random
+import time
+
+from sarena import *
+from fastboard import FastBoard
+from super_player import State
+
+State.setup()
+
+
+def perft_board(board, depth):
+    """Return the number of leaves at depth from a sarena.Board."""
+    if depth == 0:
+        return 1
+    n = 0
+    for action in board.get_actions():
+        if depth == 1:
+            n += 1
+        else:
+            n += perft_board(board.clone().play_action(action), depth - 1)
+    return n
+
+
+def perft_fast(board, depth):
+    """Return the number of leaves at depth from a FastBoard."""
+    if depth == 0:
+        return 1
+    n = 0
+    for action in board.get_actions():
+        if depth == 1:
+            n += 1
+        else:
+            n += perft_fast(board.clone().play_action(action), depth - 1)
+    return n
+
+
+def perft_state(state, depth):
+    """Return the number of leaves at depth from a super_player State."""
+    if depth == 0:
+        return 1
+    n = 0
+    for _, s in State.gen_successors(state):
+        if depth == 1:
+            n += 1
+        else:
+            n += perft_state(s, depth - 1)
+    return n
+
+
+def engines(percepts):
+    """Return (name, perft function, root) for each engine handling percepts.
+
+    State only handles the standard 6x6 board.
+
+    """
+    result = [("Board", perft_board, Board(percepts)),
+              ("FastBoard", perft_fast, FastBoard(percepts))]
+    if len(percepts) == 6 and len(percepts[0]) == 6:
+        result.append(("State", perft_state, State.from_percepts(percepts)))
+    return result
+
+
+def positions(seeds):
+    """Yield (name, percepts) for the standard perft positions."""
+    yield "b1.dmp", load_percepts("b1.dmp")
+    yield "mini_board.dmp", load_percepts("mini_board.dmp")
+    for seed in seeds:
+        random.seed(seed)
+        yield "random %d" % seed, random_board()
+
+
+def perft(percepts, depth):
+    """Run all engines to depth and return a list of (name, count, time)."""
+    results = []
+    for name, function, root in engines(percepts):
+        start = time.time()
+        n = function(root, depth)
+        results.append((name, n, time.time() - start))
+    return results
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options]",
+                          description="Count and time move generation.")
+    parser.add_option("-d", "--depth", type="int", dest="depth", default=2,
+                      help="maximal depth (default: %default)")
+    parser.add_option("-s", "--seeds", type="int", dest="seeds", default=3,
+                      help="number of seeded random boards (default: %default)")
+    (options, args) = parser.parse_args()
+
+    ok = True
+    for name, percepts in positions(range(options.seeds)):
+        print(name)
+        for depth in range(1, options.depth + 1):
+            results = perft(percepts, depth)
+            agree = len(set(n for _, n, _ in results)) == 1
+            ok = ok and agree
+            print("  depth %d: %s" % (depth, "ok" if agree else "MISMATCH"))
+            for engine, n, t in results:
+                print("    %-9s %10d nodes %8.3fs %12.0f nodes/s" %
+                      (engine, n, t, n / t if t else float("inf")))
+    exit(0 if ok else 1)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling of a player while it plays real games.
+
+PlayerProfiler wraps the play, play_session and start_session methods of a
+Player instance, so a player served by sarena.player_main can be profiled
+without changing its source (see the --profile and --sample options).
+
+Two profilers are available:
+ - cProfile, writing a pstats file per step (DIR/game-G-step-S.prof) or per
+   game (DIR/game-G.prof);
+ - a sampling profiler, a thread which looks at the stack of the playing
+   thread every few milliseconds. Its overhead does not depend on the number
+   of function calls, so the hot paths (Board.get_actions, get_height,
+   State.gen_successors, score_at, ...) keep their real weight. The samples
+   are written in the collapsed stack format ("frame;frame;frame count")
+   read by flamegraph.pl, speedscope and most flame graph tools.
+
+Run this module on the output files to print a summary of them.
+
+"""
+
+import cProfile
+import os
+import sys
+import threading
+
+
+def frame_name(code):
+    """Return the name of a code object in collapsed stacks."""
+    return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+
+class StackSampler(threading.Thread):
+
+    """Thread sampling the stacks of the threads being profiled.
+
+    Only the frames above the frame registered with begin are recorded, so
+    the stacks start at the play method instead of the server loop.
+
+    """
+
+    def __init__(self, interval=0.001):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.roots = {}  # thread ident -> root frame
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def begin(self, root):
+        with self.lock:
+            self.roots[threading.get_ident()] = root
+
+    def end(self):
+        with self.lock:
+            self.roots.pop(threading.get_ident(), None)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if not self.roots:
+                    continue
+                frames = sys._current_frames()
+                for ident, root in self.roots.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None and frame is not root:
+                        stack.append(frame_name(frame.f_code))
+                        frame = frame.f_back
+                    if frame is None or not stack:
+                        continue
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                    self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, filename):
+        """Write the samples in the collapsed stack format."""
+        with self.lock:
+            stacks = sorted(self.stacks.items())
+        with open(filename, "w") as f:
+            for stack, count in stacks:
+                f.write("%s %d\n" % (stack, count))
+
+
+class PlayerProfiler:
+
+    """Profile the moves of a player.
+
+    Arguments:
+    player -- the Player instance to profile
+    directory -- directory of the pstats files, or None to disable cProfile
+    per_step -- if True, write a pstats file per step, else one per game
+    sample_file -- collapsed stacks file, or None to disable sampling
+    interval -- sampling interval in seconds
+
+    A new game starts with start_session or when the step number does not
+    increase.
+
+    """
+
+    def __init__(self, player, directory=None, per_step=False,
+                 sample_file=None, interval=0.001):
+        self.player = player
+        self.directory = directory
+        self.per_step = per_step
+        self.sample_file = sample_file
+        self.game = 0
+        self.last_step = None
+        self.profile = None
+        self.active = threading.local()
+        self.sampler = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        if sample_file is not None:
+            self.sampler = StackSampler(interval)
+
+    def install(self):
+        """Replace the methods of the player by profiled ones."""
+        for name in ("play", "play_session"):
+            setattr(self.player, name, self._wrap(getattr(self.player, name)))
+        start_session = self.player.start_session
+
+        def profiled_start_session(percepts):
+            self.new_game()
+            return start_session(percepts)
+        self.player.start_session = profiled_start_session
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def _wrap(self, method):
+        def profiled(*args):
+            if getattr(self.active, "on", False):
+                return method(*args)  # e.g. play called by play_session
+            self.active.on = True
+            try:
+                return self._call(method, args, args[-2])
+            finally:
+                self.active.on = False
+        return profiled
+
+    def _call(self, method, args, step):
+        if self.last_step is not None and step <= self.last_step:
+            self.new_game()
+        self.last_step = step
+        if self.directory is not None and self.profile is None:
+            self.profile = cProfile.Profile()
+        if self.sampler is not None:
+            self.sampler.begin(sys._getframe())
+        if self.profile is not None:
+            self.profile.enable()
+        try:
+            return method(*args)
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+            if self.sampler is not None:
+                self.sampler.end()
+            if self.per_step:
+                self.dump("game-%d-step-%d.prof" % (self.game, step))
+
+    def dump(self, name):
+        """Write the current cProfile statistics to name and reset them."""
+        if self.profile is not None:
+            self.profile.dump_stats(os.path.join(self.directory, name))
+            self.profile = None
+
+    def new_game(self):
+        """Write the statistics of the current game and start a new one."""
+        if not self.per_step:
+            self.dump("game-%d.prof" % self.game)
+        if self.sampler is not None:
+            self.sampler.write(self.sample_file)
+        self.game += 1
+        self.last_step = None
+
+    def close(self):
+        """Write the remaining statistics and stop sampling."""
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.last_step is not None:
+            self.new_game()
+
+
+def print_collapsed(filename, limit):
+    """Print the functions with most samples in a collapsed stacks file."""
+    own = {}
+    total = {}
+    samples = 0
+    with open(filename) as f:
+        for line in f:
+            stack, count = line.rsplit(" ", 1)
+            count = int(count)
+            frames = stack.split(";")
+            samples += count
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for name in set(frames):
+                total[name] = total.get(name, 0) + count
+    print("%s: %d samples" % (filename, samples))
+    print("%8s %8s  function" % ("own %", "total %"))
+    for name in sorted(total, key=lambda n: -own.get(n, 0))[:limit]:
+        print("%8.1f %8.1f  %s" % (100.0 * own.get(name, 0) / samples,
+                                   100.0 * total[name] / samples, name))
+
+
+if __name__ == "__main__":
+    import pstats
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] FILE...",
+                          description="Summarize pstats files (merged) or" +
+                          " collapsed stack files written by a profiled" +
+                          " player.")
+    parser.add_option("-n", "--lines", type="int", dest="lines", default=25,
+                      help="number of functions to print (default: %default)")
+    parser.add_option("-s", "--sort", dest="sort", default="cumulative",
+                      help="pstats sort key (default: %default)")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("need files to summarize")
+    prof = [f for f in args if f.endswith(".prof")]
+    for filename in args:
+        if filename not in prof:
+            print_collapsed(filename, options.lines)
+    if prof:
+        pstats.Stats(*prof).sort_stats(options.sort).print_stats(options.lines)
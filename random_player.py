@@ -28,8 +28,10 @@ class RandomPlayer(Player):
 
     """A dumb random Sarena player."""
 
+    readonly_percepts = True
+
     def play(self, percepts, step, time_left):
-        b = Board(percepts)
+        b = BoardView(percepts)
         return random.choice(list(b.get_actions()))
 
 
@@ -20,6 +20,7 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 import random
 import pickle
+import hashlib
 
 def random_board():
     """Returns a random initial board."""
@@ -138,6 +139,14 @@ class Board:
         """Return a clone of this object."""
         return Board(self.m)
 
+    def digest(self, invert=False):
+        """Return the 64-bit digest of the board (see percepts_digest)."""
+        return percepts_digest(self.m, invert)
+
+    def position(self, invert=False):
+        """Return the board as an immutable Position."""
+        return Position.from_percepts(self.m, invert)
+
     def get_percepts(self, invert=False):
         """Return the percepts corresponding to the current state.
 
@@ -303,6 +312,15 @@ class Board:
             newTow.append(tower[i])
         return newTow
 
+    def pack(self, invert=False):
+        """Return the board in the packed binary form of pack_percepts."""
+        return pack_percepts(self.m, invert)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        """Return a new Board from the packed form in data at offset."""
+        return cls(unpack_percepts(data, offset))
+
     def write(self, filename):
         """Write the board to a file."""
         f = None
@@ -313,6 +331,126 @@ class Board:
             if f is not None:
                 f.close()
 
+class PerceptsView:
+
+    """Read-only view of percepts, optionally inverting the players.
+
+    The percepts are not copied: indexing a view gives the rows of the
+    percepts themselves, which must not be modified, or with invert, rows
+    whose tokens are inverted when they are accessed. A view can be used
+    wherever percepts are only read, e.g. by BoardView or pack_percepts.
+
+    """
+
+    __slots__ = ("percepts", "invert")
+
+    def __init__(self, percepts, invert=False):
+        if isinstance(percepts, PerceptsView):
+            invert = invert != percepts.invert
+            percepts = percepts.percepts
+        self.percepts = percepts
+        self.invert = invert
+
+    def __len__(self):
+        return len(self.percepts)
+
+    def __getitem__(self, i):
+        if self.invert:
+            return _InvertedRow(self.percepts[i])
+        return self.percepts[i]
+
+    def __iter__(self):
+        for i in range(len(self.percepts)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return self.copy() == other
+
+    def copy(self):
+        """Return the viewed percepts as new lists."""
+        return [[list(cell) for cell in row] for row in self]
+
+
+def _invert_token(token):
+    a, b = token
+    return [-a if a == 1 or a == -1 else a, -b if b == 1 or b == -1 else b]
+
+
+class _InvertedRow:
+
+    """Row of an inverted PerceptsView."""
+
+    __slots__ = ("row",)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __len__(self):
+        return len(self.row)
+
+    def __getitem__(self, j):
+        return _InvertedCell(self.row[j])
+
+    def __iter__(self):
+        for cell in self.row:
+            yield _InvertedCell(cell)
+
+
+class _InvertedCell:
+
+    """Cell of an inverted PerceptsView."""
+
+    __slots__ = ("cell",)
+
+    def __init__(self, cell):
+        self.cell = cell
+
+    def __len__(self):
+        return len(self.cell)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[x] for x in range(*k.indices(len(self.cell)))]
+        if k == 0 or k == -len(self.cell):
+            return self.cell[k]
+        return _invert_token(self.cell[k])
+
+    def __iter__(self):
+        for k in range(len(self.cell)):
+            yield self[k]
+
+
+class BoardView(Board):
+
+    """Read-only Board on percepts, which are not copied.
+
+    invert is as for Board. The board cannot be played on, but clone
+    returns a normal Board.
+
+    """
+
+    def __init__(self, percepts, invert=False):
+        view = PerceptsView(percepts, invert)
+        self.m = view if view.invert else view.percepts
+        self.rows = len(self.m)
+        self.columns = len(self.m[0])
+        # the moves do not depend on the colors, they are found on the
+        # percepts themselves rather than through the inverted view
+        self.moves = BoardView(view.percepts) if view.invert else self
+
+    def is_action_valid(self, action):
+        return Board.is_action_valid(self.moves, action)
+
+    def get_tower_actions(self, i, j):
+        return Board.get_tower_actions(self.moves, i, j)
+
+    def get_actions(self):
+        return Board.get_actions(self.moves)
+
+    def play_action(self, action):
+        raise TypeError("a BoardView cannot be played on, clone it first")
+
+
 def load_percepts(pickleFile):
     """Load percepts from a pickle file.
 
@@ -326,6 +464,328 @@ def load_percepts(pickleFile):
             f.close()
 
 
+# Half-token codes used by the packed board format.
+# 0 is no token, 1 is yellow, 2 is red and 3 is neutral.
+HALF_CODES = {0: 0, 1: 1, -1: 2, 2: 3}
+HALF_VALUES = (0, 1, -1, 2)
+INVERTED_HALF_CODES = {0: 0, 1: 2, -1: 1, 2: 3}
+
+
+def pack_percepts(percepts, invert=False):
+    """Pack percepts in a compact binary form and return it as bytes.
+
+    The packed form starts with the number of rows and columns (one byte
+    each), followed by one byte per cell (bit 7 is set for an arrow cell,
+    bits 0-2 give the height of the tower) and finally the tokens of all
+    towers, bottom to top, two tokens per byte. A token is a nibble whose
+    two high bits code the bottom half and two low bits the top half (see
+    HALF_CODES). An initial 6x6 board packs in 56 bytes.
+
+    If invert is True, the colors of the players are swapped while packing.
+
+    """
+    codes = INVERTED_HALF_CODES if invert else HALF_CODES
+    rows = len(percepts)
+    columns = len(percepts[0])
+    cells = bytearray((rows, columns))
+    nibbles = []
+    for i in range(rows):
+        for j in range(columns):
+            cell = percepts[i][j]
+            height = 0
+            for token in cell[1:]:
+                if token[0] == 0:
+                    break
+                nibbles.append((codes[token[0]] << 2) | codes[token[1]])
+                height += 1
+            cells.append((0x80 if cell[0] == 4 else 0) | height)
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    cells.extend((nibbles[k] << 4) | nibbles[k + 1]
+                 for k in range(0, len(nibbles), 2))
+    return bytes(cells)
+
+
+def unpack_percepts(data, offset=0):
+    """Return the percepts packed by pack_percepts in data at offset."""
+    rows, columns = data[offset], data[offset + 1]
+    n = rows * columns
+    cells = data[offset + 2:offset + 2 + n]
+    pos = (offset + 2 + n) * 2  # position in nibbles
+    percepts = []
+    for i in range(rows):
+        row = []
+        for j in range(columns):
+            c = cells[i * columns + j]
+            cell = [4 if c & 0x80 else 3]
+            for k in range(c & 0x07):
+                byte = data[pos >> 1]
+                nibble = byte & 0x0f if pos & 1 else byte >> 4
+                cell.append([HALF_VALUES[nibble >> 2],
+                             HALF_VALUES[nibble & 0x03]])
+                pos += 1
+            while len(cell) < 5:
+                cell.append([0, 0])
+            row.append(cell)
+        percepts.append(row)
+    return percepts
+
+
+def packed_percepts_size(data, offset=0):
+    """Return the length in bytes of the packed percepts at offset."""
+    n = data[offset] * data[offset + 1]
+    tokens = sum(c & 0x07 for c in data[offset + 2:offset + 2 + n])
+    return 2 + n + (tokens + 1) // 2
+
+
+# Directions of an action, in the order used by action codes.
+DIRECTIONS = ((-1, 0), (0, 1), (1, 0), (0, -1))
+
+
+def action_to_code(action, columns):
+    """Return the action as an integer code.
+
+    The code is 4 * (i1 * columns + j1) + d, where d is the index of the
+    direction of the move in DIRECTIONS. On a 6x6 board, codes fit in a
+    byte.
+
+    """
+    i1, j1, i2, j2 = action
+    return 4 * (i1 * columns + j1) + DIRECTIONS.index((i2 - i1, j2 - j1))
+
+
+def code_to_action(code, columns):
+    """Return the action corresponding to the code (see action_to_code)."""
+    i1, j1 = divmod(code >> 2, columns)
+    di, dj = DIRECTIONS[code & 3]
+    return (i1, j1, i1 + di, j1 + dj)
+
+
+def percepts_digest(percepts, invert=False):
+    """Return a 64-bit digest of the percepts, as an integer.
+
+    The digest only depends on the content of the board, so that the
+    referee and a player can check that they agree on it.
+
+    """
+    h = hashlib.blake2b(pack_percepts(percepts, invert), digest_size=8)
+    return int.from_bytes(h.digest(), "big")
+
+
+# Nibble of a token with its halves swapped, as when a tower is returned.
+FLIPPED_NIBBLES = tuple(((n & 3) << 2) | (n >> 2) for n in range(16))
+# Nibble of a token with the colors of the players swapped.
+INVERTED_NIBBLES = tuple((INVERTED_HALF_CODES[HALF_VALUES[n >> 2]] << 2) |
+                         INVERTED_HALF_CODES[HALF_VALUES[n & 3]]
+                         for n in range(16))
+
+
+class Position:
+
+    """Immutable and compact value of a board.
+
+    A Position holds the same content as Board.m in two bytes objects:
+    types, one byte per cell (3 or 4, as the first element of a cell), and
+    towers, two bytes per cell giving the tokens of the tower as four
+    nibbles, bottom first, coded as by pack_percepts (0 is no token). A 6x6
+    position takes about 250 bytes, the types being shared by the positions
+    of a game, instead of about 25 kB for the lists of Board.m.
+
+    Positions are hashable and compared by value, so they can be used as
+    dictionary keys, and pickle to a few bytes. Copying returns the same
+    object, and with_action returns a new position sharing the cell types.
+
+    """
+
+    __slots__ = ("rows", "columns", "types", "towers", "_hash")
+
+    def __init__(self, rows, columns, types, towers):
+        set_slot = object.__setattr__
+        set_slot(self, "rows", rows)
+        set_slot(self, "columns", columns)
+        set_slot(self, "types", types)
+        set_slot(self, "towers", towers)
+        set_slot(self, "_hash", None)
+
+    @classmethod
+    def from_percepts(cls, percepts, invert=False):
+        """Return the position of the percepts.
+
+        If invert is True, the colors of the players are swapped.
+
+        """
+        codes = INVERTED_HALF_CODES if invert else HALF_CODES
+        rows = len(percepts)
+        columns = len(percepts[0])
+        types = bytearray()
+        towers = bytearray()
+        for row in percepts:
+            for cell in row:
+                types.append(cell[0])
+                tower = 0
+                for k, token in enumerate(cell[1:5]):
+                    if token[0] == 0:
+                        break
+                    tower |= ((codes[token[0]] << 2) | codes[token[1]]) << \
+                        (12 - 4 * k)
+                towers += tower.to_bytes(2, "big")
+        return cls(rows, columns, bytes(types), bytes(towers))
+
+    def get_percepts(self, invert=False):
+        """Return the percepts of the position, as Board.get_percepts."""
+        values = HALF_VALUES
+        percepts = []
+        for i in range(self.rows):
+            row = []
+            for j in range(self.columns):
+                k = i * self.columns + j
+                tower = self.towers[2 * k] << 8 | self.towers[2 * k + 1]
+                cell = [self.types[k]]
+                for shift in (12, 8, 4, 0):
+                    nibble = (tower >> shift) & 15
+                    if invert:
+                        nibble = INVERTED_NIBBLES[nibble]
+                    cell.append([values[nibble >> 2], values[nibble & 3]])
+                row.append(cell)
+            percepts.append(row)
+        return percepts
+
+    def to_board(self, invert=False):
+        """Return a new Board holding the position."""
+        return Board(self.get_percepts(invert))
+
+    def inverted(self):
+        """Return the position with the colors of the players swapped."""
+        towers = bytearray(self.towers)
+        for k in range(0, len(towers), 2):
+            tower = towers[k] << 8 | towers[k + 1]
+            tower = sum(INVERTED_NIBBLES[(tower >> shift) & 15] << shift
+                        for shift in (12, 8, 4, 0))
+            towers[k:k + 2] = tower.to_bytes(2, "big")
+        return Position(self.rows, self.columns, self.types, bytes(towers))
+
+    def pack(self, invert=False):
+        """Return the position packed as by pack_percepts."""
+        towers = [self.tower_nibbles(k) for k in range(len(self.types))]
+        cells = bytearray((self.rows, self.columns))
+        cells.extend((0x80 if t == 4 else 0) | len(tower)
+                     for t, tower in zip(self.types, towers))
+        nibbles = [INVERTED_NIBBLES[n] if invert else n
+                   for tower in towers for n in tower]
+        if len(nibbles) % 2:
+            nibbles.append(0)
+        cells.extend((nibbles[k] << 4) | nibbles[k + 1]
+                     for k in range(0, len(nibbles), 2))
+        return bytes(cells)
+
+    def digest(self, invert=False):
+        """Return the 64-bit digest of the position (see percepts_digest)."""
+        h = hashlib.blake2b(self.pack(invert), digest_size=8)
+        return int.from_bytes(h.digest(), "big")
+
+    def tower_nibbles(self, k):
+        """Return the token nibbles of the tower of cell k, bottom first."""
+        tower = self.towers[2 * k] << 8 | self.towers[2 * k + 1]
+        nibbles = []
+        for shift in (12, 8, 4, 0):
+            nibble = (tower >> shift) & 15
+            if not nibble:
+                break
+            nibbles.append(nibble)
+        return nibbles
+
+    def get_height(self, i, j):
+        """Return the height of the tower on cell (i, j)."""
+        return len(self.tower_nibbles(i * self.columns + j))
+
+    def is_action_valid(self, action):
+        """Return whether action is a valid action, as Board does."""
+        try:
+            i1, j1, i2, j2 = action
+            if i1 < 0 or j1 < 0 or i2 < 0 or j2 < 0 or \
+               i1 >= self.rows or j1 >= self.columns or \
+               i2 >= self.rows or j2 >= self.columns or \
+               abs(i1 - i2) + abs(j1 - j2) != 1:
+                return False
+        except (TypeError, ValueError):
+            return False
+        h1 = self.get_height(i1, j1)
+        h2 = self.get_height(i2, j2)
+        return 0 < h1 and h1 + h2 <= Board.max_height and \
+            (h2 > 0 or self.types[i2 * self.columns + j2] == 4)
+
+    def get_actions(self):
+        """Yield all valid actions, in the order of Board.get_actions."""
+        for i in range(self.rows):
+            for j in range(self.columns):
+                if self.get_height(i, j):
+                    for di, dj in ((-1, 0), (0, -1), (0, 1), (1, 0)):
+                        action = (i, j, i + di, j + dj)
+                        if self.is_action_valid(action):
+                            yield action
+
+    def is_finished(self):
+        """Return whether no more moves can be made."""
+        for action in self.get_actions():
+            return False
+        return True
+
+    def with_action(self, action):
+        """Return the position after playing action.
+
+        Raise InvalidAction if the action is invalid.
+
+        """
+        if not self.is_action_valid(action):
+            raise InvalidAction(action)
+        i1, j1, i2, j2 = action
+        k1 = 2 * (i1 * self.columns + j1)
+        k2 = 2 * (i2 * self.columns + j2)
+        towers = self.towers
+        moved = towers[k1] << 8 | towers[k1 + 1]
+        target = towers[k2] << 8 | towers[k2 + 1]
+        if target:
+            target |= moved >> (4 * len(self.tower_nibbles(k2 // 2)))
+        else:  # returned on an arrow cell
+            for shift in (12, 8, 4, 0):
+                nibble = (moved >> shift) & 15
+                if nibble:
+                    target = target >> 4 | FLIPPED_NIBBLES[nibble] << 12
+        towers = bytearray(towers)
+        towers[k1:k1 + 2] = b"\0\0"
+        towers[k2:k2 + 2] = target.to_bytes(2, "big")
+        return Position(self.rows, self.columns, self.types, bytes(towers))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Position is immutable")
+
+    __delattr__ = __setattr__
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return NotImplemented
+        return self.towers == other.towers and self.types == other.types \
+            and self.columns == other.columns
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash",
+                               hash((self.columns, self.types, self.towers)))
+        return self._hash
+
+    def __reduce__(self):
+        return (Position, (self.rows, self.columns, self.types, self.towers))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return "Position.from_percepts(%r)" % (self.get_percepts(),)
+
+
 class Player:
 
     """Interface for a Sarena player"""
@@ -346,11 +806,106 @@ class Player:
         """
         pass
 
+    # Whether play only reads its percepts, e.g. through a BoardView. Local
+    # referees then pass a PerceptsView of their own board instead of a copy.
+    readonly_percepts = False
+
+    # Search metrics of the last move, returned by get_metrics. Players set
+    # it in play (see get_metrics for the keys).
+    metrics = {}
+
+    # Whether play should collect the metrics that cost time in the search,
+    # like counting the nodes. Set by the --metrics option of player_main.
+    collect_metrics = False
+
+    def get_metrics(self):
+        """Return a dictionary of search metrics about the last move.
+
+        All keys are optional:
+        depth -- depth of the deepest completed search
+        nodes -- number of nodes visited
+        nps -- nodes per second
+        tt_fill -- fraction of the transposition table in use
+        time_budget -- seconds the player allowed itself for the move
+        time_used -- seconds actually taken by the search
+        book -- True if the move was taken from an opening book
+
+        """
+        return self.metrics
+
+    # Stateful sessions
+    #
+    # Instead of sending the whole board at every step, the referee may send
+    # it once with start_session and then only the last action of the
+    # opponent with play_session. The player keeps the board up to date and
+    # returns a digest of it with its action, so that the referee can check
+    # that both boards are in sync.
+
+    def start_session(self, percepts):
+        """Start a session on the given board and return its hex digest."""
+        self._session_board = Board(percepts)
+        self.session_started(self._session_board)
+        return "%016x" % self._session_board.digest()
+
+    def play_session(self, action, step, time_left):
+        """Play the opponent's action and return [action, digest].
+
+        Arguments:
+        action -- the last action of the opponent, or None if there is none
+        step, time_left -- as for play
+
+        The returned action is the one chosen by the player, and digest the
+        hex digest of the board on which it was chosen.
+
+        """
+        board = self._session_board
+        if action is not None and board.is_action_valid(action):
+            # an invalid action means the boards are out of sync, which the
+            # referee notices with the digest
+            board.play_action(action)
+            self.session_moved(action)
+        digest = "%016x" % board.digest()
+        own = self.session_play(step, time_left)
+        if board.is_action_valid(own):
+            board.play_action(own)
+            self.session_moved(own)
+        return [own, digest]
+
+    def session_started(self, board):
+        """Called when a session starts on board. Does nothing by default."""
+        pass
+
+    def session_moved(self, action):
+        """Called after action was played in the session board."""
+        pass
+
+    def session_play(self, step, time_left):
+        """Return the action to play on the session board.
 
-def serve_player(player, address, port):
-    """Serve player on specified bind address and port number."""
-    from xmlrpc.server import SimpleXMLRPCServer
-    server = SimpleXMLRPCServer((address, port))
+        The default implementation calls play with the percepts of the
+        session board. Override it together with session_started and
+        session_moved to keep an incremental state instead.
+
+        """
+        board = self._session_board
+        if self.readonly_percepts:
+            return self.play(PerceptsView(board.m), step, time_left)
+        return self.play(board.get_percepts(), step, time_left)
+
+
+def serve_player(player, address, port, binary=True):
+    """Serve player on specified bind address and port number.
+
+    If binary is True, the compact binary protocol of the wire module is
+    accepted on the same port in addition to XML-RPC.
+
+    """
+    if binary:
+        from wire import BinaryXMLRPCServer
+        server = BinaryXMLRPCServer((address, port))
+    else:
+        from xmlrpc.server import SimpleXMLRPCServer
+        server = SimpleXMLRPCServer((address, port))
     server.register_instance(player)
     print("Listening on " + address + ":" + str(port))
     try:
@@ -378,6 +933,26 @@ def player_main(player, options_cb=None, setup_cb=None):
                       help="bind to address ADDRESS (default: all addresses)")
     parser.add_option("-p", "--port", type="int", dest="port", default=8000,
                       help="set port number (default: %default)")
+    parser.add_option("--no-binary",
+                      action="store_false", dest="binary", default=True,
+                      help="only accept XML-RPC, not the binary protocol")
+    parser.add_option("--metrics", action="store_true", dest="metrics",
+                      default=False, help="collect search metrics for the" +
+                           " referee, at some cost in search speed")
+    parser.add_option("--profile", dest="profile", choices=["step", "game"],
+                      help="profile the moves with cProfile and write a" +
+                           " pstats file per step or per game", metavar="MODE")
+    parser.add_option("--profile-dir", dest="profile_dir", default="profiles",
+                      help="directory of the pstats files (default: %default)",
+                      metavar="DIR")
+    parser.add_option("--sample", dest="sample",
+                      help="sample the stacks during the moves and write them" +
+                           " to FILE in the collapsed format of flame graph" +
+                           " tools", metavar="FILE")
+    parser.add_option("--sample-interval", type="float",
+                      dest="sample_interval", default=1.0,
+                      help="sampling interval in milliseconds" +
+                           " (default: %default)", metavar="MS")
     if options_cb is not None:
         options_cb(player, parser)
     (options, args) = parser.parse_args()
@@ -385,6 +960,20 @@ def player_main(player, options_cb=None, setup_cb=None):
         parser.error("no arguments needed")
     if options.port < 1 or options.port > 65535:
         parser.error("option -p: invalid port number")
+    player.collect_metrics = options.metrics
     if setup_cb is not None:
         setup_cb(player, parser, options)
-    serve_player(player, options.address, options.port)
+    profiler = None
+    if options.profile or options.sample:
+        from profiling import PlayerProfiler
+        profiler = PlayerProfiler(player,
+                                  options.profile_dir if options.profile
+                                  else None, options.profile == "step",
+                                  options.sample,
+                                  options.sample_interval / 1000.0)
+        profiler.install()
+    try:
+        serve_player(player, options.address, options.port, options.binary)
+    finally:
+        if profiler is not None:
+            profiler.close()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Self-play position dataset for fitting evaluation weights.
+
+Games between local players are played in parallel from seeded random
+boards (sarena.random_board). Every position of a game is recorded, seen by
+the player to move, with the final score of the game from that player's
+point of view.
+
+The dataset is a directory of shards (shard-00000.npy, ...), each a NumPy
+array of POSITION_DTYPE records written by one worker. They are opened with
+mmap_mode="r", so millions of positions are loaded without any Python
+object per position. A position is 36 int8 cells holding the same
+(height, bottom color, top color) triple as super_player.State:
+
+    bits 0-2   height of the tower (0 to 4)
+    bits 3-4   color of the bottom of the tower
+    bits 5-6   color of the top of the tower
+
+with the colors coded 0 for neutral, 1 for the player to move and 2 for
+its opponent (empty cells are 0).
+
+This module requires NumPy.
+
+"""
+
+import glob
+import os
+import random
+from multiprocessing import Pool
+
+import numpy as np
+
+from sarena import *
+
+POSITION_DTYPE = np.dtype([("cells", np.int8, (36,)),  # see above
+                           ("outcome", np.int8),      # final score
+                           ("step", np.uint8),        # step to be played
+                           ("seed", np.int32)])       # seed of the board
+
+COLOR_CODES = {2: 0, 1: 1, -1: 2}
+SHARD_PATTERN = "shard-%05d.npy"
+
+PLAYERS = ("random", "simple", "eval_base", "eval_ours", "super")
+
+
+def make_player(name):
+    """Return a new local player instance by name."""
+    if name == "random":
+        from random_player import RandomPlayer
+        return RandomPlayer()
+    if name == "simple":
+        from simple_player import SimplePlayer
+        return SimplePlayer()
+    if name == "eval_base":
+        from eval_player_base import EvalPlayerBase
+        return EvalPlayerBase()
+    if name == "eval_ours":
+        from eval_player_ours import EvalPlayerOurs
+        return EvalPlayerOurs()
+    if name == "super":
+        from super_player import State, SuperPlayer
+        State.setup()
+        return SuperPlayer()
+    raise ValueError("unknown player: %s" % name)
+
+
+def encode_percepts(percepts, out=None):
+    """Encode the percepts of a 6x6 board as 36 int8 cells (see above)."""
+    if out is None:
+        out = np.zeros(36, np.int8)
+    k = 0
+    for row in percepts:
+        for cell in row:
+            height = 0
+            while height < 4 and cell[height + 1][0] != 0:
+                height += 1
+            if height:
+                out[k] = height | COLOR_CODES[cell[1][0]] << 3 | \
+                    COLOR_CODES[cell[height][1]] << 5
+            else:
+                out[k] = 0
+            k += 1
+    return out
+
+
+def decode_cells(cells):
+    """Return the heights, bottom and top colors of encoded cells.
+
+    cells is an int8 array of any shape. The colors are returned as in
+    super_player.State: 1 for the player to move, -1 for its opponent and 0
+    for neutral.
+
+    """
+    cells = np.asarray(cells, np.int8)
+    colors = np.array([0, 1, -1, 0], np.int8)
+    return cells & 7, colors[(cells >> 3) & 3], colors[(cells >> 5) & 3]
+
+
+def play_shard(task):
+    """Play the games of a shard and write it. Return its number of rows.
+
+    task is (filename, seeds, player names, time credit).
+
+    """
+    from game import play_game
+    filename, seeds, names, credit = task
+    players = [make_player(name) for name in names]
+    games = []
+    for seed in seeds:
+        random.seed(seed)
+        trace = play_game(players, Board(random_board()),
+                          credits=[credit, credit])
+        if trace.reason:
+            continue  # forfeit, the score says nothing about the positions
+        # returning towers on empty arrow cells does not reduce the number
+        # of towers, so a game may last more than 36 steps
+        rows = np.zeros(len(trace.actions), POSITION_DTYPE)
+        board = trace.get_initial_board()
+        for step, (action, t) in enumerate(trace.actions, 1):
+            yellow = step % 2 == 1
+            row = rows[step - 1]
+            encode_percepts(board.get_percepts(not yellow), row["cells"])
+            row["outcome"] = trace.score if yellow else -trace.score
+            row["step"] = step
+            row["seed"] = seed
+            board.play_action(action)
+        games.append(rows)
+    rows = np.concatenate(games) if games else \
+        np.zeros(0, POSITION_DTYPE)
+    n = len(rows)
+    tmp = filename + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=POSITION_DTYPE,
+                                    shape=(n,))
+    out[:] = rows
+    out.flush()
+    del out
+    os.replace(tmp, filename)  # a shard file is always complete
+    return n
+
+
+def generate(directory, games, games_per_shard, players, credit=None,
+             first_seed=0, jobs=None):
+    """Generate a dataset and return the number of positions written.
+
+    Shards already present in directory are kept, so an interrupted run can
+    be resumed with the same arguments.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    tasks = []
+    for shard, start in enumerate(range(0, games, games_per_shard)):
+        filename = os.path.join(directory, SHARD_PATTERN % shard)
+        if not os.path.exists(filename):
+            seeds = range(first_seed + start,
+                          first_seed + min(start + games_per_shard, games))
+            tasks.append((filename, seeds, players, credit))
+    with Pool(jobs) as pool:
+        return sum(pool.imap_unordered(play_shard, tasks))
+
+
+def load_dataset(directory):
+    """Return the list of the shards of a dataset, memory-mapped."""
+    return [np.load(f, mmap_mode="r")
+            for f in sorted(glob.glob(os.path.join(directory, "shard-*.npy")))]
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] DIRECTORY",
+                          description="Generate a self-play position dataset.")
+    parser.add_option("-n", "--games", type="int", dest="games",
+                      default=1000, help="number of games (default: %default)")
+    parser.add_option("-g", "--shard-games", type="int", dest="shard_games",
+                      default=100,
+                      help="number of games per shard (default: %default)")
+    parser.add_option("-p", "--player", action="append", dest="players",
+                      choices=PLAYERS, help="player (one of %s; give it twice" %
+                      ", ".join(PLAYERS) + " for different players," +
+                      " default: super)")
+    parser.add_option("-t", "--time", type="float", dest="time", default=2.0,
+                      help="time credit of each player per game in seconds," +
+                           " 0 for none (default: %default)")
+    parser.add_option("-s", "--seed", type="int", dest="seed", default=0,
+                      help="seed of the first board (default: %default)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs",
+                      default=os.cpu_count(),
+                      help="number of processes (default: %default)")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("need the dataset directory")
+    players = options.players or ["super"]
+    if len(players) == 1:
+        players = players * 2
+    elif len(players) != 2:
+        parser.error("at most two players")
+    n = generate(args[0], options.games, options.shard_games, players,
+                 options.time or None, options.seed, options.jobs)
+    shards = load_dataset(args[0])
+    print("%d new positions, %d positions in %d shards" %
+          (n, sum(len(s) for s in shards), len(shards)))
@@ -20,12 +20,22 @@ class SimplePlayer(Player, minimax.Game):
         # TODO: remove depth limitation
         return depth >= 2 or board.is_finished()
 
+    def expand(self, board, depth):
+        # a finished board has no successors, no need to test it first
+        if depth >= 2:
+            return True, ()
+        return False, self.successors(board)
+
     def evaluate(self, board):
         return board.get_score()
 
     def play(self, percepts, step, time_left):
         board = Board(percepts)
-        return minimax.search(board, self)
+        stats = minimax.SearchStats() if self.collect_metrics else None
+        action = minimax.search(board, self, stats=stats)
+        if stats is not None:
+            self.metrics = stats.metrics()
+        return action
 
 if __name__ == "__main__":
     player_main(SimplePlayer())
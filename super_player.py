@@ -4,6 +4,7 @@
 '''Benoit Daloze & Xavier de Ryckel'''
 
 from sarena import *
+from itertools import chain
 from time import time
 
 NO_CHIP_TUPLE = [0,0]
@@ -141,9 +142,47 @@ class State:
             successors.sort(key=lambda a_s: a_s[1][SCORE], reverse=(player==1))
             return successors
 
+    # single pass expansion of a node for negamax
+    def expand(state, player, depth_left):
+        """Return (successors, finished) for state.
+
+        The successors are ordered as by successors and finished tells
+        whether there are none, the moves being generated only once.
+
+        """
+        if depth_left == 1:
+            successors = State.gen_successors(state)
+            first = next(successors, None)
+            if first is None:
+                return (), True
+            return chain((first,), successors), False
+        successors = list(State.gen_successors(state))
+        if not successors:
+            return successors, True
+        successors.sort(key=lambda a_s: a_s[1][SCORE], reverse=(player==1))
+        return successors, False
+
     def to_board_action(action):
         return (action[0]//6, action[0]%6, action[1]//6, action[1]%6)
 
+    def from_board_action(action):
+        i1, j1, i2, j2 = action
+        return (i1*6+j1, i2*6+j2)
+
+    def play(state, action):
+        """Return the state after playing the (i, n) action"""
+        i, n = action
+        height, bot, top = state[i]
+        nheight, nbot, ntop = state[n]
+        s = state[:]
+        s[i] = EMPTY_PILE
+        if nheight:
+            s[n] = (height + nheight, nbot, top)
+        else:
+            s[n] = (height, top, bot)
+        s[SCORE] = State.incremental_score(state, i, n, s, State.ARROWS[i][1])
+        return s
+
     def is_finished(state):
         for _, _ in State.gen_successors(state):
             return False
@@ -232,18 +271,48 @@ inf = float("inf")
 class MyTimeoutError(Exception):
     pass
 
-def negamax(state, max_depth, stop_time):
+# Selective search, off by default (see the --lmr and --futility options)
+#
+# Late move reductions: at nodes with at least LMR_DEPTH plies left, the
+# moves after the first LMR_MOVES ones of the ordered list are searched one
+# ply shallower, and again to full depth if they beat alpha.
+#
+# Futility pruning: with d plies left, d < len(FUTILITY_MARGINS), a move is
+# skipped if its incremental score plus FUTILITY_MARGINS[d] cannot beat
+# alpha. With one ply left, the score is the value of the move, so the
+# pruning is exact. The other margins bound the gain of the next plies on
+# the positions of bench.py (at most -6 for one reply, 27 for a reply and
+# an answer).
+LMR_DEPTH = 3
+LMR_MOVES = 3
+FUTILITY_MARGINS = (0, 0, 10, 30)
+
+def negamax(state, max_depth, stop_time, root=None):
+    """Search state to max_depth and return the best action.
+
+    root is the list of [action, state, score] of the root moves, in the
+    order in which to search them, or None. The score of each move is set
+    as soon as the move is searched, so that the moves searched before a
+    MyTimeoutError can still be used. It is exact for the best move so far
+    and an upper bound for the other ones.
+
+    The selective search options are read from SuperPlayer.lmr and
+    SuperPlayer.futility. The scores are then those of the selective search.
+
+    """
     def rec(state, alpha, beta, depth, color):
+        SuperPlayer.nodes += 1
         if stop_time and time() >= stop_time:
             raise MyTimeoutError()
         if depth == max_depth:
             return color * state[SCORE]
-        if State.is_finished(state):
+        successors, finished = State.expand(state, color, max_depth-depth)
+        if finished:
             SuperPlayer.saw_end_of_game = True
             SuperPlayer.steps_left = depth
             return color * state[SCORE]
 
-        for a, s in State.successors(state, color, max_depth-depth):
+        for a, s in successors:
             v = -rec(s, -beta, -alpha, depth+1, -color)
             if v >= beta:
                 return v
@@ -251,59 +320,245 @@ def negamax(state, max_depth, stop_time):
                 alpha = v
         return alpha
 
+    lmr = SuperPlayer.lmr
+    futility = SuperPlayer.futility
+
+    # same as rec, searching the subtree to horizon instead of max_depth
+    def selective(state, alpha, beta, depth, color, horizon=max_depth):
+        SuperPlayer.nodes += 1
+        if stop_time and time() >= stop_time:
+            raise MyTimeoutError()
+        if depth >= horizon:
+            return color * state[SCORE]
+        depth_left = horizon - depth
+        successors, finished = State.expand(state, color, depth_left)
+        if finished:
+            SuperPlayer.saw_end_of_game = True
+            SuperPlayer.steps_left = depth
+            return color * state[SCORE]
+
+        margin = None
+        if futility and depth_left < len(FUTILITY_MARGINS):
+            margin = FUTILITY_MARGINS[depth_left]
+        reduce = lmr and depth_left >= LMR_DEPTH
+        for k, (a, s) in enumerate(successors):
+            if margin is not None and color * s[SCORE] + margin <= alpha:
+                if depth_left == 1:
+                    continue # not ordered
+                break # the next moves have lower scores
+            if reduce and k >= LMR_MOVES:
+                v = -selective(s, -beta, -alpha, depth+1, -color, horizon-1)
+                if v <= alpha:
+                    continue
+            v = -selective(s, -beta, -alpha, depth+1, -color, horizon)
+            if v >= beta:
+                return v
+            if v > alpha:
+                alpha = v
+        return alpha
+
+    if lmr or futility:
+        rec = selective
+
+    if root is None:
+        root = [[a, s, None] for a, s in State.successors(state, 1, 0)]
     alpha = -inf
     action = None
-    for a, s in State.successors(state, 1, 0):
-        v = -rec(s, -inf, -alpha, 1, -1)
+    for move in root:
+        v = -rec(move[1], -inf, -alpha, 1, -1)
+        move[2] = v
         if v > alpha:
             alpha = v
-            action = a
+            action = move[0]
     return action
 
 
-MAX_STEPS = 35
+def predict_nodes(counts):
+    """Predict the nodes of the next iteration from those of the previous.
+
+    counts[k] is the number of nodes of the search to depth k+1. Alpha-beta
+    makes the iterations to an odd depth much more expensive than those to
+    an even depth, so the ratio of the last two iterations underestimates
+    the next one after a cheap iteration. Once there are four iterations,
+    the ratio of the last two iterations of the same parity as the next one
+    is used instead.
+
+    """
+    n = counts[-1]
+    if len(counts) == 1:
+        return n * n # the first iteration visits about one node per move
+    if len(counts) >= 4 and counts[-4]:
+        return counts[-2] * counts[-2] / counts[-4]
+    return n * n / max(counts[-2], 1)
+
+
+def iterative_deepening(state, stop_time, soft_time=None):
+    """Search deeper and deeper until stop_time or the end of the game.
+
+    If soft_time is given, an iteration is only started if it is predicted
+    to end before soft_time. Its number of nodes is predicted by
+    predict_nodes, and its time from the node rate of the last one.
+
+    Each iteration searches the root moves in the order of the scores of
+    the previous one. If the time is over during an iteration in which the
+    first move has been searched, the best move searched so far is played:
+    it is at least as good, at that depth, as the move of the previous
+    iteration.
+
+    Return the action of the deepest completed search and its depth.
+
+    """
+    SuperPlayer.saw_end_of_game = False
+    root = [[a, s, None] for a, s in State.successors(state, 1, 0)]
+    action = root[0][0] if root else None
+    depth = 0
+    counts = [] # nodes of each iteration
+    try:
+        while True:
+            start = time()
+            nodes = SuperPlayer.nodes
+            for move in root:
+                move[2] = None
+            action = negamax(state, depth + 1, stop_time, root)
+            depth += 1
+            root.sort(key=lambda move: -move[2]) # stable for equal scores
+            if SuperPlayer.saw_end_of_game:
+                break
+            if soft_time is not None:
+                elapsed = time() - start
+                counts.append(SuperPlayer.nodes - nodes)
+                if elapsed and time() + predict_nodes(counts) * elapsed / \
+                        counts[-1] > soft_time:
+                    break
+    except MyTimeoutError:
+        searched = [move for move in root if move[2] is not None]
+        if searched:
+            # the first maximum, the moves searched later being bounds
+            action = max(searched, key=lambda move: move[2])[0]
+    return action, depth
+
+
+# Time management
+#
+# The time credit is shared among the steps left to play in proportion to
+# STEP_WEIGHTS: the average number of moves at each step of the games of
+# moves.log, counting 0 for games already finished. Wide positions, where
+# a deeper search costs the most, get the most time, and the endgame, which
+# is often searched to its end in a fraction of a second, the least. The
+# time not used by a step stays in the credit and is shared by the next
+# steps.
+
+STEP_WEIGHTS = (120, 115, 110, 105, 100, 95, 90, 85, 81, 76, 71, 67, 62, 58, 53,
+                49, 44, 40, 36, 32, 27, 23, 20, 16, 12, 9, 6, 4, 2, 1)
+MAX_SHARE = 0.5 # of the time left for one step
+HARD_FACTOR = 1.5 # times the budget before a search is aborted
+
+def step_weight(step):
+    return STEP_WEIGHTS[step - 1] if step <= len(STEP_WEIGHTS) else 1
+
+def time_budget(time_left, step, plies_left=None):
+    """Return the time to spend on a step out of time_left.
+
+    plies_left is the number of steps after which the game is known to be
+    over, or None.
+
+    """
+    last = max(len(STEP_WEIGHTS), step)
+    if plies_left is not None:
+        last = min(last, step + plies_left - 1)
+    # we play every other step
+    total = sum(step_weight(s) for s in range(step, last + 1, 2))
+    return time_left * min(step_weight(step) / total, MAX_SHARE)
 
 # We are always the yellow player
 class SuperPlayer(Player):
     saw_end_of_game = False
     steps_left = None
+    nodes = 0 # nodes searched by negamax, never reset
+    lmr = False # late move reductions in negamax
+    futility = False # futility pruning in negamax
 
     def reset(self):
         SuperPlayer.saw_end_of_game = False
         SuperPlayer.steps_left = None
 
+    book = None # opening_book.OpeningBook consulted before searching
+
     def play(self, percepts, step, time_left):
-        state = State.from_percepts(percepts)
+        return self.play_state(State.from_percepts(percepts), step, time_left,
+                               percepts)
+
+    # keep the state across a session instead of rebuilding it every step
+    def session_started(self, board):
+        self.state = State.from_percepts(board.m)
+
+    def session_moved(self, action):
+        self.state = State.play(self.state, State.from_board_action(action))
+
+    def session_play(self, step, time_left):
+        return self.play_state(self.state, step, time_left,
+                               self._session_board.m)
+
+    def play_state(self, state, step, time_left, percepts=None):
         if step <= 2:
             self.reset()
+        start = time()
+        if self.book is not None and percepts is not None:
+            action = self.book.lookup(percepts)
+            if action is not None and Board(percepts).is_action_valid(action):
+                self.metrics = {"book": True, "nodes": 0,
+                                "time_used": time() - start}
+                return action
+        nodes = SuperPlayer.nodes
+        time_for_this_step = None
 
         if time_left: # if time limited
+            plies_left = None
             if SuperPlayer.saw_end_of_game and SuperPlayer.steps_left:
-                steps_left = (SuperPlayer.steps_left - 2) + 1
-            else:
-                steps_left = MAX_STEPS-step
-            steps_left = max(steps_left, 1)
-            time_for_this_step = time_left / steps_left
-            stop_time = time() + time_for_this_step
+                plies_left = max((SuperPlayer.steps_left - 2) + 1, 1)
+            time_for_this_step = time_budget(time_left, step, plies_left)
+            soft_time = start + time_for_this_step
+            stop_time = start + min(HARD_FACTOR * time_for_this_step,
+                                    MAX_SHARE * time_left)
 
             # iterative deepening to find appropriate depth
-            SuperPlayer.saw_end_of_game = False
-            depth = 1
-            try:
-                action = negamax(state, depth, stop_time)
-                while not SuperPlayer.saw_end_of_game:
-                    depth += 1
-                    action = negamax(state, depth, stop_time)
-            except MyTimeoutError:
-                pass
+            action, depth = iterative_deepening(state, stop_time, soft_time)
 
         else:
             stop_time = None
             depth = 4
             action = negamax(state, depth, stop_time)
 
+        used = time() - start
+        nodes = SuperPlayer.nodes - nodes
+        self.metrics = {"depth": depth, "nodes": nodes, "time_used": used}
+        if used:
+            self.metrics["nps"] = nodes / used
+        if time_for_this_step is not None:
+            self.metrics["time_budget"] = time_for_this_step
         return State.to_board_action(action)
 
+def add_options(player, parser):
+    parser.add_option("--book", dest="book",
+                      help="play the moves of the opening book FILE" +
+                           " (see opening_book.py)", metavar="FILE")
+    parser.add_option("--lmr", action="store_true", dest="lmr",
+                      default=False, help="reduce the depth of the late" +
+                      " moves in the search")
+    parser.add_option("--futility", action="store_true", dest="futility",
+                      default=False, help="prune the moves which cannot" +
+                      " reach alpha near the horizon")
+
+def setup(player, parser, options):
+    SuperPlayer.lmr = options.lmr
+    SuperPlayer.futility = options.futility
+    if options.book is not None:
+        from opening_book import OpeningBook
+        try:
+            player.book = OpeningBook(options.book)
+        except (IOError, ValueError) as e:
+            parser.error("option --book: %s" % e)
+
 if __name__ == "__main__":
     State.setup()
-    player_main(SuperPlayer())
+    player_main(SuperPlayer(), add_options, setup)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Symmetries of Sarena boards and canonical position keys.
+
+The arrow cells of the board are the cells (i, j) with i + j even. The
+symmetries of the square preserving this checkerboard are the identity, the
+180 degree rotation, the transpose and the anti-transpose (the 90 degree
+rotations and the mirrors swap both colors of cells). Swapping the colors
+of the players, as Board.get_percepts(invert=True) does, gives another
+equivalence when the player to move is swapped too.
+
+A canonical key is the digest of the smallest packed form (see
+sarena.pack_percepts) among the equivalent positions, so that opening
+books, transposition tables and endgame caches share their entries between
+symmetric positions. Each symmetry is its own inverse: transform_action
+maps actions to the canonical position and back.
+
+"""
+
+import hashlib
+
+from sarena import pack_percepts, unpack_percepts
+
+SYMMETRIES = ("identity", "rotate180", "transpose", "antitranspose")
+
+_board_symmetries = {}
+
+
+def map_cell(symmetry, i, j, rows, columns):
+    """Return the image of cell (i, j) of a rows x columns board."""
+    if symmetry == "identity":
+        return i, j
+    if symmetry == "rotate180":
+        return rows - 1 - i, columns - 1 - j
+    if symmetry == "transpose":
+        return j, i
+    if symmetry == "antitranspose":
+        return columns - 1 - j, rows - 1 - i
+    raise ValueError("unknown symmetry: %s" % symmetry)
+
+
+def board_symmetries(percepts):
+    """Return the symmetries preserving the cell types of the percepts."""
+    rows = len(percepts)
+    columns = len(percepts[0])
+    types = tuple(cell[0] for row in percepts for cell in row)
+    key = (rows, columns, types)
+    if key not in _board_symmetries:
+        result = []
+        for symmetry in SYMMETRIES:
+            if symmetry in ("transpose", "antitranspose") and rows != columns:
+                continue
+            images = (map_cell(symmetry, i, j, rows, columns) + (i, j)
+                      for i in range(rows) for j in range(columns))
+            if all(percepts[i2][j2][0] == percepts[i][j][0]
+                   for i2, j2, i, j in images):
+                result.append(symmetry)
+        _board_symmetries[key] = tuple(result)
+    return _board_symmetries[key]
+
+
+def transform_percepts(percepts, symmetry):
+    """Return the image of the percepts by a symmetry (a new list)."""
+    rows = len(percepts)
+    columns = len(percepts[0])
+    result = [[None] * columns for i in range(rows)]
+    for i in range(rows):
+        for j in range(columns):
+            i2, j2 = map_cell(symmetry, i, j, rows, columns)
+            cell = percepts[i][j]
+            result[i2][j2] = [cell[0]] + [list(token) for token in cell[1:]]
+    return result
+
+
+def transform_action(action, symmetry, rows, columns):
+    """Return the image of an action (i1, j1, i2, j2) by a symmetry."""
+    i1, j1, i2, j2 = action
+    return (map_cell(symmetry, i1, j1, rows, columns) +
+            map_cell(symmetry, i2, j2, rows, columns))
+
+
+def canonical(percepts, colors=False):
+    """Return the canonical form of a position.
+
+    The result is (packed, symmetry, inverted): the smallest packed form of
+    the equivalent positions, the symmetry giving it and whether the colors
+    were swapped. If colors is False, the colors are never swapped, e.g.
+    for positions always seen by the player to move.
+
+    """
+    best = None
+    for symmetry in board_symmetries(percepts):
+        image = percepts if symmetry == "identity" else \
+            transform_percepts(percepts, symmetry)
+        for inverted in ((False, True) if colors else (False,)):
+            packed = pack_percepts(image, inverted)
+            if best is None or packed < best[0]:
+                best = (packed, symmetry, inverted)
+    return best
+
+
+def canonical_percepts(percepts, colors=False):
+    """Return (canonical percepts, symmetry, inverted), as canonical."""
+    packed, symmetry, inverted = canonical(percepts, colors)
+    return unpack_percepts(packed), symmetry, inverted
+
+
+def canonical_key(percepts, colors=False):
+    """Return (64-bit key, symmetry, inverted) of a position.
+
+    The key is the sarena.percepts_digest of the canonical position.
+
+    """
+    packed, symmetry, inverted = canonical(percepts, colors)
+    h = hashlib.blake2b(packed, digest_size=8)
+    return int.from_bytes(h.digest(), "big"), symmetry, inverted
@@ -14,7 +14,9 @@ else:
         def score(state):
             return EvalPlayerOurs.evaluate(None, state)
 
+import random
 import unittest
+from symmetry import *
 
 class TestEvaluation(unittest.TestCase):
     def setUp(self):
@@ -180,5 +182,634 @@ class TestEvaluation(unittest.TestCase):
           + 4*SURE_THING - MAYBE
         self.assertEqual(State.score(self.parse(state)), s)
 
+class TestPackedPercepts(unittest.TestCase):
+    def test_round_trip(self):
+        for percepts in (random_board(), load_percepts("b1.dmp"),
+                         load_percepts("mini_board.dmp")):
+            board = Board(percepts)
+            for k in range(3):
+                board.play_action(next(board.get_actions()))
+            packed = pack_percepts(board.m)
+            self.assertEqual(packed_percepts_size(packed), len(packed))
+            self.assertEqual(unpack_percepts(packed), board.get_percepts())
+            self.assertEqual(unpack_percepts(pack_percepts(board.m, True)),
+                             board.get_percepts(True))
+
+class TestBoardSet(unittest.TestCase):
+    def test_round_trip(self):
+        import boardset, tempfile, os
+        boards = [Board(load_percepts("b1.dmp")),
+                  Board(load_percepts("mini_board.dmp"))]
+        boards += [Board(random_board()) for k in range(20)]
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertEqual(boardset.write_board_set(boards, filename), 22)
+            board_set = boardset.BoardSet(filename)
+            self.assertEqual(len(board_set), 22)
+            for k, board in enumerate(boards):
+                self.assertEqual(board_set[k].m, board.m)
+                self.assertEqual(board_set.packed(k), board.pack())
+            self.assertRaises(IndexError, board_set.percepts, 22)
+            board_set.close()
+        finally:
+            os.remove(filename)
+
+class TestRandomBoards(unittest.TestCase):
+    def test_random_boards(self):
+        import numpy as np
+        from npboards import random_boards, pack_boards, board_percepts, \
+            hash_boards
+        boards = random_boards(200, 7)
+        self.assertEqual(boards.shape, (200, 6, 6, 2))
+        self.assertTrue((random_boards(200, 7) == boards).all())
+        self.assertFalse((random_boards(200, 8) == boards).all())
+        tokens = sorted(sorted(cell[1]) for row in random_board()
+                        for cell in row)
+        packed = pack_boards(boards)
+        for k, board in enumerate(boards):
+            self.assertEqual(sorted(sorted(token) for token in
+                                    board.reshape(36, 2).tolist()), tokens)
+            percepts = board_percepts(board)
+            self.assertEqual(bytes(packed[k]), pack_percepts(percepts))
+            self.assertEqual(Board(percepts).get_percepts(), percepts)
+        unique = random_boards(200, 7, unique=True)
+        self.assertEqual(len(unique), 200)
+        self.assertEqual(len(set(hash_boards(unique).tolist())), 200)
+        self.assertEqual(len(set(Board(board_percepts(board)).digest()
+                                 for board in unique)), 200)
+        # draws from 3 boards only, so that duplicates have to be replaced
+        import npboards
+        pool = random_boards(3, 1)
+        draw = npboards.draw_boards
+        npboards.draw_boards = lambda rng, n: pool[rng.integers(0, 3, n)]
+        try:
+            unique = random_boards(3, 1, unique=True)
+        finally:
+            npboards.draw_boards = draw
+        self.assertEqual(sorted(hash_boards(unique).tolist()),
+                         sorted(hash_boards(pool).tolist()))
+
+class TestBatchBoards(unittest.TestCase):
+    def test_against_board(self):
+        import numpy as np
+        from npboards import BatchBoards, random_boards, board_percepts, \
+            edge_action
+        rng = np.random.default_rng(0)
+        arrays = random_boards(20, 1)
+        batch = BatchBoards.from_boards(arrays)
+        boards = [Board(board_percepts(array)) for array in arrays]
+        while True:
+            legal = batch.legal_moves()
+            self.assertEqual(list(batch.scores()),
+                             [board.get_score() for board in boards])
+            moves = batch.random_moves(rng)
+            for k, board in enumerate(boards):
+                self.assertEqual(set(map(edge_action, np.flatnonzero(legal[k]))),
+                                 set(board.get_actions()))
+                if moves[k] >= 0:
+                    board.play_action(edge_action(moves[k]))
+            if (moves < 0).all():
+                break
+            batch.play(moves)
+            for k, board in enumerate(boards):
+                self.assertEqual(batch.percepts(k), board.get_percepts())
+        self.assertRaises(InvalidAction, batch.play, [0] * 20)
+
+class TestTimeManager(unittest.TestCase):
+    def test_iteration_not_started(self):
+        import super_player
+        from super_player import State, SuperPlayer, iterative_deepening
+        State.setup()
+        state = State.from_percepts(load_percepts("b1.dmp"))
+        start = SuperPlayer.nodes
+        # a clock searching 100000 nodes per second: depth 4 ends after
+        # about 1.5s, depth 5 needs 3.4M more nodes, far more than the
+        # ratio of depths 4 and 3 predicts
+        clock = lambda: (SuperPlayer.nodes - start) / 100000
+        saved = super_player.time
+        super_player.time = clock
+        try:
+            action, depth = iterative_deepening(state, 15.0, 10.0)
+        finally:
+            super_player.time = saved
+        self.assertEqual(depth, 4)
+        self.assertLess(clock(), 10.0)
+        self.assertTrue(Board(load_percepts("b1.dmp")).is_action_valid(
+            State.to_board_action(action)))
+
+    def test_stop_during_iteration(self):
+        import super_player
+        from super_player import State, SuperPlayer, iterative_deepening
+        State.setup()
+        state = State.from_percepts(load_percepts("b1.dmp"))
+        start = SuperPlayer.nodes
+        iterations = []
+        negamax = super_player.negamax
+
+        def recording_negamax(state, max_depth, stop_time, root):
+            try:
+                return negamax(state, max_depth, stop_time, root)
+            finally:
+                iterations.append([list(move) for move in root])
+        # with the clock of test_iteration_not_started, the search to depth
+        # 4 is stopped after 114 of the 120 root moves
+        saved = super_player.time
+        super_player.time = lambda: (SuperPlayer.nodes - start) / 100000
+        super_player.negamax = recording_negamax
+        try:
+            action, depth = iterative_deepening(state, 1.4)
+        finally:
+            super_player.time = saved
+            super_player.negamax = negamax
+        self.assertEqual(depth, 3)
+        self.assertEqual(len(iterations), 4)
+        searched = [move for move in iterations[-1] if move[2] is not None]
+        self.assertTrue(0 < len(searched) < len(iterations[-1]))
+        self.assertEqual(action, max(searched, key=lambda m: m[2])[0])
+        previous = max(iterations[-2], key=lambda m: m[2])[0]
+        self.assertNotEqual(action, previous)
+        self.assertTrue(Board(load_percepts("b1.dmp")).is_action_valid(
+            State.to_board_action(action)))
+
+class TestArchive(unittest.TestCase):
+    def check_games(self, archive, traces):
+        self.assertEqual(len(archive), len(traces))
+        for game, trace in enumerate(traces):
+            board = archive.initial_board(game)
+            self.assertEqual(board.m, trace.get_initial_board().m)
+            self.assertEqual([a for a, t in archive.actions(game)],
+                             [tuple(a) for a, t in trace.actions])
+            self.assertEqual(archive.score(game), trace.score)
+            self.assertIn((game, 0), archive.find(board))
+            for step, (action, t) in enumerate(trace.actions, 1):
+                board.play_action(action)
+                self.assertIn((game, step), archive.find(board))
+
+    def test_round_trip(self):
+        import archive, game, tempfile, os
+        from random_player import RandomPlayer
+        random.seed(2)
+        initial = load_percepts("b1.dmp")
+        traces = [game.play_game([RandomPlayer(), RandomPlayer()],
+                                 Board(percepts))
+                  for percepts in (initial, initial, initial, random_board())]
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            writer = archive.ArchiveWriter()
+            for trace in traces[:3]:
+                writer.add(trace)
+            writer.write(filename)
+            a = archive.Archive(filename)
+            self.check_games(a, traces[:3])
+            self.assertEqual(a.find(Board(random_board())), [])
+            stats = a.move_stats(Board(initial))
+            self.assertEqual(sum(s["games"] for s in stats.values()), 3)
+            for action, s in stats.items():
+                games = [t for t in traces[:3]
+                         if tuple(t.actions[0][0]) == action]
+                self.assertEqual(s["games"], len(games))
+                self.assertEqual(s["yellow"] + s["red"] + s["draws"],
+                                 s["games"])
+                self.assertAlmostEqual(s["mean_score"], sum(
+                    t.score for t in games) / len(games))
+            writer = archive.ArchiveWriter.from_archive(a)
+            a.close()
+            writer.add(traces[3])
+            writer.write(filename)
+            a = archive.Archive(filename)
+            self.check_games(a, traces)
+            self.assertEqual(sum(s["games"] for s in
+                                 a.move_stats(Board(initial)).values()), 3)
+            a.close()
+        finally:
+            os.remove(filename)
+
+    def test_incomplete_trace(self):
+        import archive, game, tempfile, os
+        random.seed(4)
+        initial = load_percepts("b1.dmp")
+        board = Board(initial)
+        fd, trace_file = tempfile.mkstemp()
+        os.close(fd)
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            stream = game.StreamTrace(board, [None, None], trace_file)
+            for step in range(3):
+                action = random.choice(list(board.get_actions()))
+                board.play_action(action)
+                stream.add_action(action, 0.5)
+            stream.file.close()  # the game was interrupted
+            reader = game.load_trace(trace_file)
+            self.assertFalse(reader.complete)
+            writer = archive.ArchiveWriter()
+            writer.add(reader)
+            reader.close()
+            writer.write(filename)
+            a = archive.Archive(filename)
+            self.assertEqual(a.flags(0), archive.FLAG_INCOMPLETE)
+            self.assertEqual(len(a.actions(0)), 3)
+            self.assertIn((0, 3), a.find(board))
+            self.assertEqual(a.move_stats(Board(initial)), {})
+            a.close()
+        finally:
+            os.remove(trace_file)
+            os.remove(filename)
+
+class TestExpand(unittest.TestCase):
+    def boards(self):
+        random.seed(1)
+        middle, finished = Board(random_board()), Board(random_board())
+        for k in range(12):
+            middle.play_action(random.choice(list(middle.get_actions())))
+        while not finished.is_finished():
+            finished.play_action(next(finished.get_actions()))
+        return [Board(load_percepts("b1.dmp")), middle, finished]
+
+    def test_super_player(self):
+        from super_player import State
+        State.setup()
+        for board in self.boards():
+            state = State.from_percepts(board.get_percepts())
+            for player in (1, -1):
+                for depth_left in (1, 2, 3):
+                    successors, finished = State.expand(state, player,
+                                                        depth_left)
+                    successors = list(successors)
+                    self.assertEqual(finished, board.is_finished())
+                    self.assertEqual(successors, list(State.successors(
+                        state, player, depth_left)))
+                    self.assertEqual(not successors, finished)
+
+    def test_minimax(self):
+        import minimax
+        from basic_player import AlphaBetaPlayer
+
+        class CutoffPlayer(AlphaBetaPlayer):
+            expand = minimax.Game.expand
+        player = AlphaBetaPlayer()
+        for board in self.boards():
+            leaf, successors = player.expand(board, 0)
+            self.assertFalse(leaf)
+            self.assertEqual([a for a, b in successors],
+                             [a for a, b in player.successors(board)])
+            stats = minimax.SearchStats()
+            action = minimax.search(board, player, stats=stats)
+            cutoff_stats = minimax.SearchStats()
+            self.assertEqual(action, minimax.search(board, CutoffPlayer(),
+                                                    stats=cutoff_stats))
+            self.assertEqual(stats.nodes, cutoff_stats.nodes)
+            # a finished board has no successors and no action
+            self.assertEqual(action is None, board.is_finished())
+
+class TestSelectiveSearch(unittest.TestCase):
+    def test_against_full_search(self):
+        import bench
+        from super_player import State, FUTILITY_MARGINS
+        State.setup()
+        positions = ("opening-1-1", "middlegame-12-1", "endgame-22-1")
+        for name, phase, step, percepts in bench.load_corpus():
+            if name not in positions:
+                continue
+            full = bench.selective_search(percepts, 4)
+            sel = bench.selective_search(percepts, 4,
+                                         options=bench.SELECTIVE)
+            self.assertLess(sel[0], full[0])
+            loss = bench.move_value(percepts, 4, full[2]) - \
+                bench.move_value(percepts, 4, sel[2])
+            self.assertGreaterEqual(loss, 0)
+            self.assertLessEqual(loss, max(FUTILITY_MARGINS))
+
+class TestSelfPlayData(unittest.TestCase):
+    def test_long_game(self):
+        import selfplay_data, tempfile, os, game, numpy as np
+        from random_player import RandomPlayer
+        random.seed(299)
+        trace = game.play_game([RandomPlayer(), RandomPlayer()],
+                               Board(random_board()))
+        self.assertGreater(len(trace.actions), 36)
+        fd, filename = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+        try:
+            n = selfplay_data.play_shard((filename, [299],
+                                          ("random", "random"), None))
+            self.assertEqual(n, len(trace.actions))
+            shard = np.load(filename)
+            self.assertEqual(len(shard), len(trace.actions))
+            self.assertEqual(list(shard["step"]),
+                             list(range(1, len(trace.actions) + 1)))
+            self.assertTrue((shard["seed"] == 299).all())
+        finally:
+            os.remove(filename)
+
+class TestPosition(unittest.TestCase):
+    def test_play_game(self):
+        import pickle
+        random.seed(1)
+        board = Board(random_board())
+        position = board.position()
+        seen = {position}
+        while not board.is_finished():
+            self.assertEqual(list(position.get_actions()),
+                             list(board.get_actions()))
+            action = random.choice(list(board.get_actions()))
+            position = position.with_action(action)
+            board.play_action(action)
+            self.assertEqual(position.get_percepts(), board.get_percepts())
+            self.assertEqual(position, board.position())
+            self.assertNotIn(position, seen)
+            seen.add(position)
+        self.assertTrue(position.is_finished())
+        self.assertEqual(position.pack(True), pack_percepts(board.m, True))
+        self.assertEqual(position.inverted(), board.position(True))
+        self.assertEqual(pickle.loads(pickle.dumps(position)), position)
+        self.assertRaises(InvalidAction, position.with_action, (0, 0, 0, 1))
+        self.assertRaises(AttributeError, setattr, position, "rows", 5)
+
+class TestPerceptsView(unittest.TestCase):
+    def test_views(self):
+        random.seed(2)
+        board = Board(random_board())
+        while not board.is_finished():
+            for invert in (False, True):
+                percepts = board.get_percepts(invert)
+                self.assertEqual(PerceptsView(board.m, invert), percepts)
+                self.assertEqual(pack_percepts(PerceptsView(board.m, invert)),
+                                 pack_percepts(percepts))
+                view = BoardView(board.m, invert)
+                self.assertEqual(list(view.get_actions()),
+                                 list(board.get_actions()))
+                self.assertEqual(view.get_score(), Board(percepts).get_score())
+                self.assertEqual(view.clone().m, percepts)
+            board.play_action(random.choice(list(board.get_actions())))
+        self.assertRaises(TypeError, BoardView(board.m).play_action,
+                          (0, 0, 0, 1))
+
+class TestSessions(unittest.TestCase):
+    def test_session_game(self):
+        import game
+        from fast_player import FastPlayer
+        percepts = load_percepts("b1.dmp")
+        plain = game.play_game([FastPlayer(), FastPlayer()], Board(percepts))
+        players = [FastPlayer(), FastPlayer()]
+        session = game.play_game(players, Board(percepts), sessions=True)
+        self.assertEqual([a for a, t in session.actions],
+                         [a for a, t in plain.actions])
+        self.assertEqual(session.score, plain.score)
+
+    def test_shared_player(self):
+        import game
+        from fast_player import FastPlayer
+        class Player(FastPlayer):
+            def play_session(self, last_action, step, time_left):
+                raise AssertionError("in session mode")
+        percepts = load_percepts("b1.dmp")
+        plain = game.play_game([FastPlayer(), FastPlayer()], Board(percepts))
+        player = Player()
+        shared = game.play_game([player, player], Board(percepts),
+                                sessions=True)
+        self.assertEqual([a for a, t in shared.actions],
+                         [a for a, t in plain.actions])
+
+    def test_resync(self):
+        import game
+        from fast_player import FastPlayer
+        board = Board(load_percepts("b1.dmp"))
+        player = FastPlayer()
+        player.start_session(board.get_percepts())
+        board.play_action(next(board.get_actions()))
+        # the player did not see the first action, the referee resyncs it
+        action = game.play_session(player, board, False, None, 2, None)
+        self.assertTrue(board.is_action_valid(action))
+        self.assertEqual(player._session_board.get_percepts(),
+                         board.clone().play_action(action).get_percepts())
+
+class TestMetrics(unittest.TestCase):
+    class MetricsPlayer(Player):
+        readonly_percepts = True
+        def play(self, percepts, step, time_left):
+            self.metrics = {"depth": 1, "nodes": step}
+            return next(BoardView(percepts).get_actions())
+
+    def test_trace_metrics(self):
+        import game
+        from random_player import RandomPlayer
+        random.seed(3)
+        trace = game.play_game([self.MetricsPlayer(), RandomPlayer()],
+                               Board(random_board()))
+        self.assertEqual(len(trace.metrics), len(trace.actions))
+        for step, metrics in enumerate(trace.metrics, 1):
+            if step % 2:
+                self.assertEqual(metrics, {"depth": 1, "nodes": step})
+            else:
+                self.assertIsNone(metrics)
+
+    def test_failing_player_not_asked_again(self):
+        import game
+        from random_player import RandomPlayer
+        class Player(RandomPlayer):
+            asked = 0
+            def get_metrics(self):
+                self.asked += 1
+                raise AttributeError("get_metrics")
+        player = Player()
+        random.seed(3)
+        trace = game.play_game([player, RandomPlayer()], Board(random_board()))
+        self.assertEqual(player.asked, 1)
+        self.assertEqual(trace.metrics, [None] * len(trace.actions))
+
+    def test_remote_metrics(self):
+        import threading, wire, xmlrpc.client
+        player = self.MetricsPlayer()
+        player.play(load_percepts("b1.dmp"), 5, None)
+        server = wire.BinaryXMLRPCServer(("127.0.0.1", 0))
+        server.register_instance(player)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        try:
+            proxy = wire.BinaryPlayerProxy("127.0.0.1", port)
+            try:
+                self.assertEqual(proxy.get_metrics(),
+                                 {"depth": 1, "nodes": 5})
+            finally:
+                proxy.close()
+            proxy = xmlrpc.client.ServerProxy("http://127.0.0.1:%d" % port,
+                                              allow_none=True)
+            self.assertEqual(proxy.get_metrics(), {"depth": 1, "nodes": 5})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class TestProfiling(unittest.TestCase):
+    def test_profile_per_step(self):
+        import profiling, pstats, tempfile, shutil, os
+        from random_player import RandomPlayer
+        directory = tempfile.mkdtemp()
+        try:
+            player = RandomPlayer()
+            profiler = profiling.PlayerProfiler(player, directory, True)
+            profiler.install()
+            board = Board(load_percepts("b1.dmp"))
+            for step in (1, 2):
+                board.play_action(player.play(board.get_percepts(step == 2),
+                                              step, None))
+            profiler.close()
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ["game-0-step-1.prof", "game-0-step-2.prof"])
+            for name in os.listdir(directory):
+                stats = pstats.Stats(os.path.join(directory, name))
+                self.assertIn("play", [f[2] for f in stats.stats])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_sampler(self):
+        import profiling, sys, tempfile, time, os
+        def spin(seconds):
+            end = time.time() + seconds
+            while time.time() < end:
+                pass
+        sampler = profiling.StackSampler(0.001)
+        sampler.start()
+        sampler.begin(sys._getframe())
+        spin(0.2)
+        sampler.end()
+        sampler.stop()
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            sampler.write(filename)
+            with open(filename) as f:
+                stacks = dict(line.rsplit(" ", 1) for line in f)
+            self.assertIn("test.py:spin", stacks)
+            self.assertEqual(sum(int(n) for n in stacks.values()),
+                             sampler.samples)
+        finally:
+            os.remove(filename)
+
+class TestBinaryTrace(unittest.TestCase):
+    def test_stream_and_read(self):
+        import game, tempfile, os
+        from random_player import RandomPlayer
+        board = Board(random_board())
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            stream = game.StreamTrace(board, [10.0, None], filename)
+            trace = game.play_game([RandomPlayer(), RandomPlayer()], board,
+                                   trace=stream)
+            reader = game.load_trace(filename)
+            self.assertTrue(reader.complete)
+            self.assertEqual((reader.score, reader.reason),
+                             (trace.score, trace.reason))
+            self.assertEqual(reader.time_limits, [10.0, None])
+            self.assertEqual([a for a, t in reader.actions],
+                             [tuple(a) for a, t in trace.actions])
+            self.assertEqual(reader.get_board(len(reader.actions)).m, board.m)
+            reader.close()
+        finally:
+            os.remove(filename)
+
+class TestFastBoard(unittest.TestCase):
+    def test_random_games(self):
+        from fastboard import FastBoard
+        random.seed(3)
+        boards = [load_percepts("b1.dmp"), load_percepts("mini_board.dmp")]
+        boards += [random_board() for k in range(8)]
+        for percepts in boards:
+            board, fast = Board(percepts), FastBoard(percepts)
+            while True:
+                actions = sorted(board.get_actions())
+                self.assertEqual(sorted(fast.get_actions()), actions)
+                self.assertEqual(fast.get_percepts(), board.get_percepts())
+                self.assertEqual(fast.get_score(), board.get_score())
+                self.assertEqual(fast.is_finished(), board.is_finished())
+                if not actions:
+                    break
+                action = random.choice(actions)
+                self.assertTrue(fast.is_action_valid(action))
+                board.play_action(action)
+                fast.play_action(action)
+                self.assertFalse(fast.is_action_valid(action))
+
+    def test_verify_traces(self):
+        import game, verify_traces, tempfile, os
+        from random_player import RandomPlayer
+        random.seed(4)
+        filenames = []
+        try:
+            for stream in (False, True):
+                fd, filename = tempfile.mkstemp()
+                os.close(fd)
+                filenames.append(filename)
+                board = Board(random_board())
+                players = [RandomPlayer(), RandomPlayer()]
+                if stream:
+                    writer = game.StreamTrace(board, [None, None], filename)
+                    trace = game.play_game(players, board, trace=writer)
+                else:
+                    trace = game.play_game(players, board)
+                    trace.write(filename)
+                result = verify_traces.verify(filename)
+                self.assertIsNone(result["error"])
+                self.assertEqual(result["steps"], len(trace.actions))
+                self.assertEqual(result["score"], trace.score)
+                self.assertEqual(len(result["branching"]), len(trace.actions))
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+
+class TestPerft(unittest.TestCase):
+    def test_engines_agree(self):
+        import perft
+        for name, percepts in perft.positions([0]):
+            counts = set(n for _, n, _ in perft.perft(percepts, 2))
+            self.assertEqual(len(counts), 1, name)
+        self.assertEqual(perft.perft(load_percepts("b1.dmp"), 2)[0][1], 13776)
+
+class TestSymmetry(unittest.TestCase):
+    def test_symmetric_positions(self):
+        for seed in range(5):
+            random.seed(seed)
+            board = Board(random_board())
+            key = canonical_key(board.m)[0]
+            self.assertEqual(len(board_symmetries(board.m)), 4)
+            for symmetry in SYMMETRIES:
+                image = transform_percepts(board.m, symmetry)
+                self.assertEqual(canonical_key(image)[0], key)
+                for action in board.get_actions():
+                    played = board.clone().play_action(action)
+                    self.assertEqual(
+                        Board(image).play_action(transform_action(
+                            action, symmetry, 6, 6)).m,
+                        transform_percepts(played.m, symmetry))
+            inverted = Board(board.get_percepts(True))
+            self.assertEqual(canonical_key(inverted.m, True)[0],
+                             canonical_key(board.m, True)[0])
+
+class TestOpeningBook(unittest.TestCase):
+    def test_lookup(self):
+        import opening_book, tempfile, os
+        board = Board(load_percepts("b1.dmp"))
+        positions = list(opening_book.book_positions(board.m, 2))
+        entries = {}
+        for k, percepts in enumerate(positions[:50]):
+            entries[opening_book.book_key(percepts)[0]] = k
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            opening_book.write_book(entries, filename)
+            book = opening_book.OpeningBook(filename)
+            self.assertEqual(len(book), 50)
+            for k, percepts in enumerate(positions[:50]):
+                symmetry = opening_book.book_key(percepts)[1]
+                self.assertEqual(book.lookup(percepts), transform_action(
+                    code_to_action(k, 6), symmetry, 6, 6))
+            self.assertIsNone(book.lookup(positions[50]))
+            book.close()
+        finally:
+            os.remove(filename)
+
 if __name__ == '__main__':
     unittest.main()
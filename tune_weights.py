@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tuning of the evaluation weights SURE_THING, BACKSTAB and MAYBE.
+
+super_player.State.score_at and EvalPlayerOurs.score_at give every tower a
+value that is one of the weights times a color and a height, so the
+evaluation of a position is linear in the weights:
+
+    evaluation = SURE_THING * sure + BACKSTAB * backstab + MAYBE * maybe
+
+Two tuners are available:
+
+texel -- fit the weights to a dataset written by selfplay_data.py: the
+    probability that the player to move wins is modelled as
+    sigmoid(K * evaluation), K being first fitted for the current weights,
+    and the squared error to the outcomes is minimized by Gauss-Newton. The
+    features of all positions are computed by batched NumPy operations, one
+    process per shard.
+spsa -- simultaneous perturbation stochastic approximation: at each
+    iteration, two perturbed weight sets play a match of self-play games
+    run in parallel, and the weights move along the estimated gradient of
+    the match score.
+
+Both print the new weights and their gain, measured on held-out positions
+for texel and by a match against the current weights for both.
+
+This module requires NumPy.
+
+"""
+
+import math
+import os
+import random
+from multiprocessing import Pool
+
+import numpy as np
+
+from sarena import *
+import super_player
+from super_player import State, SuperPlayer
+from selfplay_data import decode_cells, load_dataset
+
+WEIGHTS = ("SURE_THING", "BACKSTAB", "MAYBE")
+
+State.setup()
+ARROWS = np.array([arrows for i, arrows in State.ARROWS])
+# neighbours of each cell, padded with the index 36 of an always empty cell
+NEIGHBORS = np.array([list(n) + [36] * (4 - len(n)) for n in State.NEIGHBORS])
+
+
+def current_weights():
+    return np.array([getattr(super_player, name) for name in WEIGHTS], float)
+
+
+def features(cells):
+    """Return the (N, 3) features of the (N, 36) encoded cells.
+
+    The columns are the factors of the weights in the evaluation, for the
+    player to move.
+
+    """
+    height, bot, top = decode_cells(cells)
+    height = height.astype(np.int32)
+    bot = bot.astype(np.int32)
+    top = top.astype(np.int32)
+    occupied = np.concatenate([height > 0, np.zeros((len(height), 1), bool)],
+                              axis=1)
+    lonely = ~occupied[:, NEIGHBORS].any(axis=2)
+    full = height == 4
+    low = (height > 0) & ~full
+    sure = np.where(ARROWS & full, 4 * top, 0) + \
+        np.where(ARROWS & low & lonely, height * top, 0) + \
+        np.where(~ARROWS & full, 4 * bot, 0)
+    maybe = np.where(ARROWS & low & ~lonely, height * top, 0)
+    backstab = np.where(~ARROWS & low, height * bot, 0)
+    return np.stack([sure.sum(1), backstab.sum(1), maybe.sum(1)],
+                    axis=1).astype(float)
+
+
+def shard_features(filename):
+    """Return the features, targets and seeds of a dataset shard."""
+    shard = np.load(filename, mmap_mode="r")
+    outcome = np.sign(shard["outcome"].astype(float))
+    return features(shard["cells"]), (outcome + 1) / 2, np.array(shard["seed"])
+
+
+def load_features(directory, jobs=None):
+    files = [s.filename for s in load_dataset(directory)]
+    with Pool(jobs) as pool:
+        parts = pool.map(shard_features, files)
+    if not parts:
+        raise ValueError("empty dataset: %s" % directory)
+    return [np.concatenate(p) for p in zip(*parts)]
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def texel_loss(x, y, weights, k):
+    return float(np.mean((sigmoid(k * (x @ weights)) - y) ** 2))
+
+
+def fit_k(x, y, weights):
+    """Return the scale K minimizing the loss of the given weights."""
+    lo, hi = 1e-6, 1.0
+    for _ in range(100):  # golden section search, the loss is unimodal
+        a = hi - (hi - lo) / 1.618
+        b = lo + (hi - lo) / 1.618
+        if texel_loss(x, y, weights, a) < texel_loss(x, y, weights, b):
+            hi = b
+        else:
+            lo = a
+    return (lo + hi) / 2
+
+
+def texel_fit(x, y, weights, k, iterations=50):
+    """Return the weights minimizing the loss, by Gauss-Newton."""
+    w = np.array(weights, float)
+    for _ in range(iterations):
+        p = sigmoid(k * (x @ w))
+        jacobian = (k * p * (1 - p))[:, None] * x
+        step = np.linalg.lstsq(jacobian, y - p, rcond=None)[0]
+        w += step
+        if np.abs(step).max() < 1e-6 * np.abs(w).max():
+            break
+    return w
+
+
+class WeightedPlayer(SuperPlayer):
+
+    """SuperPlayer evaluating with its own weights.
+
+    The weights are module globals of super_player, so they are swapped in
+    before each move, together with the class attributes SuperPlayer keeps
+    between moves, so that two instances can play each other.
+
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.saved = (False, None)
+
+    def play(self, percepts, step, time_left):
+        for name, value in zip(WEIGHTS, self.weights):
+            setattr(super_player, name, value)
+        SuperPlayer.saw_end_of_game, SuperPlayer.steps_left = self.saved
+        try:
+            return SuperPlayer.play(self, percepts, step, time_left)
+        finally:
+            self.saved = (SuperPlayer.saw_end_of_game, SuperPlayer.steps_left)
+
+
+def play_pair(task):
+    """Play a board twice, swapping the colors. Return the points of a.
+
+    task is (weights a, weights b, seed of the board, time credit). A win
+    counts 1 and a draw 0.5.
+
+    """
+    from game import play_game
+    a, b, seed, credit = task
+    points = 0.0
+    for first in (0, 1):
+        random.seed(seed)
+        players = [WeightedPlayer(a), WeightedPlayer(b)]
+        if first:
+            players.reverse()
+        score = play_game(players, Board(random_board()),
+                          credits=[credit, credit]).score
+        if first:
+            score = -score
+        points += 1.0 if score > 0 else 0.5 if score == 0 else 0.0
+    return points
+
+
+def match(pool, a, b, seeds, credit):
+    """Return the score of a against b, from 0 to 1, on the seeded boards."""
+    tasks = [(tuple(a), tuple(b), seed, credit) for seed in seeds]
+    return sum(pool.imap_unordered(play_pair, tasks)) / (2 * len(tasks))
+
+
+def elo(score):
+    """Return the Elo difference corresponding to a match score."""
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+
+def spsa(pool, weights, iterations, pairs, credit, a=2.0, c=1.0, seed=0):
+    """Return the weights tuned by SPSA from the given ones.
+
+    Every iteration plays pairs games pairs between two weight sets
+    perturbed by +/- c_k along a random direction.
+
+    """
+    rnd = random.Random(seed)
+    w = np.array(weights, float)
+    boards = 1000000
+    for k in range(1, iterations + 1):
+        ak = a / (k + iterations / 10) ** 0.602
+        ck = c / k ** 0.101
+        delta = np.array([rnd.choice((-1, 1)) for _ in w])
+        seeds = [rnd.randrange(boards) for _ in range(pairs)]
+        score = match(pool, w + ck * delta, w - ck * delta, seeds, credit)
+        # (score of w+ - score of w-) / (2 ck delta) estimates the gradient
+        w += ak * (2 * score - 1) / (2 * ck * delta)
+        w = np.maximum(w, 0.1)
+        print("iteration %d: score %.3f, weights %s" % (k, score,
+                                                         format_weights(w)))
+    return w
+
+
+def format_weights(weights):
+    return ", ".join("%s = %.3f" % (name, w)
+                     for name, w in zip(WEIGHTS, weights))
+
+
+def print_weights(weights):
+    print("New weights:")
+    for name, w in zip(WEIGHTS, weights):
+        print("%s = %.3f" % (name, w))
+    scaled = weights * getattr(super_player, WEIGHTS[0]) / weights[0]
+    print("scaled to %s = %g: %s" % (WEIGHTS[0], scaled[0],
+                                     format_weights(scaled)))
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog texel DATASET\n" +
+                                "       %prog spsa",
+                          description="Tune the evaluation weights.")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs",
+                      default=os.cpu_count(),
+                      help="number of processes (default: %default)")
+    parser.add_option("-i", "--iterations", type="int", dest="iterations",
+                      default=50,
+                      help="SPSA iterations (default: %default)")
+    parser.add_option("-b", "--batch", type="int", dest="batch", default=8,
+                      help="game pairs per SPSA iteration (default: %default)")
+    parser.add_option("-m", "--match", type="int", dest="match", default=50,
+                      help="game pairs of the final match against the" +
+                           " current weights, 0 to skip (default: %default)")
+    parser.add_option("-t", "--time", type="float", dest="time", default=2.0,
+                      help="time credit of each player per game in seconds" +
+                           " (default: %default)")
+    parser.add_option("--test-every", type="int", dest="test_every",
+                      default=10, help="hold out the positions of one board" +
+                      " seed out of N for texel (default: %default)")
+    (options, args) = parser.parse_args()
+    if not args or args[0] not in ("texel", "spsa") or \
+            len(args) != (2 if args[0] == "texel" else 1):
+        parser.error("invalid command")
+    weights = current_weights()
+    print("Current weights: %s" % format_weights(weights))
+    with Pool(options.jobs) as pool:
+        if args[0] == "texel":
+            x, y, seeds = load_features(args[1], options.jobs)
+            test = seeds % options.test_every == 0
+            k = fit_k(x[~test], y[~test], weights)
+            tuned = texel_fit(x[~test], y[~test], weights, k)
+            print("%d positions (%d held out), K = %g" % (len(y), test.sum(),
+                                                          k))
+            before = texel_loss(x[test], y[test], weights, k)
+            after = texel_loss(x[test], y[test], tuned, k)
+            print("Held-out loss: %.5f -> %.5f (%.2f%%)" %
+                  (before, after, 100 * (after - before) / before))
+        else:
+            tuned = spsa(pool, weights, options.iterations, options.batch,
+                         options.time)
+        print_weights(tuned)
+        if options.match:
+            # boards not used by spsa nor by default selfplay_data runs
+            seeds = range(10 ** 7, 10 ** 7 + options.match)
+            score = match(pool, tuned, weights, seeds, options.time)
+            print("Match against the current weights: %.1f%% (%+.0f Elo)" %
+                  (100 * score, elo(score)))
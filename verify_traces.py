@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Verify many game traces in parallel and collect statistics about them.
+
+Every trace is replayed with fastboard.FastBoard: each action must be legal
+and the recorded score must be the one of the final board (or the forfeit
+score if the game ended on an expired time credit or an invalid action).
+
+The statistics replace the hand-collected moves.log and random_games.txt:
+branching factor per step, game length, time used per step and score
+distribution, and the search metrics reported by the players if the traces
+recorded them.
+
+"""
+
+import glob
+import os
+from multiprocessing import Pool
+
+from fastboard import FastBoard
+from game import load_trace, TraceReader
+
+
+def verify(filename):
+    """Verify a trace file and return a dictionary describing it."""
+    result = {"file": filename, "error": None, "branching": [], "times": []}
+    try:
+        trace = load_trace(filename)
+    except Exception as e:
+        result["error"] = "unable to load: %s" % e
+        return result
+    try:
+        return check_trace(trace, result)
+    finally:
+        if isinstance(trace, TraceReader):
+            trace.close()
+
+
+def check_trace(trace, result):
+    """Replay a loaded trace, filling and returning the result of verify."""
+    result["metrics"] = getattr(trace, "metrics", None) or []
+    if not getattr(trace, "complete", True):
+        result["error"] = "incomplete trace"
+    board = FastBoard(trace.initial_board)
+    for step, (action, t) in enumerate(trace.actions, 1):
+        result["branching"].append(sum(1 for a in board.get_actions()))
+        result["times"].append(t)
+        if not board.is_action_valid(action):
+            result["error"] = "step %d: invalid action %s" % (step, action)
+            return result
+        board.play_action(action)
+    steps = len(trace.actions)
+    result["steps"] = steps
+    result["score"] = trace.score
+    result["forfeit"] = bool(trace.reason)
+    if trace.reason:
+        # the player to play the next step lost
+        expected = -1 if steps % 2 == 0 else 1
+    elif board.is_finished():
+        expected = board.get_score()
+    else:
+        if result["error"] is None:
+            result["error"] = "game not finished after step %d" % steps
+        return result
+    if trace.score != expected and result["error"] is None:
+        result["error"] = "recorded score %d, expected %d" % (trace.score,
+                                                             expected)
+    return result
+
+
+def summary(sample):
+    """Return range, average, median and median absolute deviation."""
+    s = sorted(sample)
+    n = len(s)
+
+    def median(s):
+        return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2.0
+
+    med = median(s)
+    mad = median(sorted(abs(x - med) for x in s))
+    return s[0], s[-1], sum(s) / float(n), med, mad
+
+
+def print_summary(label, sample):
+    if not sample:
+        return
+    lo, hi, mean, med, mad = summary(sample)
+    print()
+    print(label + ":")
+    print("Range:  [%6.3f - %6.3f] (%6.3f)" % (lo, hi, hi - lo))
+    print("Average: %6.3f" % mean)
+    print("Median:  %6.3f" % med)
+    print("MAD:     %6.3f" % mad)
+
+
+def print_metrics(results):
+    """Print the search metrics of each player, if some were recorded."""
+    for player in range(2):
+        metrics = [m for r in results for m in r["metrics"][player::2] if m]
+        if not metrics:
+            continue
+        print()
+        print("Search metrics of player %d (%d moves):" % (player + 1,
+                                                          len(metrics)))
+        for key in ("depth", "nodes", "nps", "tt_fill"):
+            values = [m[key] for m in metrics if key in m]
+            if values:
+                print("%-8s average %12.2f  max %12.2f" %
+                      (key, sum(values) / len(values), max(values)))
+        budget = [m for m in metrics if "time_budget" in m and "time_used" in m]
+        if budget:
+            allowed = sum(m["time_budget"] for m in budget)
+            used = sum(m["time_used"] for m in budget)
+            print("time used %.3fs of a budget of %.3fs (%.1f%%)" %
+                  (used, allowed, 100.0 * used / allowed if allowed else 0))
+
+
+def print_report(results):
+    valid = [r for r in results if r["error"] is None]
+    print("%d traces, %d valid, %d invalid" % (len(results), len(valid),
+                                               len(results) - len(valid)))
+    for r in results:
+        if r["error"] is not None:
+            print("  %s: %s" % (r["file"], r["error"]))
+    if not valid:
+        return
+    forfeits = sum(1 for r in valid if r["forfeit"])
+    if forfeits:
+        print("%d games ended by forfeit" % forfeits)
+
+    print()
+    print("Branching factor and time per step:")
+    print("step  games   moves  min  max    time (s)  max time")
+    max_steps = max(len(r["branching"]) for r in valid)
+    for step in range(max_steps):
+        moves = [r["branching"][step] for r in valid
+                 if step < len(r["branching"])]
+        times = [r["times"][step] for r in valid if step < len(r["times"])]
+        line = "%4d %6d %7.1f %4d %4d" % (step + 1, len(moves),
+                                          sum(moves) / float(len(moves)),
+                                          min(moves), max(moves))
+        if times:
+            line += "  %10.4f %9.4f" % (sum(times) / len(times), max(times))
+        print(line)
+
+    print_summary("Steps", [r["steps"] for r in valid])
+    print_summary("Score", [r["score"] for r in valid])
+    print_summary("Time of player 1", [sum(r["times"][0::2]) for r in valid])
+    print_summary("Time of player 2", [sum(r["times"][1::2]) for r in valid])
+
+    print_metrics(valid)
+
+    print()
+    print("Score distribution:")
+    scores = {}
+    for r in valid:
+        scores[r["score"]] = scores.get(r["score"], 0) + 1
+    for score in sorted(scores):
+        print("%4d %6d %s" % (score, scores[score],
+                              "#" * (60 * scores[score] // len(valid))))
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] TRACE...",
+                          description="Verify traces and report statistics." +
+                          " TRACE may be a directory of traces.")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs",
+                      default=os.cpu_count(),
+                      help="number of processes (default: %default)")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("need traces to verify")
+    files = []
+    for arg in args:
+        if os.path.isdir(arg):
+            files.extend(sorted(glob.glob(os.path.join(arg, "*"))))
+        else:
+            files.append(arg)
+    with Pool(options.jobs) as pool:
+        results = pool.map(verify, files, chunksize=16)
+    print_report(results)
+    exit(1 if any(r["error"] is not None for r in results) else 0)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary transport between the referee and the Sarena players.
+
+XML-RPC sends the percepts as several kilobytes of markup and opens a new
+HTTP connection for every step. This module offers an alternative: a single
+persistent TCP connection carrying length-prefixed binary frames, in which
+the board is packed with sarena.pack_percepts.
+
+Negotiation happens on the player's usual port. The client sends HELLO,
+which a binary-aware server answers with HELLO too. An older XML-RPC-only
+server sees a malformed HTTP request line and answers with an HTTP error,
+in which case connect() falls back to XML-RPC.
+
+Frames are a 4-byte big-endian payload length followed by the payload. A
+request payload starts with an opcode byte, a reply payload with a status
+byte:
+
+    PLAY           step (u16), time_left (f64, NaN if None),
+                   packed percepts
+                   -> OK action (4 x i8) | NONE
+    START_SESSION  packed percepts
+                   -> OK digest (u64)
+    PLAY_SESSION   step (u16), time_left (f64, NaN if None),
+                   opponent's action (u8 flag, 4 x i8)
+                   -> (OK action (4 x i8) | NONE), digest (u64)
+    GET_METRICS    -> OK metrics of the last move (UTF-8 JSON object)
+
+Any request may be answered by ERROR followed by an UTF-8 message, which the
+client raises as an xmlrpc.client.Fault like the XML-RPC transport does.
+
+"""
+
+import json
+import math
+import socket
+import struct
+import socketserver
+import threading
+import xmlrpc.client
+from urllib.parse import urlsplit
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+from sarena import pack_percepts, unpack_percepts
+
+HELLO = b"SARENA/1\r\n"
+HELLO_TIMEOUT = 5.0  # seconds to wait for the first byte of a connection
+
+OP_PLAY = 1
+OP_START_SESSION = 2
+OP_PLAY_SESSION = 3
+OP_GET_METRICS = 4
+
+STATUS_OK = 0
+STATUS_NONE = 1
+STATUS_ERROR = 2
+
+FRAME_HEADER = struct.Struct(">I")
+PLAY_HEADER = struct.Struct(">BHd")
+ACTION = struct.Struct(">4b")
+OPT_ACTION = struct.Struct(">B4b")
+DIGEST = struct.Struct(">Q")
+
+
+class ProtocolError(Exception):
+    """Raised when the peer does not follow the binary protocol."""
+
+
+def read_exactly(read, n):
+    """Read exactly n bytes with the read function or raise EOFError."""
+    data = read(n)
+    if len(data) < n:
+        raise EOFError("connection closed by peer")
+    return data
+
+
+def read_frame(read):
+    """Read a frame and return its payload, or None on a clean EOF.
+
+    read must block until all requested bytes are available, as the read
+    method of a buffered socket file does.
+
+    """
+    header = read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("connection closed by peer")
+    length, = FRAME_HEADER.unpack(header)
+    return read_exactly(read, length)
+
+
+def frame(payload):
+    """Return payload framed with its length."""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_time(time_left):
+    return math.nan if time_left is None else time_left
+
+
+def decode_time(t):
+    return None if math.isnan(t) else t
+
+
+def encode_action(action):
+    if action is None:
+        return bytes((STATUS_NONE,))
+    return bytes((STATUS_OK,)) + ACTION.pack(*action)
+
+
+def decode_action(payload):
+    if payload[0] == STATUS_NONE:
+        return None
+    return list(ACTION.unpack_from(payload, 1))
+
+
+def encode_digest(digest):
+    return DIGEST.pack(int(digest, 16))
+
+
+def decode_digest(payload, offset):
+    return "%016x" % DIGEST.unpack_from(payload, offset)
+
+
+class BinaryRequestHandler(SimpleXMLRPCRequestHandler):
+
+    """Request handler serving both XML-RPC and the binary protocol.
+
+    The first bytes sent by the client decide which protocol is spoken on
+    the connection.
+
+    """
+
+    def handle(self):
+        if not self._is_binary():
+            return super().handle()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.rfile.read(len(HELLO)) != HELLO:
+            return
+        self.wfile.write(HELLO)
+        self.wfile.flush()
+        player = self.server.instance
+        while True:
+            try:
+                payload = read_frame(self.rfile.read)
+            except EOFError:
+                return
+            if payload is None:
+                return
+            try:
+                with self.server.lock:
+                    reply = self.dispatch_binary(player, payload)
+            except Exception as e:
+                reply = bytes((STATUS_ERROR,)) + \
+                    ("%s:%s" % (type(e).__name__, e)).encode("utf-8")
+            self.wfile.write(frame(reply))
+            self.wfile.flush()
+
+    def _is_binary(self):
+        """Peek at the first byte to find whether the client sends HELLO.
+
+        No HTTP request line starts like HELLO, so one byte is enough. The
+        peek blocks until the client sends it, or for HELLO_TIMEOUT seconds
+        after which the connection is left to XML-RPC.
+
+        """
+        self.request.settimeout(HELLO_TIMEOUT)
+        try:
+            first = self.request.recv(1, socket.MSG_PEEK)
+        except socket.timeout:
+            return False
+        finally:
+            self.request.settimeout(self.timeout)
+        return first == HELLO[:1]
+
+    def dispatch_binary(self, player, payload):
+        """Execute the request in payload and return the reply payload."""
+        op = payload[0]
+        if op == OP_PLAY:
+            _, step, t = PLAY_HEADER.unpack_from(payload)
+            percepts = unpack_percepts(payload, PLAY_HEADER.size)
+            return encode_action(player.play(percepts, step, decode_time(t)))
+        if op == OP_START_SESSION:
+            digest = player.start_session(unpack_percepts(payload, 1))
+            return bytes((STATUS_OK,)) + encode_digest(digest)
+        if op == OP_PLAY_SESSION:
+            _, step, t = PLAY_HEADER.unpack_from(payload)
+            flag, *action = OPT_ACTION.unpack_from(payload, PLAY_HEADER.size)
+            action, digest = player.play_session(action if flag else None,
+                                                 step, decode_time(t))
+            return encode_action(action) + encode_digest(digest)
+        if op == OP_GET_METRICS:
+            return bytes((STATUS_OK,)) + \
+                json.dumps(player.get_metrics()).encode("utf-8")
+        raise ProtocolError("unknown opcode %d" % op)
+
+
+class BinaryXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+
+    """XML-RPC server also accepting the binary protocol.
+
+    Each connection has its own thread since a binary connection stays open
+    for the whole game. The calls to the player, binary or XML-RPC, are
+    serialized by a lock so that a player is never run by two threads.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, addr):
+        SimpleXMLRPCServer.__init__(self, addr,
+                                    requestHandler=BinaryRequestHandler)
+        self.lock = threading.Lock()
+
+    def _dispatch(self, method, params):
+        with self.lock:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+
+
+class BinaryPlayerProxy:
+
+    """Proxy for a remote player speaking the binary protocol.
+
+    It follows socket.getdefaulttimeout() on every call like the XML-RPC
+    proxy does, so that the referee's time credit handling is unchanged.
+
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.rfile = None
+
+    def connect(self, timeout=5.0):
+        """Open the connection and negotiate the protocol.
+
+        Raise ProtocolError if the server does not speak the binary protocol.
+
+        """
+        sock = socket.create_connection((self.host, self.port), timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(HELLO)
+            rfile = sock.makefile("rb")
+            reply = rfile.read(len(HELLO))
+            if reply != HELLO:
+                raise ProtocolError("server does not speak the binary protocol")
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+        self.rfile = rfile
+
+    def close(self):
+        """Close the connection. It is reopened on the next call."""
+        if self.sock is not None:
+            self.rfile.close()
+            self.sock.close()
+            self.sock = None
+            self.rfile = None
+
+    def call(self, payload):
+        """Send a request payload and return the reply payload."""
+        if self.sock is None:
+            self.connect()
+        self.sock.settimeout(socket.getdefaulttimeout())
+        try:
+            self.sock.sendall(frame(payload))
+            reply = read_frame(self.rfile.read)
+            if reply is None:
+                raise EOFError("connection closed by peer")
+        except (OSError, EOFError) as e:
+            # the stream is in an unknown state, start afresh next time
+            self.close()
+            if isinstance(e, EOFError):
+                raise ConnectionResetError(str(e))
+            raise
+        if reply[0] == STATUS_ERROR:
+            raise xmlrpc.client.Fault(1, reply[1:].decode("utf-8", "replace"))
+        return reply
+
+    def play(self, percepts, step, time_left):
+        payload = PLAY_HEADER.pack(OP_PLAY, step, encode_time(time_left)) + \
+            pack_percepts(percepts)
+        return decode_action(self.call(payload))
+
+    def start_session(self, percepts):
+        reply = self.call(bytes((OP_START_SESSION,)) + pack_percepts(percepts))
+        return decode_digest(reply, 1)
+
+    def play_session(self, action, step, time_left):
+        payload = PLAY_HEADER.pack(OP_PLAY_SESSION, step,
+                                   encode_time(time_left))
+        if action is None:
+            payload += OPT_ACTION.pack(0, 0, 0, 0, 0)
+        else:
+            payload += OPT_ACTION.pack(1, *action)
+        reply = self.call(payload)
+        return [decode_action(reply), decode_digest(reply, len(reply) - DIGEST.size)]
+
+    def get_metrics(self):
+        reply = self.call(bytes((OP_GET_METRICS,)))
+        return json.loads(reply[1:].decode("utf-8"))
+
+
+def connect(uri, binary=True):
+    """Connect to a remote player and return a proxy for the Player object.
+
+    If binary is True, try the binary protocol first and fall back to
+    XML-RPC if the server does not support it or cannot be reached now.
+
+    """
+    if binary:
+        parts = urlsplit(uri)
+        if parts.scheme == "http" and parts.hostname:
+            proxy = BinaryPlayerProxy(parts.hostname, parts.port or 80)
+            try:
+                proxy.connect()
+                return proxy
+            except (OSError, EOFError, ProtocolError):
+                pass
+    return xmlrpc.client.ServerProxy(uri, allow_none=True)